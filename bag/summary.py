@@ -0,0 +1,109 @@
+from decimal import Decimal
+
+from django.utils.functional import cached_property
+
+from checkout.models import DELIVERY_FLAT, FREE_DELIVERY_THRESHOLD
+from cwh_site import timing
+from products.models import Product
+
+
+class BagSummary:
+    """
+    Lines and totals for a bag dict ({product_id: qty}), or for a
+    callable returning one so even the session read can be deferred.
+    Nothing is read or queried until the first attribute is used, and
+    then only once: one product query, one pass over the lines.
+    """
+
+    free_threshold = FREE_DELIVERY_THRESHOLD
+
+    def __init__(self, bag):
+        self._bag = bag
+
+    def __bool__(self):
+        return bool(self.items)
+
+    @cached_property
+    def bag(self):
+        bag = self._bag() if callable(self._bag) else self._bag
+        return bag if isinstance(bag, dict) else {}
+
+    @cached_property
+    def items(self):
+        if not self.bag:
+            return []
+        with timing.phase('bag'):
+            return self._lines()
+
+    def _lines(self):
+        product_ids = [int(pid) for pid in self.bag if str(pid).isdigit()]
+        products = {
+            p.id: p for p in Product.objects.filter(id__in=product_ids)
+        }
+
+        items = []
+        for pid_str, qty in self.bag.items():
+            product = products.get(int(pid_str)) if str(
+                pid_str).isdigit() else None
+            if not product:
+                continue
+            qty = int(qty)
+            price = product.price or Decimal('0.00')
+            items.append({
+                'product': product,
+                'name': product.name,
+                'slug': product.slug,
+                'qty': qty,
+                'price': price,
+                'line_total': price * qty,
+                'thumb_url': product.primary_image_url,
+                'image_url': product.primary_image_url or None,
+                'image_alt': product.primary_image_alt or product.name,
+                'image_derivatives': product.primary_image_derivatives,
+            })
+        return items
+
+    @cached_property
+    def item_count(self):
+        return sum(item['qty'] for item in self.items)
+
+    @cached_property
+    def order_total(self):
+        return sum(
+            (item['line_total'] for item in self.items), Decimal('0.00'))
+
+    @cached_property
+    def delivery_cost(self):
+        if self.order_total >= FREE_DELIVERY_THRESHOLD:
+            return Decimal('0.00')
+        return DELIVERY_FLAT if self.order_total > 0 else Decimal('0.00')
+
+    @cached_property
+    def grand_total(self):
+        return self.order_total + self.delivery_cost
+
+    @cached_property
+    def remaining_to_free(self):
+        if self.order_total < FREE_DELIVERY_THRESHOLD:
+            return FREE_DELIVERY_THRESHOLD - self.order_total
+        return Decimal('0.00')
+
+
+def _session_bag(request):
+    # No session cookie means no bag; checking the key doesn't load
+    # the session or mark it accessed (which would add Vary: Cookie)
+    if request.session.session_key is None:
+        return {}
+    return request.session.get('bag', {})
+
+
+def get_bag_summary(request):
+    """
+    The BagSummary for this request's session bag, memoised on the
+    request so views and the mini_bag context processor share it.
+    """
+    summary = getattr(request, '_bag_summary', None)
+    if summary is None:
+        summary = BagSummary(lambda: _session_bag(request))
+        request._bag_summary = summary
+    return summary
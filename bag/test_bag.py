@@ -1,8 +1,11 @@
 from decimal import Decimal
 
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, TestCase
 from django.urls import reverse
 
+from bag.context_processors import mini_bag
 from products.models import Product
 
 
@@ -90,3 +93,57 @@ class BagViewTests(TestCase):
         self.assertContains(response, "Your bag is empty.")
         # We no longer assert that 'Test Item' is absent, because it is
         # still present in toast messages, which is expected behaviour.
+
+
+class BagSummaryQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="shopper")
+        self.client.force_login(self.user)
+        session = self.client.session
+        session["bag"] = {
+            str(Product.objects.create(
+                name=f"Item {i}", price=Decimal("10.00")).id): i + 1
+            for i in range(5)
+        }
+        session.save()
+
+    def test_bag_page_queries_products_once(self):
+        """
+        The bag view and the mini bag in the navbar share one summary:
+        session + user + a single product query.
+        """
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("bag:view_bag"))
+        self.assertEqual(response.context["total_qty"], 15)
+        self.assertEqual(response.context["bag_item_count"], 15)
+        self.assertEqual(response.context["subtotal"], Decimal("150.00"))
+
+
+class MiniBagLazinessTests(TestCase):
+    def test_anonymous_page_skips_session_and_db(self):
+        """
+        With no session cookie the navbar badge renders without loading
+        the session or querying products.
+        """
+        request = RequestFactory().get("/")
+        request.session = SessionStore()
+        context = mini_bag(request)
+        with self.assertNumQueries(0):
+            self.assertEqual(context["bag_item_count"], 0)
+            self.assertEqual(list(context["mini_bag_items"]), [])
+        self.assertFalse(request.session.accessed)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/no-such-page/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_values_are_only_computed_when_used(self):
+        product = Product.objects.create(name="Item", price=Decimal("4.00"))
+        session = self.client.session
+        session["bag"] = {str(product.id): 2}
+        session.save()
+        response = self.client.get(reverse("bag:view_bag"))
+        context = response.context
+        self.assertEqual(context["bag_item_count"], 2)
+        self.assertEqual(context["bag_order_total"], Decimal("8.00"))
+        self.assertEqual(len(context["mini_bag_items"]), 1)
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Order, OrderLineItem
+from .models import (
+    EmailOutbox, Order, OrderLineItem, StockReservation, WebhookEvent)
 
 
 class OrderLineItemInLine(admin.TabularInline):
@@ -21,3 +22,32 @@ class OrderAdmin(admin.ModelAdmin):
 
 
 admin.site.register(OrderLineItem)
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'kind', 'order', 'status', 'attempts',
+        'next_attempt_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    list_select_related = ('order',)
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = (
+        'event_id', 'type', 'status', 'attempts', 'received_at',
+        'processed_at')
+    list_filter = ('status', 'type')
+    search_fields = ('event_id',)
+    readonly_fields = ('received_at', 'processed_at', 'last_error')
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = (
+        'payment_intent', 'product', 'quantity', 'expires_at', 'created_at')
+    list_select_related = ('product',)
+    search_fields = ('payment_intent', 'product__name')
+    readonly_fields = ('created_at',)
@@ -13,7 +13,8 @@ def _render_first(paths, ctx):
     return None
 
 
-def send_order_confirmation(order):
+def build_order_confirmation(order, connection=None):
+    """The confirmation message for ``order``, ready to send."""
     ctx = {
         "order": order,
         "items": order.lineitems.select_related("product").all()
@@ -53,7 +54,23 @@ def send_order_confirmation(order):
         bcc=(
             [settings.SHOP_OWNER_EMAIL] if getattr(
                 settings, "SHOP_OWNER_EMAIL", "") else None),
+        connection=connection,
     )
     if html:
         msg.attach_alternative(html, "text/html")
-    msg.send(fail_silently=False)
+    return msg
+
+
+def send_order_confirmation(order):
+    """Build and send the confirmation now (bypassing the outbox)."""
+    build_order_confirmation(order).send(fail_silently=False)
+
+
+def queue_order_confirmation(order):
+    """
+    Queue the confirmation for the send_outbox worker. Call it inside
+    the transaction that creates the order.
+    """
+    from .models import EmailOutbox
+    return EmailOutbox.objects.create(
+        kind=EmailOutbox.ORDER_CONFIRMATION, order=order)
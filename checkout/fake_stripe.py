@@ -0,0 +1,319 @@
+"""
+Offline stand-ins for Stripe.
+
+``FakeStripe`` is an in-memory store that mirrors the parts of the
+``stripe`` SDK checkout uses (PaymentIntent create/modify/retrieve and
+the error classes); every call is recorded in ``fake.calls``.
+
+``FakeStripeServer`` serves the same store over HTTP in Stripe's REST
+shape, so the real SDK, and ``checkout.payments``, can talk to it by
+pointing ``STRIPE_API_BASE`` at ``server.url``::
+
+    with FakeStripeServer(webhook_url=..., webhook_secret=...) as server:
+        ...
+        server.fake.confirm(intent_id)  # pays and delivers the webhook
+
+``sign_payload`` produces a valid ``Stripe-Signature`` header for a
+webhook body, and ``confirm`` delivers a signed
+``payment_intent.succeeded`` event when a webhook URL is configured.
+POSTs retried with the same ``Idempotency-Key`` are replayed, as on
+Stripe.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import secrets
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+
+class StripeObject(dict):
+    """A dict with attribute access, like ``stripe.StripeObject``."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class _Errors:
+    class StripeError(Exception):
+        pass
+
+    class InvalidRequestError(StripeError):
+        pass
+
+    class SignatureVerificationError(StripeError):
+        pass
+
+
+class _PaymentIntents:
+    # Intents in these states can no longer change amount
+    FINAL = {"succeeded", "canceled", "processing"}
+
+    def __init__(self, fake):
+        self._fake = fake
+        self._ids = itertools.count(1)
+
+    def _get(self, intent_id):
+        try:
+            return self._fake.intents[intent_id]
+        except KeyError:
+            raise _Errors.InvalidRequestError(
+                f"No such payment_intent: '{intent_id}'") from None
+
+    def create(self, amount, currency, metadata=None, **kwargs):
+        intent_id = f"pi_{self._fake.id_prefix}{next(self._ids):06d}"
+        intent = StripeObject(
+            id=intent_id,
+            object="payment_intent",
+            amount=amount,
+            currency=currency,
+            status="requires_payment_method",
+            metadata=StripeObject(metadata or {}),
+            client_secret=f"{intent_id}_secret_{secrets.token_hex(8)}",
+        )
+        self._fake.intents[intent_id] = intent
+        self._fake.calls.append(("PaymentIntent.create", intent_id))
+        return StripeObject(intent)
+
+    def modify(self, intent_id, metadata=None, **fields):
+        self._fake.calls.append(("PaymentIntent.modify", intent_id))
+        intent = self._get(intent_id)
+        if "amount" in fields and intent["status"] in self.FINAL:
+            raise _Errors.InvalidRequestError(
+                "This PaymentIntent's amount could not be updated because "
+                f"it has a status of {intent['status']}.")
+        intent.update(fields)
+        if metadata:
+            intent["metadata"] = StripeObject(
+                {**intent["metadata"], **metadata})
+        return StripeObject(intent)
+
+    def retrieve(self, intent_id, **kwargs):
+        self._fake.calls.append(("PaymentIntent.retrieve", intent_id))
+        return StripeObject(self._get(intent_id))
+
+
+def sign_payload(payload, secret, timestamp=None):
+    """A Stripe-Signature header value for a webhook body."""
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256,
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+class FakeStripe:
+    error = _Errors
+
+    def __init__(self, webhook_url=None, webhook_secret="", id_prefix="fake"):
+        # Vary id_prefix to keep ids unique across runs on one database
+        self.id_prefix = id_prefix
+        self.api_key = ""
+        self.intents = {}
+        self.calls = []
+        self.replies = {}
+        self.PaymentIntent = _PaymentIntents(self)
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self._event_ids = itertools.count(1)
+
+    def confirm(self, intent_id, status="succeeded"):
+        """
+        Complete a payment, as the shopper's browser would, and deliver
+        the payment_intent.succeeded webhook if a URL is configured.
+        """
+        intent = self.intents[intent_id]
+        intent["status"] = status
+        if status == "succeeded" and self.webhook_url:
+            self.deliver(self.event("payment_intent.succeeded", intent))
+        return intent
+
+    def event(self, event_type, obj):
+        return {
+            "id": f"evt_{self.id_prefix}{next(self._event_ids):06d}",
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "livemode": False,
+            "data": {"object": dict(obj)},
+        }
+
+    def deliver(self, event):
+        """POST a signed event to the webhook URL; returns the status."""
+        payload = json.dumps(event)
+        request = urllib.request.Request(
+            self.webhook_url,
+            data=payload.encode(),
+            headers={
+                "Content-Type": "application/json",
+                "Stripe-Signature": sign_payload(
+                    payload, self.webhook_secret),
+            },
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+
+    def count(self, method):
+        return sum(1 for name, _ in self.calls if name == method)
+
+
+def _unflatten(pairs):
+    """Stripe's form encoding (metadata[key]=v) back into dicts."""
+    params = {}
+    for key, value in pairs:
+        if "[" in key:
+            outer, inner = key.split("[", 1)
+            params.setdefault(outer, {})[inner.rstrip("]")] = value
+        else:
+            params[key] = value
+    if "amount" in params:
+        params["amount"] = int(params["amount"])
+    return params
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeStripe/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Request-Id", f"req_{secrets.token_hex(6)}")
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up
+            pass
+
+    def _params(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode() if length else ""
+        return _unflatten(parse_qsl(body, keep_blank_values=True))
+
+    def _dispatch(self, method):
+        server = self.server
+        # Bound now, so a slow request can't land in a reset() store
+        fake = server.fake
+        if server.latency:
+            time.sleep(server.latency)
+        with server.lock:
+            if server.failures:
+                server.failures -= 1
+                return self._reply(500, {"error": {
+                    "type": "api_error", "message": "Injected failure"}})
+
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts[:2] != ["v1", "payment_intents"] or len(parts) > 4:
+            return self._reply(404, {"error": {
+                "type": "invalid_request_error",
+                "message": f"Unrecognized request URL ({self.path})"}})
+
+        # Replay POSTs retried with the same Idempotency-Key, like Stripe
+        idempotency_key = self.headers.get("Idempotency-Key")
+        if method == "POST" and idempotency_key in fake.replies:
+            return self._reply(200, fake.replies[idempotency_key])
+
+        intents = fake.PaymentIntent
+        try:
+            with server.lock:
+                if method == "POST" and len(parts) == 2:
+                    params = self._params()
+                    result = intents.create(
+                        params.pop("amount"), params.pop("currency"),
+                        **params)
+                elif method == "POST" and len(parts) == 3:
+                    result = intents.modify(parts[2], **self._params())
+                elif method == "GET" and len(parts) == 3:
+                    result = intents.retrieve(parts[2])
+                elif method == "POST" and parts[3] == "confirm":
+                    intents.retrieve(parts[2])
+                    result = None
+                else:
+                    return self._reply(405, {"error": {
+                        "type": "invalid_request_error",
+                        "message": "Method not allowed"}})
+            if result is None:
+                # Outside the lock: delivery calls back into the site
+                result = fake.confirm(parts[2])
+        except _Errors.InvalidRequestError as e:
+            status = 404 if "No such" in str(e) else 400
+            return self._reply(status, {"error": {
+                "type": "invalid_request_error", "message": str(e)}})
+        if method == "POST" and idempotency_key:
+            fake.replies[idempotency_key] = result
+        return self._reply(200, result)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+class FakeStripeServer:
+    """
+    ``FakeStripe`` over HTTP on a local port, in a background thread.
+    ``latency`` (seconds) is added to every request; ``fail(n)`` makes
+    the next ``n`` requests return 500, to exercise client retries.
+    """
+
+    def __init__(self, fake=None, host="127.0.0.1", port=0, latency=0.0,
+                 webhook_url=None, webhook_secret=""):
+        self.fake = fake or FakeStripe(
+            webhook_url=webhook_url, webhook_secret=webhook_secret)
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self.fake
+        self.httpd.lock = threading.Lock()
+        self.httpd.latency = latency
+        self.httpd.failures = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset(self):
+        """Start again with an empty store (e.g. between tests)."""
+        fake = FakeStripe(
+            webhook_url=self.fake.webhook_url,
+            webhook_secret=self.fake.webhook_secret,
+            id_prefix=self.fake.id_prefix)
+        self.fake = self.httpd.fake = fake
+        self.httpd.latency = 0.0
+        self.fail(0)
+        return fake
+
+    def fail(self, n=1):
+        with self.httpd.lock:
+            self.httpd.failures = n
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
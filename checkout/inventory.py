@@ -0,0 +1,183 @@
+"""
+Stock reservations.
+
+``Product.stock`` is what is on the shelf and ``Product.reserved`` how
+much of it is held for PaymentIntents that haven't been paid yet;
+products with ``stock=None`` aren't tracked and are skipped. Every
+change is a single conditional UPDATE with ``F()`` expressions, so the
+check and the write are one statement and two buyers can't both take
+the last item::
+
+    UPDATE products_product SET reserved = reserved + 2
+     WHERE id = 7 AND stock >= reserved + 2
+
+No row updated means not enough stock. Products are always updated in
+id order, so two checkouts holding the same products can't deadlock.
+
+``reserve`` runs when checkout creates or updates a PaymentIntent,
+``commit`` turns the hold into a sale inside OrderBuilder's
+transaction, and ``release_expired`` (the worker, or the
+release_reservations command) puts abandoned holds back on sale.
+``reserve`` also releases lapsed holds on the products it wants, so a
+sweep that hasn't run yet never makes stock look sold out.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from products.models import Product
+from .models import StockReservation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = timedelta(minutes=15)
+
+
+class OutOfStock(Exception):
+    def __init__(self, product, available):
+        self.product = product
+        self.available = available
+        if available:
+            message = f"Sorry, only {available} of {product.name} left."
+        else:
+            message = f"Sorry, {product.name} is out of stock."
+        super().__init__(message)
+
+
+def _ttl():
+    minutes = getattr(settings, "STOCK_RESERVATION_MINUTES", None)
+    return DEFAULT_TTL if minutes is None else timedelta(minutes=minutes)
+
+
+def _tracked(lines):
+    """{product_id: qty} for the tracked products in (product, qty)s."""
+    quantities = {}
+    for product, qty in lines:
+        if product.stock is not None and qty > 0:
+            quantities[product.pk] = quantities.get(product.pk, 0) + qty
+    return quantities
+
+
+def _give_back(rows):
+    """Return reserved quantities for ``rows`` to their products."""
+    held = {}
+    for row in rows:
+        held[row.product_id] = held.get(row.product_id, 0) + row.quantity
+    for product_id in sorted(held):
+        Product.objects.filter(pk=product_id).update(
+            reserved=Greatest(F("reserved") - held[product_id], 0))
+
+
+def reserve(intent_id, lines):
+    """
+    Hold stock for ``lines`` ([(product, qty)], e.g. from a BagSummary)
+    against ``intent_id``, replacing whatever it held before. Raises
+    OutOfStock, holding nothing, if any product is short. Returns when
+    the hold expires.
+    """
+    quantities = _tracked(lines)
+    expires_at = timezone.now() + _ttl()
+    with transaction.atomic():
+        previous = list(
+            StockReservation.objects.select_for_update()
+            .filter(payment_intent=intent_id))
+        # Lapsed holds on these products, whether or not the
+        # release_reservations sweep has run, mustn't block this one
+        lapsed = []
+        if quantities:
+            lapsed = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(
+                    product_id__in=quantities,
+                    expires_at__lte=timezone.now())
+                .exclude(payment_intent=intent_id))
+        if previous or lapsed:
+            _give_back(previous + lapsed)
+            StockReservation.objects.filter(
+                pk__in=[r.pk for r in previous + lapsed]).delete()
+
+        for product_id in sorted(quantities):
+            qty = quantities[product_id]
+            held = Product.objects.filter(
+                pk=product_id, stock__gte=F("reserved") + qty,
+            ).update(reserved=F("reserved") + qty)
+            if not held:
+                product = Product.objects.get(pk=product_id)
+                # Leaves the atomic block, undoing this call's holds
+                raise OutOfStock(product, product.available)
+
+        StockReservation.objects.bulk_create([
+            StockReservation(
+                payment_intent=intent_id, product_id=product_id,
+                quantity=qty, expires_at=expires_at)
+            for product_id, qty in quantities.items()
+        ])
+    return expires_at
+
+
+def commit(intent_id, lines):
+    """
+    Take ``lines`` out of stock for a paid order, consuming the
+    intent's hold. Call inside the order's transaction. A line whose
+    hold has lapsed is still taken if the stock is there; if it isn't,
+    the payment has already been made, so the order stands, stock
+    bottoms out at zero and the oversell is logged.
+    """
+    quantities = _tracked(lines)
+    held = {}
+    if intent_id:
+        rows = list(
+            StockReservation.objects.select_for_update()
+            .filter(payment_intent=intent_id))
+        for row in rows:
+            held[row.product_id] = held.get(row.product_id, 0) + row.quantity
+        if rows:
+            StockReservation.objects.filter(
+                pk__in=[r.pk for r in rows]).delete()
+
+    for product_id in sorted(quantities.keys() | held.keys()):
+        qty = quantities.get(product_id, 0)
+        products = Product.objects.filter(
+            pk=product_id, stock__isnull=False)
+        if held.get(product_id):
+            products.update(
+                stock=Greatest(F("stock") - qty, 0),
+                reserved=Greatest(F("reserved") - held[product_id], 0))
+        elif not products.filter(stock__gte=F("reserved") + qty).update(
+                stock=F("stock") - qty):
+            if products.update(stock=Greatest(F("stock") - qty, 0)):
+                logger.warning(
+                    "Oversold product %s by up to %s for %s",
+                    product_id, qty, intent_id or "an order")
+
+
+def release(intent_id):
+    """Drop the intent's hold, e.g. when checkout is abandoned."""
+    with transaction.atomic():
+        rows = list(
+            StockReservation.objects.select_for_update()
+            .filter(payment_intent=intent_id))
+        _give_back(rows)
+        StockReservation.objects.filter(pk__in=[r.pk for r in rows]).delete()
+
+
+def release_expired(batch_size=500):
+    """Put expired holds back on sale. Returns how many were released."""
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=timezone.now())
+                .order_by("expires_at", "id")[:batch_size])
+            if not rows:
+                return released
+            _give_back(rows)
+            StockReservation.objects.filter(
+                pk__in=[r.pk for r in rows]).delete()
+        released += len(rows)
@@ -0,0 +1,85 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from bag.summary import BagSummary
+from checkout.models import Order, OrderLineItem
+from checkout.orders import OrderBuilder
+from products.models import Product
+
+DETAILS = {
+    "full_name": "Bench Mark", "email": "bench@example.com",
+    "phone_number": "0", "address1": "1 Test St", "city": "Town",
+    "postcode": "AB1 2CD", "country": "GB",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time OrderBuilder against the old per-line create() path for a "
+        "bag of --lines products. All data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lines", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            products = Product.objects.bulk_create([
+                Product(
+                    name=f"Bench {i}", slug=f"bench-order-{i}",
+                    price=Decimal("9.99"))
+                for i in range(options["lines"])
+            ])
+            bag = {str(p.pk): 2 for p in products}
+
+            legacy, legacy_queries = self._time(
+                lambda n: self._legacy(bag, f"pi_legacy_{n}"),
+                options["repeat"])
+            builder, builder_queries = self._time(
+                lambda n: OrderBuilder(
+                    bag, DETAILS, stripe_pid=f"pi_builder_{n}").build(),
+                options["repeat"])
+
+            self.stdout.write(
+                f"{options['lines']} lines, median of {options['repeat']}:")
+            self.stdout.write(
+                f"  per-line create: {legacy:8.1f} ms "
+                f"{legacy_queries:4} queries")
+            self.stdout.write(
+                f"  OrderBuilder:    {builder:8.1f} ms "
+                f"{builder_queries:4} queries")
+            self.stdout.write(f"  speed-up: {legacy / builder:.1f}x")
+            transaction.set_rollback(True)
+
+    def _time(self, create, repeat):
+        timings = []
+        for n in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                create(n)
+                timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings), len(queries)
+
+    def _legacy(self, bag, stripe_pid):
+        """The order creation path as it was before OrderBuilder."""
+        summary = BagSummary(bag)
+        order = Order.objects.create(
+            **DETAILS,
+            order_total=summary.order_total,
+            delivery_cost=summary.delivery_cost,
+            grand_total=summary.grand_total,
+            stripe_pid=stripe_pid,
+        )
+        for item in summary.items:
+            OrderLineItem.objects.create(
+                order=order,
+                product=item["product"],
+                quantity=item["qty"],
+            )
+        return order
@@ -0,0 +1,260 @@
+import json
+import re
+import secrets
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from checkout import webhooks
+from checkout.fake_stripe import FakeStripe, FakeStripeServer, sign_payload
+from checkout.models import Order, WebhookEvent
+from products.models import Category, Product
+
+PREFIX = "loadtest"
+WEBHOOK_SECRET = "whsec_loadtest"
+CLIENT_SECRET = re.compile(r'data-client-secret="([^"]+)"')
+
+DETAILS = {
+    "full_name": "Load Test", "email": "load@example.com",
+    "phone_number": "0", "address1": "1 Test St", "city": "Town",
+    "postcode": "AB1 2CD", "country": "GB",
+}
+
+STEPS = [
+    "add_to_bag", "checkout", "cache_checkout_data", "stripe_webhook",
+    "checkout_paid", "order_status",
+]
+
+
+class Recorder:
+    """(ms, queries, ok) samples per step, from many threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {step: [] for step in STEPS}
+
+    def add(self, step, ms, queries, ok):
+        with self._lock:
+            self.samples[step].append((ms, queries, ok))
+
+
+def percentile(sorted_values, pct):
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    return statistics.quantiles(
+        sorted_values, n=100, method="inclusive")[pct - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive --shoppers concurrent simulated shoppers through bag -> "
+        "checkout -> cache_checkout_data -> webhook -> checkout_paid "
+        "in-process through the WSGI app, with Stripe replaced by a "
+        "local FakeStripeServer. Reports p50/p95/p99 latency, "
+        "throughput and queries per step. Writes to the configured "
+        "database; the seeded products and orders are deleted "
+        "afterwards unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shoppers", type=int, default=8)
+        parser.add_argument(
+            "--checkouts", type=int, default=5,
+            help="Checkouts per shopper.")
+        parser.add_argument("--products", type=int, default=50)
+        parser.add_argument(
+            "--stock", type=int, default=None,
+            help="Stock per product (default: not tracked).")
+        parser.add_argument(
+            "--stripe-latency", type=float, default=0.0,
+            help="Seconds added to every fake Stripe API call.")
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args, **options):
+        products = self._seed(options["products"], options["stock"])
+        recorder = Recorder()
+        server = FakeStripeServer(
+            FakeStripe(id_prefix=f"{PREFIX}{secrets.token_hex(3)}"),
+            latency=options["stripe_latency"]).start()
+        done = threading.Event()
+        self.worker_errors = 0
+        try:
+            with override_settings(
+                ALLOWED_HOSTS=["testserver"],
+                STRIPE_API_BASE=server.url,
+                STRIPE_SECRET_KEY="sk_test_loadtest",
+                STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                CHECKOUT_FINALISE_TIMEOUT=30,
+                # Runs without collectstatic's manifest
+                STORAGES={**settings.STORAGES, "staticfiles": {
+                    "BACKEND": "django.contrib.staticfiles.storage."
+                               "StaticFilesStorage"}},
+            ):
+                worker = threading.Thread(
+                    target=self._webhook_worker, args=(done,), daemon=True)
+                worker.start()
+                started = time.perf_counter()
+                with ThreadPoolExecutor(options["shoppers"]) as pool:
+                    completed = sum(pool.map(
+                        lambda n: self._shopper(
+                            n, products, server.fake, recorder,
+                            options["checkouts"]),
+                        range(options["shoppers"])))
+                elapsed = time.perf_counter() - started
+                done.set()
+                worker.join()
+        finally:
+            server.stop()
+            if not options["keep"]:
+                self._clean_up()
+
+        self._report(recorder, completed, elapsed, options)
+
+    def _seed(self, count, stock):
+        self._clean_up()
+        category = Category.objects.create(
+            name=f"{PREFIX} category", slug=f"{PREFIX}-category")
+        return Product.objects.bulk_create([
+            Product(
+                name=f"{PREFIX} product {i}", slug=f"{PREFIX}-product-{i}",
+                category=category, price=Decimal("12.50"), stock=stock)
+            for i in range(count)
+        ])
+
+    def _clean_up(self):
+        Order.objects.filter(email=DETAILS["email"]).delete()
+        WebhookEvent.objects.filter(
+            event_id__startswith=f"evt_{PREFIX}").delete()
+        Product.objects.filter(slug__startswith=f"{PREFIX}-").delete()
+        Category.objects.filter(slug=f"{PREFIX}-category").delete()
+
+    def _webhook_worker(self, done):
+        """
+        The process_webhooks worker, polling alongside the shoppers.
+        Database errors (e.g. SQLite's "database is locked") are counted
+        and the batch is retried, as a supervised worker would be.
+        """
+        try:
+            while not done.is_set():
+                try:
+                    busy = any(webhooks.process_pending(batch_size=50))
+                except DatabaseError:
+                    self.worker_errors += 1
+                    busy = False
+                if not busy:
+                    time.sleep(0.02)
+        finally:
+            connection.close()
+
+    def _request(self, recorder, step, send, ok_status=(200, 302)):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = send()
+            ms = (time.perf_counter() - started) * 1000
+        ok = response.status_code in ok_status
+        recorder.add(step, ms, len(queries), ok)
+        return response if ok else None
+
+    def _shopper(self, n, products, fake, recorder, checkouts):
+        """One shopper's checkouts; returns how many completed."""
+        client = Client(raise_request_exception=False)
+        completed = 0
+        try:
+            for i in range(checkouts):
+                product = products[(n * checkouts + i) % len(products)]
+                if self._checkout(client, product, fake, recorder):
+                    completed += 1
+        finally:
+            connection.close()
+        return completed
+
+    def _checkout(self, client, product, fake, recorder):
+        if not self._request(
+                recorder, "add_to_bag", lambda: client.post(
+                    reverse("bag:add_to_bag", args=[product.pk]),
+                    {"quantity": 1, "redirect_url": "/"})):
+            return False
+
+        response = self._request(
+            recorder, "checkout",
+            lambda: client.get(reverse("checkout:checkout")),
+            ok_status=(200,))
+        match = response and CLIENT_SECRET.search(response.content.decode())
+        if not match:
+            return False
+        client_secret = match.group(1)
+        intent_id = client_secret.split("_secret")[0]
+
+        if not self._request(
+                recorder, "cache_checkout_data", lambda: client.post(
+                    reverse("checkout:cache_checkout_data"),
+                    {**DETAILS, "client_secret": client_secret})):
+            return False
+
+        # The shopper pays; Stripe sends the signed webhook
+        intent = fake.confirm(intent_id)
+        payload = json.dumps(fake.event("payment_intent.succeeded", intent))
+        if not self._request(
+                recorder, "stripe_webhook", lambda: Client().post(
+                    reverse("checkout:stripe_webhook"), payload,
+                    content_type="application/json",
+                    HTTP_STRIPE_SIGNATURE=sign_payload(
+                        payload, WEBHOOK_SECRET))):
+            return False
+
+        response = self._request(
+            recorder, "checkout_paid", lambda: client.get(
+                reverse("checkout:checkout_paid"),
+                {"payment_intent_client_secret": client_secret}))
+        if response is None:
+            return False
+        if response.status_code == 302:
+            return True
+
+        # The finalising page: poll until the worker has made the order
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            response = self._request(
+                recorder, "order_status",
+                lambda: client.get(reverse("checkout:order_status")),
+                ok_status=(200,))
+            if response is None:
+                return False
+            if response.json()["status"] == "ready":
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _report(self, recorder, completed, elapsed, options):
+        shoppers, checkouts = options["shoppers"], options["checkouts"]
+        self.stdout.write(
+            f"{shoppers} shoppers x {checkouts} checkouts: {completed} "
+            f"completed in {elapsed:.2f}s "
+            f"({completed / elapsed:.1f} checkouts/s)")
+        if self.worker_errors:
+            self.stdout.write(
+                f"Webhook worker database errors: {self.worker_errors}")
+        self.stdout.write(
+            f"{'step':<20} {'reqs':>5} {'err':>4} {'req/s':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for step, samples in recorder.samples.items():
+            if not samples:
+                continue
+            timings = sorted(ms for ms, _, _ in samples)
+            errors = sum(1 for *_, ok in samples if not ok)
+            queries = statistics.mean(q for _, q, _ in samples)
+            self.stdout.write(
+                f"{step:<20} {len(samples):>5} {errors:>4} "
+                f"{len(samples) / elapsed:>7.1f} "
+                f"{percentile(timings, 50):>8.1f} "
+                f"{percentile(timings, 95):>8.1f} "
+                f"{percentile(timings, 99):>8.1f} {queries:>8.1f}")
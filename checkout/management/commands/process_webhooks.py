@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout import webhooks
+
+
+class Command(BaseCommand):
+    help = (
+        "Process pending Stripe webhook events from the inbox. Safe to "
+        "run several copies in parallel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument(
+            "--max-attempts", type=int, default=webhooks.MAX_ATTEMPTS)
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep running, polling the inbox every --sleep seconds.")
+        parser.add_argument("--sleep", type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        while True:
+            done, failed = webhooks.process_pending(
+                batch_size=options["batch_size"],
+                max_attempts=options["max_attempts"],
+            )
+            total_done += done
+            total_failed += failed
+            if done or failed:
+                # More may be waiting behind this batch
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(
+            f"Processed {total_done}, failed {total_failed}.")
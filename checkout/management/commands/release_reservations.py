@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout import inventory
+
+
+class Command(BaseCommand):
+    help = (
+        "Put stock held for expired, unpaid PaymentIntents back on sale."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep running, checking every --sleep seconds.")
+        parser.add_argument("--sleep", type=float, default=60.0)
+
+    def handle(self, *args, **options):
+        while True:
+            released = inventory.release_expired(
+                batch_size=options["batch_size"])
+            if released or not options["loop"]:
+                self.stdout.write(f"Released {released} reservations.")
+            if not options["loop"]:
+                return
+            time.sleep(options["sleep"])
@@ -0,0 +1,73 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from checkout import inventory, outbox, webhooks
+from products import derivatives
+
+logger = logging.getLogger(__name__)
+
+
+def _webhook_events():
+    """Process the webhook inbox until it's empty; returns how many."""
+    total = 0
+    while True:
+        done, failed = webhooks.process_pending()
+        if not done and not failed:
+            return total
+        total += done + failed
+
+
+def _emails():
+    sent, failed = outbox.drain()
+    return sent + failed
+
+
+def _images():
+    done, failed = derivatives.drain()
+    return done + failed
+
+
+# (name, drain) for every background queue; each drain processes what
+# is due and returns how many items it handled
+QUEUES = [
+    ("webhook events", _webhook_events),
+    ("expired reservations", inventory.release_expired),
+    ("emails", _emails),
+    ("product images", _images),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Run every background queue in one process (the Procfile's "
+        "worker): Stripe webhook events, expired stock reservations, "
+        "the email outbox and product image copies. Each pass drains all "
+        "of them, then sleeps "
+        "--sleep seconds. A queue that raises is logged and tried again "
+        "on the next pass. Safe to run several copies."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sleep", type=float, default=2.0)
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Make one pass and exit instead of looping.")
+
+    def handle(self, *args, **options):
+        while True:
+            for name, drain in QUEUES:
+                try:
+                    handled = drain()
+                except Exception:
+                    logger.exception("Worker queue %s failed", name)
+                    continue
+                if handled:
+                    self.stdout.write(f"{name}: {handled}")
+            if options["once"]:
+                return
+            time.sleep(options["sleep"])
+            # A long-lived process must notice dropped connections
+            close_old_connections()
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from checkout import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued emails from the outbox in batches over one SMTP "
+        "connection, retrying failures with backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument(
+            "--max-attempts", type=int, default=outbox.MAX_ATTEMPTS)
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep running, polling the outbox every --sleep seconds.")
+        parser.add_argument("--sleep", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = outbox.drain(
+                batch_size=options["batch_size"],
+                max_attempts=options["max_attempts"],
+            )
+            if sent or failed or not options["loop"]:
+                self.stdout.write(f"Sent {sent}, failed {failed}.")
+            if not options["loop"]:
+                return
+            time.sleep(options["sleep"])
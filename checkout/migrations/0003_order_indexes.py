@@ -0,0 +1,22 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0002_alter_order_order_number'),
+        ('profiles', '0003_alter_userprofile_phone_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['stripe_pid'], name='order_stripe_pid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user_profile', 'date'], name='order_profile_date_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0005_webhookevent'),
+        ('profiles', '0003_alter_userprofile_phone_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('stripe_pid', ''), _negated=True), fields=('stripe_pid',), name='order_unique_stripe_pid'),
+        ),
+    ]
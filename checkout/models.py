@@ -2,6 +2,7 @@ import uuid
 from django.conf import settings
 from decimal import Decimal
 from django.db import models
+from django.utils import timezone
 from django_countries.fields import CountryField
 from products.models import Product
 
@@ -42,6 +43,23 @@ class Order(models.Model):
     stripe_pid = models.CharField(
         max_length=250, blank=False, null=False, default='')
 
+    class Meta:
+        indexes = [
+            # Webhook and checkout_paid look orders up by PaymentIntent
+            models.Index(fields=['stripe_pid'], name='order_stripe_pid_idx'),
+            # Order history on the profile page
+            models.Index(
+                fields=['user_profile', 'date'],
+                name='order_profile_date_idx'),
+        ]
+        constraints = [
+            # One order per PaymentIntent (see checkout.orders)
+            models.UniqueConstraint(
+                fields=['stripe_pid'],
+                condition=~models.Q(stripe_pid=''),
+                name='order_unique_stripe_pid'),
+        ]
+
     def _generate_order_number(self):
         return uuid.uuid4().hex.upper()
 
@@ -82,3 +100,106 @@ class OrderLineItem(models.Model):
 
     def __str__(self):
         return f'{self.product} x {self.quantity}'
+
+
+class EmailOutbox(models.Model):
+    """
+    Emails waiting to be sent by the send_outbox worker. Rows are
+    written in the same transaction as the order, so a confirmation is
+    never lost and payment handling never waits on SMTP.
+    """
+    ORDER_CONFIRMATION = 'order_confirmation'
+    KIND_CHOICES = [(ORDER_CONFIRMATION, 'Order confirmation')]
+
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    order = models.ForeignKey(
+        Order, null=True, blank=True, on_delete=models.CASCADE,
+        related_name='emails')
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    # Due time while pending; also pushed forward as a lease while a
+    # worker is sending, so a crashed worker's rows come back later
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                condition=models.Q(status='pending'),
+                name='outbox_pending_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} #{self.pk} ({self.status})'
+
+
+class WebhookEvent(models.Model):
+    """
+    Inbox of verified Stripe events. The webhook view only records them
+    (the unique event_id makes Stripe's retries no-ops); the
+    process_webhooks worker does the actual work.
+    """
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'), (PROCESSED, 'Processed'), (FAILED, 'Failed')]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['received_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                condition=models.Q(status='pending'),
+                name='webhook_pending_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.type} {self.event_id} ({self.status})'
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for a PaymentIntent until it is paid (turned into a sale
+    by OrderBuilder) or expires (returned by release_reservations).
+    Mirrors Product.reserved; see checkout.inventory.
+    """
+    payment_intent = models.CharField(max_length=255, db_index=True)
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['expires_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['expires_at', 'id'],
+                name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_id} for {self.payment_intent}'
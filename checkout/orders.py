@@ -0,0 +1,81 @@
+"""
+The one place orders are created.
+
+``OrderBuilder`` turns a bag dict and the shopper's details into an
+``Order`` plus its line items inside a single ``transaction.atomic()``:
+one product query (via ``BagSummary``), one INSERT for the order, one
+``bulk_create`` for every line, the stock taken (``inventory.commit``)
+and the confirmation email queued in the same transaction. Totals come from the summary, so the line items and
+the order agree without ``Order.update_totals``.
+
+A unique constraint on ``stripe_pid`` makes it idempotent: if the
+webhook worker and the return-URL fallback race, the loser gets the
+winner's order back.
+"""
+import json
+
+from django.db import IntegrityError, transaction
+
+from bag.summary import BagSummary
+from . import inventory
+from .emails import queue_order_confirmation
+from .models import Order, OrderLineItem
+
+DETAIL_FIELDS = (
+    "full_name", "email", "phone_number", "address1", "address2",
+    "city", "county", "postcode", "country",
+)
+
+
+class OrderBuilder:
+    def __init__(self, bag, details, stripe_pid="", user_profile=None):
+        self.bag = bag if isinstance(bag, dict) else {}
+        self.details = {
+            field: details.get(field, "") or "" for field in DETAIL_FIELDS}
+        self.stripe_pid = stripe_pid
+        self.user_profile = user_profile
+
+    def existing(self):
+        if not self.stripe_pid:
+            return None
+        return Order.objects.filter(stripe_pid=self.stripe_pid).first()
+
+    def build(self):
+        """Returns (order, created)."""
+        order = self.existing()
+        if order is not None:
+            return order, False
+
+        summary = BagSummary(self.bag)
+        items = summary.items
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(
+                    **self.details,
+                    order_total=summary.order_total,
+                    delivery_cost=summary.delivery_cost,
+                    grand_total=summary.grand_total,
+                    original_bag=json.dumps(self.bag),
+                    stripe_pid=self.stripe_pid,
+                    user_profile=self.user_profile,
+                )
+                OrderLineItem.objects.bulk_create([
+                    OrderLineItem(
+                        order=order,
+                        product=item["product"],
+                        quantity=item["qty"],
+                        lineitem_total=item["line_total"],
+                    )
+                    for item in items
+                ])
+                inventory.commit(
+                    self.stripe_pid,
+                    [(item["product"], item["qty"]) for item in items])
+                queue_order_confirmation(order)
+        except IntegrityError:
+            # Lost a race on stripe_pid; the other order stands
+            order = self.existing()
+            if order is None:
+                raise
+            return order, False
+        return order, True
@@ -0,0 +1,113 @@
+"""
+Delivery side of the email outbox (see ``EmailOutbox``).
+
+``claim_batch`` leases due rows so concurrent workers don't pick up the
+same email, ``deliver`` sends a batch over one SMTP connection and
+schedules failures for a retry with exponential backoff.
+"""
+import logging
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .emails import build_order_confirmation
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 30  # seconds; doubles after each failure
+BACKOFF_MAX = 60 * 60
+LEASE = timedelta(minutes=5)
+
+BUILDERS = {
+    EmailOutbox.ORDER_CONFIRMATION: lambda row, connection: (
+        build_order_confirmation(row.order, connection=connection)),
+}
+
+
+def backoff(attempts):
+    return timedelta(
+        seconds=min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to ``batch_size`` due emails to this worker by pushing
+    their next_attempt_at past the lease time.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=EmailOutbox.PENDING, next_attempt_at__lte=now)
+            .select_related('order')
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        EmailOutbox.objects.filter(pk__in=[r.pk for r in rows]).update(
+            next_attempt_at=now + LEASE)
+    return rows
+
+
+def _failed(row, error, max_attempts):
+    """Record a failed attempt; back off, or give up after max_attempts."""
+    row.attempts += 1
+    row.last_error = repr(error)
+    if row.attempts >= max_attempts:
+        row.status = EmailOutbox.FAILED
+        logger.error("Giving up on outbox email %s: %s", row.pk, error)
+    else:
+        row.next_attempt_at = timezone.now() + backoff(row.attempts)
+    row.save(update_fields=[
+        'attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def deliver(rows, max_attempts=MAX_ATTEMPTS):
+    """Send ``rows`` over a single connection. Returns (sent, failed)."""
+    sent = failed = 0
+    if not rows:
+        return sent, failed
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        # The mail server is down: every row tried counts as an attempt,
+        # so the batch backs off instead of being re-leased forever
+        logger.warning(
+            "Could not connect to send %s outbox emails: %s", len(rows), e)
+        for row in rows:
+            _failed(row, e, max_attempts)
+        return sent, len(rows)
+    try:
+        for row in rows:
+            try:
+                BUILDERS[row.kind](row, connection).send()
+            except Exception as e:
+                failed += 1
+                _failed(row, e, max_attempts)
+                continue
+            sent += 1
+            row.status = EmailOutbox.SENT
+            row.attempts += 1
+            row.sent_at = timezone.now()
+            row.save(update_fields=['status', 'attempts', 'sent_at'])
+    finally:
+        try:
+            connection.close()
+        except Exception as e:
+            logger.warning("Error closing the mail connection: %s", e)
+    return sent, failed
+
+
+def drain(batch_size=50, max_attempts=MAX_ATTEMPTS):
+    """Deliver everything currently due. Returns (sent, failed)."""
+    total_sent = total_failed = 0
+    while True:
+        rows = claim_batch(batch_size)
+        if not rows:
+            return total_sent, total_failed
+        sent, failed = deliver(rows, max_attempts=max_attempts)
+        total_sent += sent
+        total_failed += failed
@@ -0,0 +1,165 @@
+"""
+The Stripe client checkout talks through.
+
+One ``Payments`` instance per process holds a ``stripe.StripeClient``
+on a pooled ``requests`` session, so API calls reuse keep-alive
+connections instead of opening a TLS connection per request. Every
+call has a bounded (connect, read) timeout, and network errors, 409s
+and 5xxs are retried by the SDK with backoff; POSTs carry an
+idempotency key, so a retried create can't make a second intent.
+
+Latency and error counts per operation are kept in ``metrics``::
+
+    payments.get_client().metrics.snapshot()
+    # {"payment_intents.create": {"calls": 12, "errors": 0,
+    #                             "avg_ms": 41.7, "max_ms": 96.3}, ...}
+
+Settings: ``STRIPE_SECRET_KEY``, ``STRIPE_API_BASE`` (point it at a
+``checkout.fake_stripe.FakeStripeServer`` to run offline),
+``STRIPE_CONNECT_TIMEOUT``, ``STRIPE_READ_TIMEOUT``,
+``STRIPE_MAX_RETRIES`` and ``STRIPE_POOL_SIZE``.
+"""
+import threading
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+from cwh_site import timing
+
+StripeError = stripe.StripeError
+SignatureVerificationError = stripe.SignatureVerificationError
+
+DEFAULT_CONNECT_TIMEOUT = 3
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_POOL_SIZE = 10
+
+
+class Metrics:
+    """Thread-safe call counts and latencies, per operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def record(self, op, elapsed_ms, ok=True):
+        with self._lock:
+            stats = self._ops.setdefault(
+                op, {"calls": 0, "errors": 0, "total_ms": 0.0,
+                     "max_ms": 0.0})
+            stats["calls"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                op: {
+                    "calls": s["calls"],
+                    "errors": s["errors"],
+                    "avg_ms": round(s["total_ms"] / s["calls"], 1),
+                    "max_ms": round(s["max_ms"], 1),
+                }
+                for op, s in self._ops.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._ops.clear()
+
+
+class Payments:
+    def __init__(self, api_key, api_base=None,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 pool_size=DEFAULT_POOL_SIZE):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._client = stripe.StripeClient(
+            api_key,
+            base_addresses={"api": api_base} if api_base else {},
+            max_network_retries=max_retries,
+            http_client=stripe.RequestsClient(
+                timeout=timeout, session=session),
+        )
+        self.metrics = Metrics()
+
+    def _call(self, op, method, *args):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = method(*args)
+            ok = True
+            return result
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.metrics.record(op, elapsed_ms, ok)
+            timing.add("stripe", elapsed_ms)
+
+    def create_intent(self, **params):
+        return self._call(
+            "payment_intents.create",
+            self._client.v1.payment_intents.create, params)
+
+    def modify_intent(self, intent_id, **params):
+        return self._call(
+            "payment_intents.update",
+            self._client.v1.payment_intents.update, intent_id, params)
+
+    def retrieve_intent(self, intent_id):
+        return self._call(
+            "payment_intents.retrieve",
+            self._client.v1.payment_intents.retrieve, intent_id)
+
+    @staticmethod
+    def construct_event(payload, sig_header, secret):
+        """Verify a webhook signature; no API call."""
+        return stripe.Webhook.construct_event(payload, sig_header, secret)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide ``Payments`` client, built from settings."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Payments(
+                    settings.STRIPE_SECRET_KEY,
+                    api_base=getattr(settings, "STRIPE_API_BASE", None),
+                    timeout=(
+                        getattr(settings, "STRIPE_CONNECT_TIMEOUT",
+                                DEFAULT_CONNECT_TIMEOUT),
+                        getattr(settings, "STRIPE_READ_TIMEOUT",
+                                DEFAULT_READ_TIMEOUT),
+                    ),
+                    max_retries=getattr(
+                        settings, "STRIPE_MAX_RETRIES", DEFAULT_MAX_RETRIES),
+                    pool_size=getattr(
+                        settings, "STRIPE_POOL_SIZE", DEFAULT_POOL_SIZE),
+                )
+    return _client
+
+
+def reset_client():
+    global _client
+    with _client_lock:
+        _client = None
+
+
+@receiver(setting_changed)
+def _settings_changed(setting, **kwargs):
+    if setting.startswith("STRIPE_"):
+        reset_client()
@@ -0,0 +1,86 @@
+"""
+Synthetic order history, for the generate_dataset command (see
+products.seeding).
+"""
+import json
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from products.seeding import batched
+from .models import DELIVERY_FLAT, FREE_DELIVERY_THRESHOLD
+from .models import Order, OrderLineItem
+
+GUEST = {
+    "full_name": "Guest Shopper", "email": "guest@example.com",
+    "phone_number": "07700 900000", "address1": "1 Test Street",
+    "city": "London", "postcode": "SW1A 1AA",
+}
+
+
+def seed_orders(total, profiles, products, batch_size=5_000, seed=42,
+                prefix="bench", max_lines=5, days=730):
+    """
+    ``total`` paid orders spread over the last ``days`` days, each of 1
+    to ``max_lines`` lines from ``products`` ([(pk, price)]); most belong
+    to a profile from the ``profiles`` queryset, the rest are guests.
+    Returns how many line items were made.
+    """
+    rng = random.Random(f"{seed}:orders")
+    owners = list(profiles.values(
+        "pk", "full_name", "email", "phone_number", "address1", "city",
+        "postcode"))
+    now = timezone.now()
+
+    def orders():
+        for i in range(total):
+            owner = rng.choice(owners) if owners and rng.random() < 0.8 \
+                else None
+            details = GUEST if owner is None else {
+                k: v for k, v in owner.items() if k != "pk"}
+            lines = [
+                (pk, rng.choice((1, 1, 1, 2, 3)), price)
+                for pk, price in rng.sample(
+                    products, min(rng.randint(1, max_lines), len(products)))
+            ]
+            order_total = sum(price * qty for _, qty, price in lines)
+            delivery = (
+                Decimal("0.00") if order_total >= FREE_DELIVERY_THRESHOLD
+                else DELIVERY_FLAT)
+            order = Order(
+                user_profile_id=owner and owner["pk"],
+                order_number=uuid.UUID(int=rng.getrandbits(128)).hex.upper(),
+                country="GB",
+                order_total=order_total,
+                delivery_cost=delivery,
+                grand_total=order_total + delivery,
+                stripe_pid=f"pi_{prefix}{i:08d}",
+                original_bag=json.dumps(
+                    {str(pk): qty for pk, qty, _ in lines}),
+                **details,
+            )
+            placed = now - timedelta(seconds=rng.randint(0, days * 86_400))
+            yield order, lines, placed
+
+    made = 0
+    for batch in batched(orders(), batch_size):
+        with transaction.atomic():
+            created = Order.objects.bulk_create([o for o, _, _ in batch])
+            items = []
+            for order, (_, lines, placed) in zip(created, batch):
+                # date is auto_now_add, so it can only be backdated after
+                order.date = placed
+                items += [
+                    OrderLineItem(
+                        order=order, product_id=pk, quantity=qty,
+                        lineitem_total=price * qty)
+                    for pk, qty, price in lines
+                ]
+            Order.objects.bulk_update(created, ["date"], batch_size=1_000)
+            OrderLineItem.objects.bulk_create(items)
+        made += len(items)
+    return made
@@ -1,22 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+import json
+import time
 from unittest.mock import patch
 from decimal import Decimal
-from django.test import TestCase, override_settings
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
 from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.utils import timezone
 from django.urls import reverse
 from products.models import Product
-from checkout.models import Order, OrderLineItem
+from checkout import inventory, outbox, payments
+from checkout.fake_stripe import FakeStripeServer, sign_payload
+from checkout.orders import OrderBuilder
+from checkout.models import (
+    EmailOutbox, Order, OrderLineItem, StockReservation, WebhookEvent)
 from checkout.emails import send_order_confirmation
 
 
-class StripeFlowTests(TestCase):
-    @patch('checkout.views.stripe')
-    def test_checkout_paid_creates_order(self, mock_stripe):
-        # Mock PI retrieve to return succeeded
-        mock_stripe.PaymentIntent.retrieve.return_value = type(
-            'PI', (), {'id': 'pi_123', 'status': 'succeeded'})
-        p = Product.objects.create(name='X', price=Decimal('10.00'))
+class FakeStripeMixin:
+    """Points checkout.payments at a FakeStripeServer over HTTP."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stripe = FakeStripeServer().start()
+        cls.addClassCleanup(cls.stripe.stop)
+        cls.enterClassContext(override_settings(
+            STRIPE_API_BASE=cls.stripe.url,
+            STRIPE_SECRET_KEY='sk_test_fake',
+            STRIPE_WEBHOOK_SECRET='whsec_test',
+        ))
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        self.fake = self.stripe.reset()
+
+
+class StripeFlowTests(FakeStripeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        intent = self.fake.PaymentIntent.create(2000, 'gbp')
+        self.fake.confirm(intent.id)
+        self.pi_id, self.client_secret = intent.id, intent.client_secret
+        self.product = Product.objects.create(
+            name='X', price=Decimal('10.00'))
         s = self.client.session
-        s['bag'] = {str(p.id): 2}
+        s['bag'] = {str(self.product.id): 2}
         s['checkout_data'] = {
             'full_name': 'A',
             'email': 'a@b.com',
@@ -30,12 +65,70 @@ class StripeFlowTests(TestCase):
             'save_info': False
         }
         s.save()
-        r = self.client.get(
-            reverse(
-                'checkout:checkout_paid'
-            ) + '?payment_intent_client_secret=pi_123_secret_abc'
+
+    def _return_from_stripe(self):
+        return self.client.get(
+            reverse('checkout:checkout_paid'),
+            {'payment_intent_client_secret': self.client_secret},
         )
-        self.assertEqual(r.status_code, 302)
+
+    def test_return_url_does_not_wait_for_webhook(self):
+        r = self._return_from_stripe()
+        self.assertEqual(r.status_code, 200)
+        self.assertTemplateUsed(r, 'checkout/finalising.html')
+        self.assertFalse(Order.objects.exists())
+
+        status_url = reverse('checkout:order_status')
+        with self.assertNumQueries(2):
+            # A pending poll is the session + one indexed order lookup
+            data = self.client.get(status_url).json()
+        self.assertEqual(data, {'status': 'pending'})
+
+        # The webhook lands
+        order = Order.objects.create(
+            full_name='A', email='a@b.com', phone_number='1',
+            address1='x', city='t', postcode='z', country='GB',
+            stripe_pid=self.pi_id)
+        data = self.client.get(status_url).json()
+        self.assertEqual(data['status'], 'ready')
+        self.assertEqual(
+            data['redirect'],
+            reverse('checkout:checkout_success', args=[order.order_number]))
+        self.assertEqual(self.client.session['bag'], {})
+        self.assertEqual(self.fake.count('PaymentIntent.retrieve'), 1)
+
+    @override_settings(CHECKOUT_FINALISE_TIMEOUT=0)
+    def test_fallback_creates_order_after_timeout(self):
+        self._return_from_stripe()
+        data = self.client.get(reverse('checkout:order_status')).json()
+        order = Order.objects.get(stripe_pid=self.pi_id)
+        self.assertEqual(data['status'], 'ready')
+        self.assertIn(order.order_number, data['redirect'])
+        self.assertEqual(order.lineitems.get().quantity, 2)
+        # The confirmation is queued, not sent inline
+        self.assertEqual(order.emails.get().status, EmailOutbox.PENDING)
+        self.assertFalse(mail.outbox)
+
+
+class CheckoutPageQueryTests(FakeStripeMixin, TestCase):
+    def test_checkout_page_computes_bag_once(self):
+        self.client.force_login(User.objects.create(username='u'))
+        s = self.client.session
+        s['bag'] = {
+            str(Product.objects.create(
+                name=f'P{i}', price=Decimal('20.00')).id): 1
+            for i in range(3)
+        }
+        s.save()
+        # The first visit creates the PaymentIntent and saves it in
+        # the session; a revisit reuses it without writing
+        self.client.get(reverse('checkout:checkout'))
+        # session + user + products (shared with the mini bag) + the
+        # intent's order lookup + profile
+        with self.assertNumQueries(5):
+            r = self.client.get(reverse('checkout:checkout'))
+        self.assertEqual(r.context['grand_total'], Decimal('60.00'))
+        self.assertEqual(r.context['bag_grand_total'], Decimal('60.00'))
 
 
 @override_settings(
@@ -56,3 +149,450 @@ class EmailTests(TestCase):
         send_order_confirmation(o)
         self.assertTrue(mail.outbox)
         self.assertIn(str(o.order_number), mail.outbox[0].subject)
+
+
+class UnreachableEmailBackend(locmem.EmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('smtp down')
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'
+)
+class OutboxTests(TestCase):
+    def setUp(self):
+        p = Product.objects.create(name='X', price=Decimal('10.00'))
+        self.orders = []
+        for i in range(3):
+            o = Order.objects.create(
+                full_name='T', email=f't{i}@t.com', phone_number='1',
+                address1='A', city='C', postcode='P', country='GB')
+            OrderLineItem.objects.create(order=o, product=p, quantity=1)
+            EmailOutbox.objects.create(
+                kind=EmailOutbox.ORDER_CONFIRMATION, order=o)
+            self.orders.append(o)
+
+    def test_worker_sends_batch_over_one_connection(self):
+        with patch(
+                'checkout.outbox.get_connection',
+                wraps=outbox.get_connection) as get_connection:
+            call_command('send_outbox', batch_size=10, stdout=StringIO())
+        get_connection.assert_called_once()
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox),
+            ['t0@t.com', 't1@t.com', 't2@t.com'])
+        self.assertFalse(
+            EmailOutbox.objects.exclude(status=EmailOutbox.SENT).exists())
+
+    def test_failures_back_off_then_retry(self):
+        with patch(
+                'checkout.outbox.build_order_confirmation',
+                side_effect=OSError('smtp down')):
+            self.assertEqual(outbox.drain(), (0, 3))
+        row = EmailOutbox.objects.first()
+        self.assertEqual(
+            (row.status, row.attempts), (EmailOutbox.PENDING, 1))
+        self.assertGreater(row.next_attempt_at, timezone.now())
+        self.assertIn('smtp down', row.last_error)
+
+        # Not due yet
+        self.assertEqual(outbox.drain(), (0, 0))
+
+        EmailOutbox.objects.update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.drain(), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(
+        EMAIL_BACKEND='checkout.tests.UnreachableEmailBackend')
+    def test_unreachable_server_backs_off_every_row(self):
+        out = StringIO()
+        with self.assertLogs('checkout.outbox', 'WARNING'):
+            call_command('send_outbox', stdout=out)
+        self.assertIn('Sent 0, failed 3', out.getvalue())
+        for row in EmailOutbox.objects.all():
+            self.assertEqual(
+                (row.status, row.attempts), (EmailOutbox.PENDING, 1))
+            self.assertGreater(row.next_attempt_at, timezone.now())
+            self.assertIn('smtp down', row.last_error)
+
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        with self.assertLogs('checkout.outbox', 'WARNING'):
+            call_command('run_workers', once=True, stdout=StringIO())
+        self.assertEqual(
+            set(EmailOutbox.objects.values_list('attempts', flat=True)), {2})
+
+    def test_gives_up_after_max_attempts(self):
+        with patch(
+                'checkout.outbox.build_order_confirmation',
+                side_effect=OSError('bad address')), \
+                self.assertLogs('checkout.outbox', 'ERROR'):
+            outbox.drain(max_attempts=1)
+        self.assertEqual(
+            EmailOutbox.objects.filter(status=EmailOutbox.FAILED).count(), 3)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='X', price=Decimal('10.00'))
+
+    def _event(self, event_id='evt_1', pi_id='pi_9'):
+        return {
+            'id': event_id,
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {
+                'id': pi_id,
+                'metadata': {
+                    'bag': json.dumps({str(self.product.id): 3}),
+                    'full_name': 'A', 'email': 'a@b.com',
+                    'phone_number': '1', 'address1': 'x', 'city': 't',
+                    'postcode': 'z', 'country': 'GB',
+                },
+            }},
+        }
+
+    def _post(self, event, secret='whsec_test'):
+        payload = json.dumps(event)
+        return self.client.post(
+            reverse('checkout:stripe_webhook'), payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_payload(payload, secret))
+
+    def test_bad_signature_is_rejected(self):
+        with self.assertLogs('checkout.views', 'WARNING'):
+            r = self._post(self._event(), secret='whsec_other')
+        self.assertEqual(r.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_view_only_records_and_retries_are_ignored(self):
+        event = self._event()
+        with self.assertNumQueries(4):
+            # get_or_create: SELECT, SAVEPOINT, INSERT, RELEASE
+            self.assertEqual(self._post(event).status_code, 200)
+        self.assertEqual(self._post(event).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.assertFalse(Order.objects.exists())
+
+    def test_worker_creates_order_once(self):
+        self._post(self._event('evt_1'))
+        # A second event for the same PaymentIntent
+        self._post(self._event('evt_2'))
+        call_command('process_webhooks', stdout=StringIO())
+
+        order = Order.objects.get(stripe_pid='pi_9')
+        self.assertEqual(order.lineitems.get().quantity, 3)
+        self.assertEqual(order.emails.count(), 1)
+        self.assertEqual(
+            set(WebhookEvent.objects.values_list('status', flat=True)),
+            {WebhookEvent.PROCESSED})
+
+    def test_failed_event_is_retried_later(self):
+        self._post(self._event())
+        with patch(
+                'checkout.webhooks.payment_intent_succeeded',
+                side_effect=RuntimeError('db hiccup')), \
+                self.assertLogs('checkout.webhooks', 'ERROR'):
+            call_command('process_webhooks', stdout=StringIO())
+        event = WebhookEvent.objects.get()
+        self.assertEqual(
+            (event.status, event.attempts), (WebhookEvent.PENDING, 1))
+        self.assertFalse(Order.objects.exists())
+
+        WebhookEvent.objects.update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1))
+        call_command('process_webhooks', stdout=StringIO())
+        self.assertTrue(Order.objects.filter(stripe_pid='pi_9').exists())
+
+    def test_deployed_worker_processes_the_inbox(self):
+        self._post(self._event())
+        out = StringIO()
+        call_command('run_workers', once=True, stdout=out)
+        self.assertTrue(Order.objects.filter(stripe_pid='pi_9').exists())
+        self.assertIn('webhook events: 1', out.getvalue())
+        self.assertIn(
+            'run_workers', (settings.BASE_DIR / 'Procfile').read_text())
+
+
+class OrderBuilderTests(TestCase):
+    details = {
+        'full_name': 'A', 'email': 'a@b.com', 'phone_number': '1',
+        'address1': 'x', 'city': 't', 'postcode': 'z', 'country': 'GB',
+    }
+
+    def setUp(self):
+        self.bag = {
+            str(Product.objects.create(
+                name=f'P{i}', price=Decimal('2.50')).id): i + 1
+            for i in range(50)
+        }
+
+    def test_bulk_inserts_lines_with_totals(self):
+        # existing check, products, savepoint, order, lines, stock
+        # reservations, outbox, release: independent of the number of
+        # lines (untracked products need no stock update)
+        with self.assertNumQueries(8):
+            order, created = OrderBuilder(
+                self.bag, self.details, stripe_pid='pi_b').build()
+        self.assertTrue(created)
+        self.assertEqual(order.lineitems.count(), 50)
+        self.assertEqual(order.order_total, Decimal('3187.50'))
+        self.assertEqual(order.grand_total, Decimal('3187.50'))
+        self.assertEqual(
+            sum(li.lineitem_total for li in order.lineitems.all()),
+            order.order_total)
+        self.assertEqual(order.emails.count(), 1)
+
+    def test_idempotent_on_stripe_pid(self):
+        first, _ = OrderBuilder(
+            self.bag, self.details, stripe_pid='pi_b').build()
+        again, created = OrderBuilder(
+            self.bag, self.details, stripe_pid='pi_b').build()
+        self.assertFalse(created)
+        self.assertEqual(again, first)
+
+        # A racing builder that missed the existence check
+        with patch.object(OrderBuilder, 'existing', side_effect=[None, first]):
+            raced, created = OrderBuilder(
+                self.bag, self.details, stripe_pid='pi_b').build()
+        self.assertFalse(created)
+        self.assertEqual(raced, first)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderLineItem.objects.count(), 50)
+
+
+class PaymentIntentReuseTests(FakeStripeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.products = [
+            Product.objects.create(name=f'P{i}', price=Decimal('10.00'))
+            for i in range(2)
+        ]
+        self._set_bag({str(self.products[0].id): 1})
+
+    def _set_bag(self, bag):
+        s = self.client.session
+        s['bag'] = bag
+        s.save()
+
+    def _secret(self):
+        return self.client.get(
+            reverse('checkout:checkout')).context['client_secret']
+
+    def test_unchanged_bag_reuses_intent(self):
+        first = self._secret()
+        self.assertEqual(self._secret(), first)
+        self.assertEqual(
+            self.fake.calls, [('PaymentIntent.create', 'pi_fake000001')])
+
+    def test_intent_that_became_an_order_is_replaced(self):
+        first = self._secret()
+        # Paid; the webhook made the order but the shopper never came
+        # back through checkout_paid, so the session still has it
+        self.fake.confirm('pi_fake000001')
+        Order.objects.create(
+            full_name='A', email='a@b.com', phone_number='1',
+            address1='x', city='t', postcode='z', country='GB',
+            stripe_pid='pi_fake000001')
+        second = self._secret()
+        self.assertNotEqual(second, first)
+        self.assertEqual(
+            self.client.session['payment_intent']['id'], 'pi_fake000002')
+        self.assertEqual(self.fake.count('PaymentIntent.modify'), 0)
+
+    def test_changed_bag_modifies_amount(self):
+        first = self._secret()
+        self._set_bag({str(p.id): 2 for p in self.products})
+        self.assertEqual(self._secret(), first)
+        intent = self.fake.intents['pi_fake000001']
+        self.assertEqual(intent.amount, 4499)
+        self.assertEqual(self.fake.count('PaymentIntent.create'), 1)
+        self.assertEqual(self.fake.count('PaymentIntent.modify'), 1)
+
+    def test_paid_intent_is_replaced(self):
+        first = self._secret()
+        self.fake.confirm('pi_fake000001')
+        self._set_bag({str(self.products[1].id): 3})
+        second = self._secret()
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.fake.count('PaymentIntent.create'), 2)
+        self.assertEqual(self.fake.intents['pi_fake000002'].amount, 3499)
+
+
+class PaymentsClientTests(FakeStripeMixin, TestCase):
+    def _client(self, **kwargs):
+        return payments.Payments(
+            'sk_test_fake', api_base=self.stripe.url, **kwargs)
+
+    def test_intent_round_trip_and_metrics(self):
+        client = self._client()
+        intent = client.create_intent(
+            amount=1000, currency='gbp', metadata={'bag': '{}'})
+        client.modify_intent(intent.id, amount=1500)
+        self.assertEqual(client.retrieve_intent(intent.id).amount, 1500)
+        self.assertEqual(self.fake.intents[intent.id].metadata, {'bag': '{}'})
+
+        stats = client.metrics.snapshot()
+        self.assertEqual(
+            {op: s['calls'] for op, s in stats.items()},
+            {'payment_intents.create': 1, 'payment_intents.update': 1,
+             'payment_intents.retrieve': 1})
+
+    def test_server_errors_are_retried(self):
+        client = self._client(max_retries=1)
+        self.stripe.fail(1)
+        client.create_intent(amount=1000, currency='gbp')
+        self.assertEqual(self.fake.count('PaymentIntent.create'), 1)
+        self.assertEqual(
+            client.metrics.snapshot()['payment_intents.create']['errors'], 0)
+
+        no_retry = self._client(max_retries=0)
+        self.stripe.fail(1)
+        with self.assertRaises(payments.StripeError):
+            no_retry.create_intent(amount=1000, currency='gbp')
+        self.assertEqual(
+            no_retry.metrics.snapshot()['payment_intents.create']['errors'],
+            1)
+
+    def test_read_timeout_is_bounded(self):
+        client = self._client(timeout=(1, 0.1), max_retries=0)
+        self.stripe.httpd.latency = 0.5
+        with self.assertRaises(payments.StripeError):
+            client.create_intent(amount=1000, currency='gbp')
+        self.assertLess(
+            client.metrics.snapshot()['payment_intents.create']['max_ms'],
+            500)
+
+    def test_client_follows_settings(self):
+        client = payments.get_client()
+        self.assertIs(payments.get_client(), client)
+        with override_settings(STRIPE_MAX_RETRIES=0):
+            self.assertIsNot(payments.get_client(), client)
+
+
+class InventoryTests(FakeStripeMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(
+            name='Drop', price=Decimal('10.00'), stock=3)
+        self.untracked = Product.objects.create(
+            name='Plenty', price=Decimal('5.00'))
+
+    def _refresh(self):
+        self.product.refresh_from_db()
+        return self.product.stock, self.product.reserved
+
+    def test_reserve_commit_and_release(self):
+        inventory.reserve('pi_a', [(self.product, 2), (self.untracked, 9)])
+        self.assertEqual(self._refresh(), (3, 2))
+        self.assertEqual(self.product.available, 1)
+        with self.assertRaisesMessage(inventory.OutOfStock, 'only 1'):
+            inventory.reserve('pi_b', [(self.product, 2)])
+        self.assertEqual(self._refresh(), (3, 2))
+
+        # Re-reserving replaces the intent's hold
+        inventory.reserve('pi_a', [(self.product, 1)])
+        self.assertEqual(self._refresh(), (3, 1))
+
+        OrderBuilder(
+            {str(self.product.id): 1}, {}, stripe_pid='pi_a').build()
+        self.assertEqual(self._refresh(), (2, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_saving_a_stale_product_keeps_its_holds(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        inventory.reserve('pi_a', [(self.product, 2)])
+        # e.g. a staff edit loaded before the checkout reserved stock
+        stale.name = 'Drop, renamed'
+        stale.save()
+        self.assertEqual(self._refresh(), (3, 2))
+        self.assertEqual(self.product.name, 'Drop, renamed')
+
+    def test_expired_holds_are_released(self):
+        inventory.reserve('pi_a', [(self.product, 3)])
+        StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('release_reservations', stdout=out)
+        self.assertIn('Released 1', out.getvalue())
+        self.assertEqual(self._refresh(), (3, 0))
+
+    def test_lapsed_hold_does_not_block_before_the_sweep(self):
+        inventory.reserve('pi_a', [(self.product, 3)])
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.reserve('pi_b', [(self.product, 1)])
+
+        StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+        # No release_reservations run in between
+        inventory.reserve('pi_b', [(self.product, 2)])
+        self.assertEqual(self._refresh(), (3, 2))
+        self.assertEqual(
+            list(StockReservation.objects.values_list(
+                'payment_intent', 'quantity')),
+            [('pi_b', 2)])
+
+    def test_worker_releases_expired_holds(self):
+        inventory.reserve('pi_a', [(self.product, 3)])
+        StockReservation.objects.update(
+            expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('run_workers', once=True, stdout=out)
+        self.assertIn('expired reservations: 1', out.getvalue())
+        self.assertEqual(self._refresh(), (3, 0))
+
+    def test_checkout_reserves_and_refuses_short_bags(self):
+        s = self.client.session
+        s['bag'] = {str(self.product.id): 2}
+        s.save()
+        self.client.get(reverse('checkout:checkout'))
+        intent_id = self.client.session['payment_intent']['id']
+        self.assertEqual(
+            StockReservation.objects.get().payment_intent, intent_id)
+        self.assertEqual(self._refresh(), (3, 2))
+
+        s = self.client.session
+        s['bag'] = {str(self.product.id): 4}
+        s.save()
+        r = self.client.get(reverse('checkout:checkout'))
+        self.assertRedirects(r, reverse('bag:view_bag'))
+        # The earlier hold stands; Stripe wasn't asked to change amount
+        self.assertEqual(self._refresh(), (3, 2))
+        self.assertEqual(self.fake.count('PaymentIntent.modify'), 0)
+
+
+class ConcurrentStockTests(TransactionTestCase):
+    def test_parallel_buyers_never_oversell(self):
+        product = Product.objects.create(
+            name='Last few', price=Decimal('10.00'), stock=5)
+        buyers = 20
+
+        deadline = time.monotonic() + 30
+
+        def buy(n):
+            try:
+                while True:
+                    try:
+                        inventory.reserve(f'pi_{n}', [(product, 1)])
+                        return True
+                    except inventory.OutOfStock:
+                        return False
+                    except OperationalError as e:
+                        # SQLite's shared in-memory test database
+                        # refuses concurrent writers instead of queueing
+                        # them; the buyer tries again, for a while
+                        if ('locked' not in str(e)
+                                or time.monotonic() > deadline):
+                            raise
+                        time.sleep(0.001)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(buy, range(buyers)))
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(product.reserved, 5)
+        self.assertEqual(StockReservation.objects.count(), 5)
@@ -6,6 +6,7 @@ app_name = 'checkout'
 urlpatterns = [
     path('', views.checkout, name='checkout'),
     path('paid/', views.checkout_paid, name='checkout_paid'),
+    path('status/', views.order_status, name='order_status'),
     path('cache/', views.cache_checkout_data, name='cache_checkout_data'),
     path('wh/', views.stripe_webhook, name='stripe_webhook'),
     path(
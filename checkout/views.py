@@ -1,29 +1,25 @@
 # checkout/views.py
+import hashlib
 import json
 import logging
 import time
-from decimal import Decimal
 
-import stripe
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from bag.summary import get_bag_summary
 from bag.views import _get_bag
-from products.models import Product
 from profiles.models import UserProfile
-from .emails import send_order_confirmation
+from . import inventory, payments, webhooks
 from .forms import OrderForm
-from .models import (
-    FREE_DELIVERY_THRESHOLD,
-    DELIVERY_FLAT,
-    Order,
-    OrderLineItem,
-)
+from .models import Order
+from .orders import OrderBuilder
 
 # Used the logger to find bugs during Stripe integration.
 # They remain in the code as they are useful later too.
@@ -32,105 +28,76 @@ logger = logging.getLogger(__name__)
 # ---------- Helpers ----------
 
 
-def _bag_summary(request):
-    """Counts items and totals from the session bag."""
-    bag = _get_bag(request.session)
-    product_ids = [int(pid) for pid in bag.keys()]
-    products = {
-        p.id: p for p in Product.objects.filter(id__in=product_ids)
-    }
+def _bag_hash(summary):
+    """Fingerprint of the bag contents and what they cost."""
+    contents = json.dumps(
+        [sorted(summary.bag.items()), str(summary.grand_total)])
+    return hashlib.sha256(contents.encode()).hexdigest()
 
-    items = []
-    order_total = Decimal("0.00")
-
-    for pid_str, qty in bag.items():
-        pid = int(pid_str)
-        product = products.get(pid)
-        if not product:
-            continue
-        qty = int(qty)
-        price = getattr(
-            product,
-            "price",
-            Decimal("0.00"),
-        ) or Decimal("0.00")
-        line_total = price * qty
-        order_total += line_total
-        items.append(
-            {
-                "product": product,
-                "qty": qty,
-                "line_total": line_total,
-            }
-        )
 
-    delivery_cost = (
-        Decimal("0.00")
-        if order_total >= FREE_DELIVERY_THRESHOLD
-        else (
-            DELIVERY_FLAT
-            if order_total > 0
-            else Decimal("0.00")
-        )
-    )
-    grand_total = order_total + delivery_cost
-    remaining_to_free = (
-        FREE_DELIVERY_THRESHOLD - order_total
-        if order_total < FREE_DELIVERY_THRESHOLD
-        else Decimal("0.00")
+def _payment_intent_for_bag(request, summary):
+    """
+    The client secret of this session's PaymentIntent, with the bag's
+    stock reserved against it. An unchanged bag whose hold hasn't run
+    out reuses the stored intent with no Stripe call, after one indexed
+    lookup that it hasn't become an order; a changed bag updates its
+    amount with PaymentIntent.modify. A new intent is only created for
+    a new session, or when the old one can't be used (e.g. it has
+    already been paid).
+    Raises inventory.OutOfStock if the bag can't be reserved.
+    """
+    amount = int(
+        summary.grand_total
+        * int(getattr(settings, "STRIPE_PRICE_MULTIPLIER", 100))
     )
-    return (
-        bag,
-        items,
-        order_total,
-        delivery_cost,
-        grand_total,
-        remaining_to_free,
+    bag_hash = _bag_hash(summary)
+    lines = [(item["product"], item["qty"]) for item in summary.items]
+    stored = request.session.get("payment_intent") or {}
+    if (stored.get("id")
+            and Order.objects.filter(stripe_pid=stored["id"]).exists()):
+        # Paid, and the webhook made the order, but this session never
+        # reached checkout_paid to forget it; Stripe.js would refuse it
+        del request.session["payment_intent"]
+        stored = {}
+
+    if (stored.get("bag_hash") == bag_hash
+            and stored.get("reserved_until", 0) > time.time() + 60):
+        return stored["client_secret"]
+
+    if stored.get("id"):
+        try:
+            # Reserve first so a short bag doesn't touch Stripe
+            reserved_until = inventory.reserve(stored["id"], lines)
+            payments.get_client().modify_intent(stored["id"], amount=amount)
+        except payments.StripeError as e:
+            logger.info(
+                "Replacing PaymentIntent %s: %s", stored["id"], e)
+            inventory.release(stored["id"])
+        else:
+            stored["bag_hash"] = bag_hash
+            stored["reserved_until"] = reserved_until.timestamp()
+            request.session["payment_intent"] = stored
+            return stored["client_secret"]
+
+    intent = payments.get_client().create_intent(
+        amount=amount,
+        currency=getattr(settings, "STRIPE_CURRENCY", "gbp"),
+        automatic_payment_methods={"enabled": True},
+        metadata={"session_key": request.session.session_key or ""},
     )
-
-
-def _summary_from_bag_dict(bag_dict):
-    """Counts items/totals from a plain dict."""
-    product_ids = [int(pid) for pid in bag_dict.keys()]
-    products = {
-        p.id: p for p in Product.objects.filter(id__in=product_ids)
+    # Saved before reserving, so a short bag reuses this intent later
+    request.session["payment_intent"] = {
+        "id": intent.id,
+        "client_secret": intent.client_secret,
     }
-
-    items = []
-    order_total = Decimal("0.00")
-
-    for pid_str, qty in bag_dict.items():
-        pid = int(pid_str)
-        product = products.get(pid)
-        if not product:
-            continue
-        qty = int(qty)
-        price = getattr(
-            product,
-            "price",
-            Decimal("0.00"),
-        ) or Decimal("0.00")
-        line_total = price * qty
-        order_total += line_total
-        items.append(
-            {
-                "product": product,
-                "qty": qty,
-                "line_total": line_total,
-            }
-        )
-
-    delivery_cost = (
-        Decimal("0.00")
-        if order_total >= FREE_DELIVERY_THRESHOLD
-        else (
-            DELIVERY_FLAT
-            if order_total > 0
-            else Decimal("0.00")
-        )
-    )
-    grand_total = order_total + delivery_cost
-    return items, order_total, delivery_cost, grand_total
+    reserved_until = inventory.reserve(intent.id, lines)
+    request.session["payment_intent"] = {
+        "id": intent.id,
+        "client_secret": intent.client_secret,
+        "bag_hash": bag_hash,
+        "reserved_until": reserved_until.timestamp(),
+    }
+    return intent.client_secret
 
 
 # ---------- Views ----------
@@ -141,31 +108,16 @@ def checkout(request):
     """
     Render checkout with Stripe payment intent and payment element.
     """
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-
-    (
-        bag,
-        items,
-        order_total,
-        delivery_cost,
-        grand_total,
-        remaining_to_free,
-    ) = _bag_summary(request)
-    if not bag:
+    summary = get_bag_summary(request)
+    if not summary.bag:
         messages.info(request, "Your bag is empty.")
         return redirect("bag:view_bag")
 
-    # Create a payment intent
-    amount = int(
-        grand_total
-        * int(getattr(settings, "STRIPE_PRICE_MULTIPLIER", 100))
-    )
-    intent = stripe.PaymentIntent.create(
-        amount=amount,
-        currency=getattr(settings, "STRIPE_CURRENCY", "gbp"),
-        automatic_payment_methods={"enabled": True},
-        metadata={"session_key": request.session.session_key or ""},
-    )
+    try:
+        client_secret = _payment_intent_for_bag(request, summary)
+    except inventory.OutOfStock as e:
+        messages.error(request, str(e))
+        return redirect("bag:view_bag")
 
     # Prefill from profile
     initial = {}
@@ -188,14 +140,14 @@ def checkout(request):
 
     context = {
         "form": form,
-        "items": items,
-        "order_total": order_total,
-        "delivery_cost": delivery_cost,
-        "grand_total": grand_total,
-        "free_threshold": FREE_DELIVERY_THRESHOLD,
-        "remaining_to_free": remaining_to_free,
+        "items": summary.items,
+        "order_total": summary.order_total,
+        "delivery_cost": summary.delivery_cost,
+        "grand_total": summary.grand_total,
+        "free_threshold": summary.free_threshold,
+        "remaining_to_free": summary.remaining_to_free,
         "stripe_public_key": settings.STRIPE_PUBLIC_KEY,
-        "client_secret": intent.client_secret,
+        "client_secret": client_secret,
     }
     return render(request, "checkout/checkout.html", context)
 
@@ -207,7 +159,6 @@ def cache_checkout_data(request):
     intent metadata so the webhook can build the order without the browser
     returning.
     """
-    stripe.api_key = settings.STRIPE_SECRET_KEY
     data = request.POST
 
     # Session (used by return-url path as a fallback)
@@ -253,8 +204,8 @@ def cache_checkout_data(request):
             ),
         }
         try:
-            stripe.PaymentIntent.modify(intent_id, metadata=meta)
-        except Exception:
+            payments.get_client().modify_intent(intent_id, metadata=meta)
+        except payments.StripeError:
             # don't block checkout if metadata update fails
             pass
 
@@ -266,133 +217,121 @@ def cache_checkout_data(request):
 @require_http_methods(["POST"])
 def stripe_webhook(request):
     """
-    Create the Order on payment_intent.succeeded.
+    Verify the event and record it in the inbox; the process_webhooks
+    worker creates the order. Stripe gets its 200 straight away.
     """
-    stripe.api_key = settings.STRIPE_SECRET_KEY
     wh_secret = settings.STRIPE_WEBHOOK_SECRET
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
 
     try:
-        event = stripe.Webhook.construct_event(
+        event = payments.Payments.construct_event(
             payload,
             sig_header,
             wh_secret,
         )
-    except (ValueError, stripe.error.SignatureVerificationError) as e:
+    except (ValueError, payments.SignatureVerificationError) as e:
         logger.warning(
             "Stripe webhook signature/payload error: %s",
             e,
         )
         return HttpResponse(status=400)
 
-    if event["type"] != "payment_intent.succeeded":
-        return HttpResponse(status=200)
+    try:
+        payload_data = json.loads(payload)
+    except ValueError:
+        payload_data = dict(event)
+    webhooks.record(payload_data)
+    return HttpResponse(status=200)
+
 
-    pi = event["data"]["object"]
-    stripe_pid = pi["id"]
-    metadata = pi.get("metadata", {}) or {}
+def _finalise_timeout():
+    return getattr(settings, "CHECKOUT_FINALISE_TIMEOUT", 10)
 
-    # Idempotency: bail if already created
-    if Order.objects.filter(stripe_pid=stripe_pid).exists():
-        return HttpResponse(status=200)
 
+def _create_order_from_return(request, pi):
+    """
+    Fallback for when the webhook hasn't created the order: build it
+    from the PaymentIntent metadata, else from the session.
+    Returns the order, or None if there is nothing to build it from.
+    """
+    meta = getattr(pi, "metadata", {}) or {}
     try:
-        # Build from metadata
-        try:
-            bag = json.loads(metadata.get("bag", "{}"))
-        except Exception:
-            bag = {}
-        (
-            items,
-            order_total,
-            delivery_cost,
-            grand_total,
-        ) = _summary_from_bag_dict(bag)
+        bag_from_meta = json.loads(meta.get("bag", "{}"))
+    except Exception:
+        bag_from_meta = {}
 
+    if bag_from_meta:
+        # Use metadata (preferred)
         user_profile = None
-        profile_id = metadata.get("profile_id")
+        profile_id = meta.get("profile_id")
         if profile_id:
             try:
                 user_profile = UserProfile.objects.get(id=profile_id)
             except UserProfile.DoesNotExist:
                 user_profile = None
+        order, _ = OrderBuilder(
+            bag_from_meta, meta, stripe_pid=pi.id, user_profile=user_profile,
+        ).build()
+        return order
+
+    # Last fallback
+    bag = get_bag_summary(request).bag
+    data = request.session.get("checkout_data", {})
+    if not bag or not data:
+        return None
+
+    order, _ = OrderBuilder(
+        bag, data, stripe_pid=pi.id,
+        user_profile=(
+            getattr(request.user, "userprofile", None)
+            if request.user.is_authenticated
+            else None
+        ),
+    ).build()
+    return order
 
-        order = Order.objects.create(
-            full_name=metadata.get("full_name", ""),
-            email=metadata.get("email", ""),
-            phone_number=metadata.get("phone_number", ""),
-            address1=metadata.get("address1", ""),
-            address2=metadata.get("address2", ""),
-            city=metadata.get("city", ""),
-            county=metadata.get("county", ""),
-            postcode=metadata.get("postcode", ""),
-            country=metadata.get("country", ""),
-            order_total=order_total,
-            delivery_cost=delivery_cost,
-            grand_total=grand_total,
-            original_bag=json.dumps(bag),
-            stripe_pid=stripe_pid,
-            user_profile=user_profile,
-        )
-        for item in items:
-            OrderLineItem.objects.create(
-                order=order,
-                product=item["product"],
-                quantity=item["qty"],
-            )
-
-        if user_profile and metadata.get("save_info") == "true":
-            p = user_profile
-            p.full_name = metadata.get("full_name", p.full_name)
-            p.email = metadata.get("email", p.email)
-            p.phone_number = metadata.get(
-                "phone_number",
-                p.phone_number,
-            )
-            p.address1 = metadata.get("address1", p.address1)
-            p.address2 = metadata.get("address2", p.address2)
-            p.city = metadata.get("city", p.city)
-            p.county = metadata.get("county", p.county)
-            p.postcode = metadata.get("postcode", p.postcode)
-            p.country = metadata.get("country", p.country)
-            p.save()
 
-        try:
-            send_order_confirmation(order)
-        except Exception as e:
-            logger.exception(
-                "Order %s created; email failed: %s",
-                order.order_number,
-                e,
-            )
-
-        logger.info(
-            "Order %s created by webhook for %s",
-            order.order_number,
-            stripe_pid,
+def _finish_checkout(request, order):
+    """
+    Clear the bag and pending payment; return where to send the
+    shopper next.
+    """
+    request.session["bag"] = {}
+    request.session.pop("checkout_data", None)
+    request.session.pop("pending_payment", None)
+    request.session.pop("payment_intent", None)
+    if order is None:
+        messages.info(
+            request,
+            (
+                "Payment received. We're finalising your order; "
+                "it will appear in your profile shortly."
+            ),
         )
-        return HttpResponse(status=200)
+        return reverse("profiles:profile")
+    messages.success(
+        request,
+        f"Payment received. Your order number is {order.order_number}.",
+    )
+    return reverse(
+        "checkout:checkout_success",
+        kwargs={"order_number": order.order_number},
+    )
 
-    except Exception as e:
-        # Log full traceback but don't loop 500s forever
-        logger.exception(
-            "Webhook failed for %s: %s",
-            stripe_pid,
-            e,
-        )
-        # Returning 200 stops Stripe from endlessly retrying
-        return HttpResponse(status=200)
+
+def _retrieve_intent(pi_id):
+    return payments.get_client().retrieve_intent(pi_id)
 
 
 @require_http_methods(["GET"])
 def checkout_paid(request):
     """
-    - If webhook already created the order, redirect to success.
-    - Otherwise wait briefly; if still not found, create it here from
-      PaymentIntent metadata/session.
+    Stripe's return URL. Never waits on the webhook:
+    - if the webhook already created the order, redirect to success;
+    - otherwise render the "finalising" page, which polls order_status
+      until the order exists (or the fallback creates it).
     """
-    stripe.api_key = settings.STRIPE_SECRET_KEY
     client_secret = request.GET.get("payment_intent_client_secret")
     if not client_secret:
         messages.error(request, "Missing payment client secret.")
@@ -400,7 +339,7 @@ def checkout_paid(request):
 
     pi_id = client_secret.split("_secret")[0]
     try:
-        pi = stripe.PaymentIntent.retrieve(pi_id)
+        pi = _retrieve_intent(pi_id)
     except Exception:
         messages.error(request, "Could not verify payment.")
         return redirect("checkout:checkout")
@@ -412,157 +351,54 @@ def checkout_paid(request):
         )
         return redirect("checkout:checkout")
 
-    # 1) Try to find order created by webhook
-    for _ in range(5):
-        existing = Order.objects.filter(stripe_pid=pi.id).first()
-        if existing:
-            messages.success(
-                request,
-                (
-                    "Payment received. Your order number is "
-                    f"{existing.order_number}."
-                ),
-            )
-            request.session["bag"] = {}
-            request.session.pop("checkout_data", None)
-            return redirect(
-                "checkout:checkout_success",
-                order_number=existing.order_number,
-            )
-        time.sleep(1)
-
-    # 2) Fallback: build and create here
-    meta = getattr(pi, "metadata", {}) or {}
-    try:
-        bag_from_meta = json.loads(meta.get("bag", "{}"))
-    except Exception:
-        bag_from_meta = {}
+    existing = Order.objects.filter(stripe_pid=pi.id).first()
+    if existing:
+        return redirect(_finish_checkout(request, existing))
 
-    if bag_from_meta:
-        # Use metadata (preferred)
-        (
-            items,
-            order_total,
-            delivery_cost,
-            grand_total,
-        ) = _summary_from_bag_dict(bag_from_meta)
-        user_profile = None
-        profile_id = meta.get("profile_id")
-        if profile_id:
-            try:
-                user_profile = UserProfile.objects.get(id=profile_id)
-            except UserProfile.DoesNotExist:
-                user_profile = None
+    pending = request.session.get("pending_payment") or {}
+    if pending.get("pi") != pi.id:
+        pending = {"pi": pi.id, "since": time.time()}
+        request.session["pending_payment"] = pending
+    elif time.time() - pending["since"] >= _finalise_timeout():
+        # A reload (or the no-JS refresh) after the webhook timed out
+        return redirect(
+            _finish_checkout(request, _create_order_from_return(request, pi)))
 
-        order, created = Order.objects.get_or_create(
-            stripe_pid=pi.id,
-            defaults=dict(
-                full_name=meta.get("full_name", ""),
-                email=meta.get("email", ""),
-                phone_number=meta.get("phone_number", ""),
-                address1=meta.get("address1", ""),
-                address2=meta.get("address2", ""),
-                city=meta.get("city", ""),
-                county=meta.get("county", ""),
-                postcode=meta.get("postcode", ""),
-                country=meta.get("country", ""),
-                order_total=order_total,
-                delivery_cost=delivery_cost,
-                grand_total=grand_total,
-                original_bag=json.dumps(bag_from_meta),
-                user_profile=user_profile,
-            ),
-        )
-        if created:
-            for item in items:
-                OrderLineItem.objects.create(
-                    order=order,
-                    product=item["product"],
-                    quantity=item["qty"],
-                )
-            try:
-                send_order_confirmation(order)
-            except Exception as e:
-                logger.exception(
-                    "Order %s created via return-url; email failed: %s",
-                    order.order_number,
-                    e,
-                )
-    else:
-        # Last fallback
-        (
-            bag,
-            items,
-            order_total,
-            delivery_cost,
-            grand_total,
-            _,
-        ) = _bag_summary(request)
-        data = request.session.get("checkout_data", {})
-        if not bag or not data:
-            messages.info(
-                request,
-                (
-                    "Payment received. We're finalising your order; "
-                    "it will appear in your profile shortly."
-                ),
-            )
-            request.session["bag"] = {}
-            request.session.pop("checkout_data", None)
-            return redirect("profiles:profile")
-
-        order, created = Order.objects.get_or_create(
-            stripe_pid=pi.id,
-            defaults=dict(
-                full_name=data.get("full_name", ""),
-                email=data.get("email", ""),
-                phone_number=data.get("phone_number", ""),
-                address1=data.get("address1", ""),
-                address2=data.get("address2", ""),
-                city=data.get("city", ""),
-                county=data.get("county", ""),
-                postcode=data.get("postcode", ""),
-                country=data.get("country", ""),
-                order_total=order_total,
-                delivery_cost=delivery_cost,
-                grand_total=grand_total,
-                original_bag=json.dumps(bag),
-                user_profile=(
-                    getattr(request.user, "userprofile", None)
-                    if request.user.is_authenticated
-                    else None
-                ),
-            ),
-        )
-        if created:
-            for item in items:
-                OrderLineItem.objects.create(
-                    order=order,
-                    product=item["product"],
-                    quantity=item["qty"],
-                )
-            try:
-                send_order_confirmation(order)
-            except Exception as e:
-                logger.exception(
-                    (
-                        "Order is created via return-url; "
-                        "email failed: %s"
-                    ),
-                    order.order_number,
-                    e,
-                )
+    return render(request, "checkout/finalising.html", {
+        "status_url": reverse("checkout:order_status"),
+        "poll_interval_ms": 1000,
+    })
 
-    request.session["bag"] = {}
-    request.session.pop("checkout_data", None)
-    messages.success(
-        request,
-        f"Payment received. Your order number is {order.order_number}.",
-    )
-    return redirect(
-        "checkout:checkout_success",
-        order_number=order.order_number,
-    )
+
+@require_http_methods(["GET"])
+def order_status(request):
+    """
+    JSON poll target for the finalising page: one indexed lookup by
+    PaymentIntent id. Only once the webhook has had
+    CHECKOUT_FINALISE_TIMEOUT seconds does it fall back to creating the
+    order here.
+    """
+    pending = request.session.get("pending_payment") or {}
+    pi_id = pending.get("pi")
+    if not pi_id:
+        return JsonResponse({"status": "unknown"}, status=404)
+
+    order = (
+        Order.objects.filter(stripe_pid=pi_id).only("order_number").first())
+    if order is None:
+        if time.time() - pending["since"] < _finalise_timeout():
+            return JsonResponse({"status": "pending"})
+        try:
+            pi = _retrieve_intent(pi_id)
+        except Exception:
+            logger.exception("Could not retrieve %s for fallback", pi_id)
+            return JsonResponse({"status": "pending"})
+        order = _create_order_from_return(request, pi)
+
+    return JsonResponse({
+        "status": "ready",
+        "redirect": _finish_checkout(request, order),
+    })
 
 
 def checkout_success(request, order_number):
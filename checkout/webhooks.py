@@ -0,0 +1,132 @@
+"""
+Stripe webhook inbox processing.
+
+``stripe_webhook`` only verifies and records events (``WebhookEvent``);
+``process_pending`` is run by the ``process_webhooks`` worker. Each
+batch is claimed with ``select_for_update(skip_locked=True)``, so any
+number of workers can drain the inbox in parallel without handling an
+event twice, and each event runs in its own savepoint so one bad event
+doesn't roll back its neighbours. Failures are retried with the same
+backoff as the email outbox.
+"""
+import json
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from profiles.models import UserProfile
+from .models import WebhookEvent
+from .orders import OrderBuilder
+from .outbox import backoff
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+def payment_intent_succeeded(pi):
+    """Create the Order for a succeeded PaymentIntent, once."""
+    stripe_pid = pi["id"]
+    metadata = pi.get("metadata", {}) or {}
+
+    try:
+        bag = json.loads(metadata.get("bag", "{}"))
+    except Exception:
+        bag = {}
+
+    user_profile = None
+    profile_id = metadata.get("profile_id")
+    if profile_id:
+        try:
+            user_profile = UserProfile.objects.get(id=profile_id)
+        except UserProfile.DoesNotExist:
+            user_profile = None
+
+    with transaction.atomic():
+        order, created = OrderBuilder(
+            bag, metadata, stripe_pid=stripe_pid, user_profile=user_profile,
+        ).build()
+        if not created:
+            # The return-url fallback got there first
+            return order
+
+        if user_profile and metadata.get("save_info") == "true":
+            p = user_profile
+            p.full_name = metadata.get("full_name", p.full_name)
+            p.email = metadata.get("email", p.email)
+            p.phone_number = metadata.get(
+                "phone_number",
+                p.phone_number,
+            )
+            p.address1 = metadata.get("address1", p.address1)
+            p.address2 = metadata.get("address2", p.address2)
+            p.city = metadata.get("city", p.city)
+            p.county = metadata.get("county", p.county)
+            p.postcode = metadata.get("postcode", p.postcode)
+            p.country = metadata.get("country", p.country)
+            p.save()
+
+    logger.info(
+        "Order %s created by webhook for %s",
+        order.order_number,
+        stripe_pid,
+    )
+    return order
+
+
+HANDLERS = {
+    "payment_intent.succeeded": lambda event: payment_intent_succeeded(
+        event["data"]["object"]),
+}
+
+
+def record(event):
+    """
+    Store a verified event. Returns False if it was already recorded
+    (a Stripe retry) or isn't one we handle.
+    """
+    if event["type"] not in HANDLERS:
+        return False
+    _, created = WebhookEvent.objects.get_or_create(
+        event_id=event["id"],
+        defaults={"type": event["type"], "payload": event},
+    )
+    return created
+
+
+def process_pending(batch_size=20, max_attempts=MAX_ATTEMPTS):
+    """Process one batch of pending events. Returns (done, failed)."""
+    done = failed = 0
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(
+                status=WebhookEvent.PENDING,
+                next_attempt_at__lte=timezone.now(),
+            )
+            .order_by("next_attempt_at", "id")[:batch_size]
+        )
+        for event in events:
+            event.attempts += 1
+            try:
+                with transaction.atomic():
+                    HANDLERS[event.type](event.payload)
+            except Exception as e:
+                logger.exception(
+                    "Webhook event %s failed: %s", event.event_id, e)
+                failed += 1
+                event.last_error = repr(e)
+                if event.attempts >= max_attempts:
+                    event.status = WebhookEvent.FAILED
+                else:
+                    event.next_attempt_at = (
+                        timezone.now() + backoff(event.attempts))
+            else:
+                done += 1
+                event.status = WebhookEvent.PROCESSED
+                event.processed_at = timezone.now()
+            event.save(update_fields=[
+                "attempts", "last_error", "status", "next_attempt_at",
+                "processed_at"])
+    return done, failed
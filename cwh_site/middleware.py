@@ -0,0 +1,194 @@
+"""
+Request instrumentation: ServerTimingMiddleware and
+QueryBudgetMiddleware.
+
+Server timing
+-------------
+
+``ServerTimingMiddleware`` times a sample of requests
+(SERVER_TIMING_SAMPLE_RATE) by phase, via the hooks in cwh_site.timing,
+plus ``db`` time from an execute wrapper. Each sampled request gets one
+``cwh_site.timing`` log line whose ``timing`` extra carries the numbers
+for structured log handlers, and a ``Server-Timing`` header if it comes
+from staff or SERVER_TIMING_HEADER is on (by default only in DEBUG).
+Unsampled requests pay for one random number.
+
+Query budgets
+-------------
+
+
+``QueryBudgetMiddleware`` counts the queries each request runs (through
+``connection.execute_wrapper``, so it works without DEBUG) and checks
+them against a budget per URL name::
+
+    QUERY_BUDGETS = {"products:list": 8, "products:detail": 6}
+    QUERY_BUDGET_DEFAULT = 20
+
+It also groups the queries by shape (the SQL with its parameters left
+out and IN lists collapsed), and a shape run QUERY_BUDGET_REPEAT times
+or more in one request is reported as a likely N+1. Over-budget and
+N+1 requests are logged as warnings, or raise QueryBudgetExceeded when
+QUERY_BUDGET_ACTION is "raise" (what the tests use).
+
+Off unless QUERY_BUDGET_ENABLED (DEBUG by default), and then the only
+cost is a counter per query.
+"""
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger("cwh_site.timing")
+
+DEFAULT_BUDGET = 20
+DEFAULT_REPEAT = 3
+
+# "IN (%s, %s, %s)" and multi-row VALUES differ only by batch size
+_PLACEHOLDER_LIST = re.compile(r"%s(?:\s*,\s*%s)+")
+_VALUES_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+_IGNORED = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql):
+    shape = _PLACEHOLDER_LIST.sub("%s", sql)
+    return _VALUES_ROWS.sub(r"\1", shape)
+
+
+class QueryLog:
+    """Execute wrapper that counts queries, and their shapes."""
+
+    def __init__(self):
+        self.count = 0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if not sql.startswith(_IGNORED):
+            self.shapes[query_shape(sql)] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """[(shape, times)] run at least ``threshold`` times."""
+        return [
+            (shape, times) for shape, times in self.shapes.most_common()
+            if times >= threshold
+        ]
+
+
+def budget_for(view_name):
+    budgets = getattr(settings, "QUERY_BUDGETS", {})
+    return budgets.get(
+        view_name, getattr(settings, "QUERY_BUDGET_DEFAULT", DEFAULT_BUDGET))
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "QUERY_BUDGET_ENABLED", settings.DEBUG):
+            return self.get_response(request)
+
+        log = QueryLog()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(log))
+            response = self.get_response(request)
+
+        self.check(request, log)
+        return response
+
+    def check(self, request, log):
+        match = request.resolver_match
+        view_name = match.view_name if match else request.path
+        budget = budget_for(view_name)
+        repeated = log.repeated(
+            getattr(settings, "QUERY_BUDGET_REPEAT", DEFAULT_REPEAT))
+
+        problems = []
+        if log.count > budget:
+            problems.append(
+                f"{log.count} queries, over the budget of {budget}")
+        for shape, times in repeated:
+            problems.append(f"N+1: {times}x {shape[:200]}")
+        if not problems:
+            return
+
+        message = f"{request.method} {request.path} ({view_name}): " + (
+            "; ".join(problems))
+        if getattr(settings, "QUERY_BUDGET_ACTION", "log") == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def _db_timer(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add("db", (time.perf_counter() - started) * 1000)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = getattr(settings, "SERVER_TIMING_SAMPLE_RATE", 0.0)
+        if not rate or random.random() >= rate:
+            return self.get_response(request)
+
+        timings, token = timing.start()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(conn.execute_wrapper(_db_timer))
+                response = self.get_response(request)
+        finally:
+            timing.stop(token)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        if self._show_header(request):
+            response["Server-Timing"] = timings.header(total_ms)
+        match = request.resolver_match
+        phases = {
+            name: {"ms": round(ms, 1), "count": n}
+            for name, (ms, n) in timings.phases.items()
+        }
+        timing_logger.info(
+            "%s %s %s %.1fms %s",
+            request.method, request.path, response.status_code, total_ms,
+            " ".join(
+                f"{name}={p['ms']}ms/{p['count']}"
+                for name, p in phases.items()),
+            extra={"timing": {
+                "method": request.method,
+                "path": request.path,
+                "view": match.view_name if match else None,
+                "status": response.status_code,
+                "total_ms": round(total_ms, 1),
+                "phases": phases,
+            }},
+        )
+        return response
+
+    @staticmethod
+    def _show_header(request):
+        """Everyone with SERVER_TIMING_HEADER on, otherwise staff only."""
+        if getattr(settings, "SERVER_TIMING_HEADER", False):
+            return True
+        user = getattr(request, "user", None)
+        return bool(user and user.is_staff)
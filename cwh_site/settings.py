@@ -80,9 +80,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so "total" covers the whole stack
+    "cwh_site.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     # WhiteNoise for static files on Heroku
     "whitenoise.middleware.WhiteNoiseMiddleware",
+    # Query counts per view against QUERY_BUDGETS (see below)
+    "cwh_site.middleware.QueryBudgetMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -92,11 +96,45 @@ MIDDLEWARE = [
     "allauth.account.middleware.AccountMiddleware",
 ]
 
+# Server-Timing header and cwh_site.timing log line for this fraction of
+# requests (see cwh_site.middleware.ServerTimingMiddleware). The header
+# shows internal timings, so only staff get it unless
+# SERVER_TIMING_HEADER is on (the default in DEBUG); the log line is
+# written either way.
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get(
+    "SERVER_TIMING_SAMPLE_RATE", 1.0 if DEBUG else 0.05))
+SERVER_TIMING_HEADER = os.environ.get(
+    "SERVER_TIMING_HEADER", str(DEBUG)).lower() in ("1", "true", "yes")
+
+# Per-view SQL query budgets, checked by QueryBudgetMiddleware when
+# enabled (DEBUG by default). "log" warns; "raise" fails the request.
+# A query shape repeated QUERY_BUDGET_REPEAT times is flagged as N+1.
+QUERY_BUDGET_ENABLED = os.environ.get(
+    "QUERY_BUDGET_ENABLED", str(DEBUG)).lower() in ("1", "true", "yes")
+QUERY_BUDGET_ACTION = os.environ.get("QUERY_BUDGET_ACTION", "log")
+QUERY_BUDGET_DEFAULT = 20
+QUERY_BUDGET_REPEAT = 3
+QUERY_BUDGETS = {
+    "home": 6,
+    "products:list": 8,
+    "products:category": 8,
+    "products:detail": 7,
+    "bag:view_bag": 4,
+    "checkout:checkout": 8,
+    "checkout:order_status": 4,
+    "checkout:checkout_success": 4,
+    "checkout:order_detail": 6,
+    "products:wishlist": 4,
+    "products:product_review": 5,
+    "profiles:profile": 5,
+}
+
 ROOT_URLCONF = "cwh_site.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # Django templates with render time reported to Server-Timing
+        "BACKEND": "cwh_site.timing.TimedDjangoTemplates",
         "DIRS": [
             os.path.join(BASE_DIR, "templates"),
             os.path.join(BASE_DIR, "templates", "allauth"),
@@ -162,6 +200,27 @@ else:
         }
     }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default, which is per process and only fit for
+# development: in production point CACHE_BACKEND / CACHE_LOCATION at a
+# shared cache, database (run createcachetable) or Redis, so a catalog
+# change made by one process invalidates every other process's copies.
+# ``check --deploy`` (products.checks) fails while it is local memory.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get(
+            "CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.environ.get("CACHE_LOCATION", "cwh-site"),
+    }
+}
+
+# Seconds a catalog entry may live; changes invalidate it sooner
+CATALOG_CACHE_TIMEOUT = int(os.environ.get("CATALOG_CACHE_TIMEOUT", 900))
+
 CSRF_TRUSTED_ORIGINS = [
     "https://*.codeinstitute-ide.net/",
     "https://*.herokuapp.com",
@@ -243,6 +302,19 @@ STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
 STRIPE_CURRENCY = os.environ.get("STRIPE_CURRENCY", "gbp")
 # Convert pounds to pence
 STRIPE_PRICE_MULTIPLIER = 100
+# API client (checkout.payments). Point STRIPE_API_BASE at a
+# FakeStripeServer (see checkout/fake_stripe.py) to run offline.
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE") or None
+STRIPE_CONNECT_TIMEOUT = float(os.environ.get("STRIPE_CONNECT_TIMEOUT", 3))
+STRIPE_READ_TIMEOUT = float(os.environ.get("STRIPE_READ_TIMEOUT", 10))
+STRIPE_MAX_RETRIES = int(os.environ.get("STRIPE_MAX_RETRIES", 2))
+STRIPE_POOL_SIZE = int(os.environ.get("STRIPE_POOL_SIZE", 10))
+# Seconds the return page waits on the webhook before creating the
+# order itself
+CHECKOUT_FINALISE_TIMEOUT = 10
+# Minutes checkout holds stock for an unpaid PaymentIntent; run the
+# release_reservations command to put expired holds back on sale
+STOCK_RESERVATION_MINUTES = 15
 
 stripe.api_key = STRIPE_SECRET_KEY
 
@@ -0,0 +1,41 @@
+"""
+Test helpers for query budgets (see cwh_site.middleware).
+
+``QueryBudgetMixin.assertQueryBudget(url, expected)`` requests ``url``
+with QueryBudgetMiddleware set to raise, pins its exact query count and
+checks the pin is within the view's QUERY_BUDGETS entry, so an N+1 or a
+budget breach fails the test that covers the view.
+"""
+from django.test import override_settings
+from django.urls import URLPattern, URLResolver, get_resolver, resolve
+
+from .middleware import budget_for
+
+
+def url_names(patterns=None, namespace=None):
+    """Every namespaced URL name in the project's URLconf."""
+    names = set()
+    for pattern in patterns or get_resolver().url_patterns:
+        if isinstance(pattern, URLResolver):
+            inner = pattern.namespace
+            if namespace and inner:
+                inner = f"{namespace}:{inner}"
+            names |= url_names(pattern.url_patterns, inner or namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(
+                f"{namespace}:{pattern.name}" if namespace else pattern.name)
+    return names
+
+
+class QueryBudgetMixin:
+    def assertQueryBudget(self, url, expected, status=200):
+        view_name = resolve(url.split("?")[0]).view_name
+        with override_settings(
+                QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_ACTION="raise"), \
+                self.assertNumQueries(expected):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status, url)
+        self.assertLessEqual(
+            expected, budget_for(view_name),
+            f"{view_name} is pinned above its query budget")
+        return response
@@ -0,0 +1,223 @@
+import logging
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from checkout.models import Order, OrderLineItem
+from products.models import Category, Product, ProductImage, ProductReview
+from products.models import Wishlist
+from . import timing
+from .middleware import QueryBudgetExceeded, QueryBudgetMiddleware
+from .testing import QueryBudgetMixin, url_names
+
+# Views without a GET page to pin, or pinned elsewhere
+NOT_PINNED = {
+    "bag:add_to_bag", "bag:adjust_bag", "bag:remove_from_bag",  # POST
+    "products:wishlist_toggle",  # POST
+    "checkout:cache_checkout_data", "checkout:stripe_webhook",  # POST
+    # Need a PaymentIntent; see checkout.tests
+    "checkout:checkout", "checkout:checkout_paid", "checkout:order_status",
+    # Staff only
+    "products:admin_product_list", "products:product_create",
+    "products:product_update", "products:product_delete",
+    "products:product_import", "products:product_export",
+    "products:product_bulk_action",
+}
+APP_NAMESPACES = ("bag", "checkout", "policies", "products", "profiles")
+
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+@override_settings(STORAGES=TEST_STORAGES, MEDIA_ROOT='/tmp/cwh-test-media')
+class PublicViewQueryTests(QueryBudgetMixin, TestCase):
+    """Pins the query count of every public page, cold and warm cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('shopper', password='pw')
+        category = Category.objects.create(name='Mugs')
+        cls.products = [
+            Product.objects.create(
+                name=f'Mug {i}', price=Decimal('12.00'), category=category)
+            for i in range(12)
+        ]
+        cls.product = cls.products[0]
+        for i in range(3):
+            ProductImage.objects.create(
+                product=cls.product, alt_text=f'Side {i}',
+                image=SimpleUploadedFile(f'mug{i}.gif', b'GIF89a'))
+        for i in range(4):
+            ProductReview.objects.create(
+                product=cls.product, rating=4, approved=True,
+                user=User.objects.create_user(f'reviewer{i}'),
+                title='Good', body='Holds tea.')
+        for p in cls.products[:5]:
+            Wishlist.objects.create(user=cls.user, product=p)
+        cls.order = Order.objects.create(
+            full_name='A', email='a@b.com', phone_number='1',
+            address1='x', city='t', postcode='z', country='GB',
+            user_profile=cls.user.userprofile)
+        for p in cls.products[:5]:
+            OrderLineItem.objects.create(
+                order=cls.order, product=p, quantity=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def pages(self):
+        """(url name, url, logged in, cold queries, warm queries)"""
+        order_number = self.order.order_number
+        return [
+            ('home', reverse('home'), False, 2, 0),
+            ('products:list', reverse('products:list'), False, 4, 0),
+            ('products:category', reverse(
+                'products:category', args=['mugs']), False, 3, 1),
+            ('products:detail', reverse(
+                'products:detail', args=[self.product.slug]), False, 3, 1),
+            ('bag:view_bag', reverse('bag:view_bag'), False, 0, 0),
+            ('policies:delivery', reverse('policies:delivery'), False, 0, 0),
+            ('policies:terms', reverse('policies:terms'), False, 0, 0),
+            ('policies:faqs', reverse('policies:faqs'), False, 0, 0),
+            ('checkout:checkout_success', reverse(
+                'checkout:checkout_success', args=[order_number]),
+             False, 1, 1),
+            ('checkout:order_detail', reverse(
+                'checkout:order_detail', args=[order_number]), True, 5, 5),
+            ('products:wishlist', reverse('products:wishlist'), True, 3, 3),
+            ('products:product_review', reverse(
+                'products:product_review', args=[self.product.slug]),
+             True, 4, 4),
+            ('profiles:profile', reverse('profiles:profile'), True, 4, 4),
+        ]
+
+    def test_bag_lines_cost_no_extra_queries(self):
+        s = self.client.session
+        s['bag'] = {str(p.id): 1 for p in self.products}
+        s.save()
+        # session + one product query for all twelve lines
+        self.assertQueryBudget(reverse('bag:view_bag'), 2)
+
+    def test_every_public_view_is_pinned(self):
+        names = {
+            name for name in url_names()
+            if name.split(':')[0] in APP_NAMESPACES or name == 'home'
+        }
+        pinned = {page[0] for page in self.pages()}
+        self.assertEqual(names - NOT_PINNED - pinned, set())
+
+    def test_public_view_query_counts(self):
+        for name, url, logged_in, cold, warm in self.pages():
+            with self.subTest(name):
+                if logged_in:
+                    self.client.force_login(self.user)
+                else:
+                    self.client.logout()
+                cache.clear()
+                self.assertQueryBudget(url, cold)
+                self.assertQueryBudget(url, warm)
+
+
+@override_settings(
+    QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_ACTION='log',
+    QUERY_BUDGET_DEFAULT=5, QUERY_BUDGET_REPEAT=3)
+class QueryBudgetMiddlewareTests(TestCase):
+    def _run(self, view):
+        request = RequestFactory().get('/somewhere/')
+        request.resolver_match = None
+        return QueryBudgetMiddleware(view)(request)
+
+    def test_repeated_shapes_are_flagged_as_n_plus_one(self):
+        products = [
+            Product.objects.create(name=f'P{i}', price=Decimal('1.00'))
+            for i in range(3)
+        ]
+
+        def view(request):
+            for p in products:
+                Product.objects.filter(pk=p.pk).first()
+            Product.objects.filter(pk__in=[1, 2]).count()
+            Product.objects.filter(pk__in=[1, 2, 3]).count()
+            return HttpResponse()
+
+        with self.assertLogs('cwh_site.middleware', logging.WARNING) as logs:
+            self._run(view)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('N+1: 3x SELECT', logs.output[0])
+        # IN lists of different lengths are one shape, run twice
+        self.assertNotIn('COUNT', logs.output[0])
+
+    def test_budget_breach_raises_when_configured(self):
+        def view(request):
+            with connection.cursor() as cursor:
+                for i in range(6):
+                    cursor.execute(f'SELECT {i}')
+            return HttpResponse()
+
+        with override_settings(QUERY_BUDGET_ACTION='raise'), \
+                self.assertRaisesMessage(
+                    QueryBudgetExceeded, '6 queries, over the budget of 5'):
+            self._run(view)
+
+        with override_settings(QUERY_BUDGET_ENABLED=False), \
+                self.assertNoLogs('cwh_site.middleware'):
+            self._run(view)
+
+
+@override_settings(STORAGES=TEST_STORAGES, MEDIA_ROOT='/tmp/cwh-test-media')
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(
+            name='Mug', price=Decimal('12.00'))
+        ProductImage.objects.create(
+            product=self.product,
+            image=SimpleUploadedFile('mug.gif', b'GIF89a'))
+        self.url = reverse('products:detail', args=[self.product.slug])
+
+    @override_settings(
+        SERVER_TIMING_SAMPLE_RATE=1.0, SERVER_TIMING_HEADER=True)
+    def test_sampled_request_reports_phases(self):
+        with self.assertLogs('cwh_site.timing', logging.INFO) as logs:
+            r = self.client.get(self.url)
+        header = r['Server-Timing']
+        for name in ('db', 'template', 'cache', 'images', 'total'):
+            self.assertIn(f'{name};dur=', header)
+
+        record = logs.records[0].timing
+        self.assertEqual(record['view'], 'products:detail')
+        self.assertEqual(record['status'], 200)
+        # Nested template renders count once
+        self.assertEqual(record['phases']['template']['count'], 1)
+        self.assertGreaterEqual(record['phases']['db']['count'], 2)
+
+    @override_settings(
+        SERVER_TIMING_SAMPLE_RATE=1.0, SERVER_TIMING_HEADER=False)
+    def test_header_is_for_staff_only_by_default(self):
+        with self.assertLogs('cwh_site.timing', logging.INFO):
+            r = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', r)
+
+        self.client.force_login(
+            User.objects.create(username='staff', is_staff=True))
+        r = self.client.get(self.url)
+        self.assertIn('total;dur=', r['Server-Timing'])
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_untouched(self):
+        with self.assertNoLogs('cwh_site.timing'):
+            r = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', r)
+        # Hooks outside a sampled request are no-ops
+        with timing.phase('stripe'):
+            timing.add('db', 1.0)
+        self.assertIsNone(timing.current())
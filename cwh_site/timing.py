@@ -0,0 +1,103 @@
+"""
+Per-request phase timings for the Server-Timing header.
+
+``ServerTimingMiddleware`` (cwh_site.middleware) starts a ``Timings``
+for a sampled request; code anywhere below it reports time with::
+
+    with timing.phase("stripe"):
+        ...
+
+or ``timing.add("stripe", ms)`` for time measured elsewhere. Outside a
+sampled request both are no-ops costing one context-variable lookup.
+A phase entered again while already running (a template rendering a
+template) is only counted once.
+
+Phases recorded out of the box: ``db`` (the middleware's execute
+wrapper), ``template`` (``TimedDjangoTemplates``, the TEMPLATES
+backend), ``bag`` (BagSummary lines, i.e. the mini bag), ``cache``
+(catalog and card cache reads and writes), ``images`` (storage URL
+builds) and ``stripe`` (checkout.payments). Phases overlap: SQL run by
+a lazy queryset inside a template counts towards both.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates
+
+_current = ContextVar("server_timing", default=None)
+
+
+class Timings:
+    def __init__(self):
+        self.phases = {}
+        self._active = set()
+
+    def add(self, name, ms, count=1):
+        total, n = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (total + ms, n + count)
+
+    def header(self, total_ms):
+        parts = [
+            f'{name};dur={ms:.1f};desc="{n}x"'
+            for name, (ms, n) in self.phases.items()
+        ]
+        parts.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(parts)
+
+
+def start():
+    """Begin collecting for this request; returns (timings, token)."""
+    timings = Timings()
+    return timings, _current.set(timings)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def add(name, ms, count=1):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, ms, count)
+
+
+@contextmanager
+def phase(name):
+    timings = _current.get()
+    if timings is None or name in timings._active:
+        yield
+        return
+    timings._active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings._active.discard(name)
+        timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+class TimedTemplate:
+    """A backend template whose render() is timed as ``template``."""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        with phase("template"):
+            return self._template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
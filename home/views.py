@@ -1,5 +1,6 @@
 from django.shortcuts import render
 from django.contrib import messages
+from products import cache as catalog_cache
 from products.models import Category, Product
 
 
@@ -12,10 +13,14 @@ def index(request):
         messages.success(
             request, 'Welcome back! Explore our latest creations.')
 
-    categories = Category.objects.filter(
-        is_active=True).order_by('sort_order', 'name')[:8]
-    latest_products = Product.objects.filter(
-        is_active=True).order_by('-created_at')[:8]
+    categories = catalog_cache.get_or_set(
+        catalog_cache.CATEGORIES, 'home', lambda: list(
+            Category.objects.filter(
+                is_active=True).order_by('sort_order', 'name')[:8]))
+    latest_products = catalog_cache.get_or_set(
+        catalog_cache.PRODUCT_LIST, 'latest', lambda: list(
+            Product.objects.filter(
+                is_active=True).order_by('-created_at')[:8]))
 
     context = {
         'categories': categories,
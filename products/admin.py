@@ -17,9 +17,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'is_active')
+    list_display = (
+        'name', 'category', 'price', 'stock', 'reserved', 'is_active')
     list_filter = ('category', 'is_active')
     search_fields = ('name', 'sku')
+    readonly_fields = ('reserved',)
     inlines = [ProductImageInLine]
     prepopulated_fields = {'slug': ('name',)}
 
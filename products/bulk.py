@@ -0,0 +1,59 @@
+"""
+Bulk edits for the staff product list.
+
+Each action is one UPDATE over whatever queryset it is given, whether
+that is the ticked rows or every product matching the list's filters.
+``updated_at`` is set too, because cached product cards are keyed on
+it; the facet counts are rebuilt and the catalog cache is bumped when
+the transaction commits.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Least, Round
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from . import facets, search
+
+ACTIONS = {
+    "activate": "Activate",
+    "deactivate": "Deactivate",
+    "set_category": "Move to category",
+    "adjust_price": "Adjust price by %",
+}
+
+# Product.price is max_digits=6, decimal_places=2
+MAX_PRICE = Decimal("9999.99")
+
+
+def apply(products, action, category=None, percent=None):
+    """
+    Run ``action`` on the ``products`` queryset; returns how many
+    products were changed.
+    """
+    changes = {"updated_at": timezone.now()}
+    if action == "activate":
+        changes["is_active"] = True
+    elif action == "deactivate":
+        changes["is_active"] = False
+    elif action == "set_category":
+        changes["category"] = category
+    elif action == "adjust_price":
+        factor = (Decimal(100) + percent) / Decimal(100)
+        changes["price"] = Least(
+            Greatest(Round(F("price") * Value(factor), 2), Value(Decimal(0))),
+            Value(MAX_PRICE),
+        )
+    else:
+        raise ValueError(f"Unknown bulk action {action!r}")
+
+    with transaction.atomic():
+        changed = products.order_by().update(**changes)
+        if action == "set_category" and category is not None:
+            # The category name is part of each product's search text
+            search.index_category(category.pk)
+        facets.rebuild()
+        catalog_cache.bump_on_commit()
+    return changed
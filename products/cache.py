@@ -0,0 +1,95 @@
+"""
+Versioned cache for catalog data.
+
+Every key embeds the current catalog version, so invalidation is a
+single ``bump()``: entries written under older versions are never read
+again and simply age out. The version is bumped from the model signals
+in ``products.signals`` whenever a product, image, category or review
+changes, so nothing needs key scans or deletes. The version must be
+shared by every process that serves or changes the catalog, so outside
+DEBUG the default cache has to be a shared backend (database, file on
+a shared disk or Redis), not local memory; products.checks fails
+``check --deploy`` otherwise.
+
+``get_or_set`` is the cache-aside helper the views use::
+
+    categories = catalog_cache.get_or_set(
+        catalog_cache.CATEGORIES, "nav", lambda: list(qs))
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from cwh_site import timing
+
+VERSION_KEY = "catalog:version"
+
+# Namespaces
+CATEGORIES = "categories"
+PRODUCT_LIST = "product-list"
+PRODUCT_DETAIL = "product-detail"
+COUNTS = "counts"
+FACETS = "facets"
+
+DEFAULT_TIMEOUT = 60 * 15
+
+
+def _timeout():
+    return getattr(settings, "CATALOG_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+def version():
+    """
+    The current catalog version. A missing key (first use, eviction or
+    a cleared cache) starts from the clock rather than 1 so a persistent
+    backend can't hand back entries left over from an earlier run.
+    """
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        current = cache.get(VERSION_KEY)
+    return current
+
+
+def bump():
+    """Invalidate everything cached under the current version."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_on_commit():
+    """
+    Bump now and again once the surrounding transaction commits, so a
+    request that re-filled the cache from the old rows in between
+    doesn't keep serving them.
+    """
+    bump()
+    transaction.on_commit(bump)
+
+
+def make_key(namespace, *parts):
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f"catalog:{namespace}:{version()}:{digest}"
+
+
+def get_or_set(namespace, parts, compute, timeout=None):
+    """
+    Cache-aside: return the cached value for ``(namespace, parts)`` or
+    call ``compute()``, store its result and return it.
+    """
+    if not isinstance(parts, tuple):
+        parts = (parts,)
+    with timing.phase("cache"):
+        key = make_key(namespace, *parts)
+        value = cache.get(key)
+    if value is None:
+        value = compute()
+        with timing.phase("cache"):
+            cache.set(
+                key, value, _timeout() if timeout is None else timeout)
+    return value
@@ -0,0 +1,116 @@
+"""
+Cached product-card fragments.
+
+Each card is keyed on everything it renders from: the product's id and
+``updated_at`` (name, slug, price), ``images_version`` (primary image)
+and the rating aggregates, which are written with ``update()`` and so
+don't move ``updated_at``. A listing fetches all its cards with one
+``get_many`` and renders and ``set_many``s only the misses.
+
+Hit/miss counts are tallied in process and added to totals in the
+cache at most every STATS_FLUSH_INTERVAL seconds, so they add up across
+worker processes without costing a listing any extra cache round
+trips; see ``stats()`` and the ``card_cache_stats`` command. Backends
+whose ``incr`` isn't atomic (the database cache) may drop a flush that
+races another process's, so treat the totals as approximate.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from cwh_site import timing
+
+CARD_TEMPLATE = "products/partials/_product_card.html"
+# Bump when the card template changes so stale markup isn't served
+CARD_VERSION = 2
+CARD_TIMEOUT = 60 * 60 * 24
+
+HITS_KEY = "catalog:cards:hits"
+MISSES_KEY = "catalog:cards:misses"
+STATS_FLUSH_INTERVAL = 60
+
+# This process's counts not yet added to the cache totals
+_pending = {HITS_KEY: 0, MISSES_KEY: 0}
+_flushed_at = time.monotonic()
+_lock = threading.Lock()
+
+
+def card_key(product):
+    return "catalog:card:{}:{}:{}:{}:{}:{}".format(
+        CARD_VERSION,
+        product.pk,
+        product.updated_at.timestamp() if product.updated_at else "",
+        product.images_version,
+        product.rating_count,
+        product.rating_avg,
+    )
+
+
+def _add(key, n):
+    if not n:
+        return
+    try:
+        cache.incr(key, n)
+    except ValueError:
+        # First count, or the counter was evicted
+        if not cache.add(key, n, timeout=None):
+            cache.incr(key, n)
+
+
+def _count(hits, misses, flush=False):
+    global _flushed_at
+    with _lock:
+        _pending[HITS_KEY] += hits
+        _pending[MISSES_KEY] += misses
+        now = time.monotonic()
+        if not flush and now - _flushed_at < STATS_FLUSH_INTERVAL:
+            return
+        counts = dict(_pending)
+        _pending.update(dict.fromkeys(_pending, 0))
+        _flushed_at = now
+    for key, n in counts.items():
+        _add(key, n)
+
+
+def render_cards(products):
+    """[(product, card_html)] for ``products``, in order."""
+    products = list(products)
+    keys = [card_key(p) for p in products]
+    with timing.phase("cache"):
+        found = cache.get_many(keys)
+
+    missing = {}
+    template = None
+    for product, key in zip(products, keys):
+        if key not in found:
+            template = template or get_template(CARD_TEMPLATE)
+            missing[key] = template.render({"product": product})
+    with timing.phase("cache"):
+        if missing:
+            cache.set_many(missing, CARD_TIMEOUT)
+            found.update(missing)
+        _count(len(keys) - len(missing), len(missing))
+    return [(p, mark_safe(found[key])) for p, key in zip(products, keys)]
+
+
+def stats():
+    """Totals across processes, including this one's unflushed counts."""
+    _count(0, 0, flush=True)
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = counts.get(HITS_KEY, 0)
+    misses = counts.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    with _lock:
+        _pending.update(dict.fromkeys(_pending, 0))
+    cache.delete_many([HITS_KEY, MISSES_KEY])
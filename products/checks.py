@@ -0,0 +1,42 @@
+"""
+System checks for the catalog cache (see products.cache).
+
+Every gunicorn worker, the background worker and one-off management
+commands bump the catalog version in the default cache, so that cache
+must be shared between processes. Local memory is per process: a bump
+in one leaves every other process serving its stale copies until
+CATALOG_CACHE_TIMEOUT. Outside DEBUG ``check --deploy`` (the Procfile's
+release step) fails while it is still in use.
+"""
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+from django.utils.module_loading import import_string
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs=None, **kwargs):
+    if settings.DEBUG:
+        return []
+    backend = settings.CACHES.get(DEFAULT_CACHE_ALIAS, {}).get("BACKEND", "")
+    try:
+        per_process = issubclass(import_string(backend), LocMemCache)
+    except ImportError:
+        # Django's own caches.E001 reports a broken backend
+        return []
+    if not per_process:
+        return []
+    return [
+        Error(
+            "The default cache is local memory, which each process keeps "
+            "separately, so catalog changes are not seen by the other "
+            "processes until their cached pages expire.",
+            hint=(
+                "Set CACHE_BACKEND and CACHE_LOCATION to a shared cache, "
+                "e.g. django.core.cache.backends.db.DatabaseCache with "
+                "a table made by createcachetable, or Redis."
+            ),
+            id="products.E001",
+        )
+    ]
@@ -0,0 +1,251 @@
+"""
+Resized copies of product images for ``srcset``.
+
+Every ProductImage gets a WebP and a JPEG at each of SIZES (the longest
+side, never upscaled), written next to the originals in the default
+storage and recorded in ``ProductImage.derivatives``; the product's
+primary image copy is denormalised onto ``Product`` by
+``sync_primary_image`` so listings, the bag and the wishlist can use it
+without touching the images table. Templates render them with the
+``{% picture %}`` tag (products.templatetags.product_images), which
+falls back to the original file until the copies exist.
+
+The work happens off the request path. Saving an image with a new file
+marks it pending (products.signals), keeping ``derivatives_source`` so
+the worker can delete the old file's copies; the ``process_images`` worker
+leases due images with ``claim_batch`` like the email outbox, so several
+workers can run at once, renders them with ``process`` and retries
+failures with backoff; in production the Procfile's ``run_workers``
+drains it alongside the checkout queues. ``backfill_image_derivatives``
+queues existing images and drains the queue in-process.
+"""
+import io
+import logging
+import posixpath
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# Name -> longest side in pixels. thumb covers the 48-88px bag, wishlist
+# and gallery thumbnails at 2x, card the listing cards, detail the
+# product page.
+SIZES = {
+    "thumb": 160,
+    "card": 480,
+    "detail": 1200,
+}
+# Format -> (Pillow format, save options, file extension)
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}, "webp"),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True},
+             "jpg"),
+}
+JPEG_BACKGROUND = (255, 255, 255)
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 60  # seconds; doubles after each failure
+BACKOFF_MAX = 60 * 60
+LEASE = timedelta(minutes=5)
+
+
+def backoff(attempts):
+    return timedelta(
+        seconds=min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX))
+
+
+def render(source):
+    """
+    Yield (size, width, height, fmt, bytes) for every size and format
+    of the image file ``source``, largest size first.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert(
+                "RGBA" if "transparency" in image.info
+                or image.mode in ("LA", "PA") else "RGB")
+        # Each size is scaled down from the one before it, which is
+        # much cheaper than going back to the full-size original
+        for size, longest in sorted(
+                SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail(
+                (longest, longest), Image.Resampling.LANCZOS,
+                reducing_gap=3.0)
+            flat = image
+            if image.mode == "RGBA":
+                flat = Image.new("RGB", image.size, JPEG_BACKGROUND)
+                flat.paste(image, mask=image.getchannel("A"))
+            for fmt, (pil_format, options, _ext) in FORMATS.items():
+                buffer = io.BytesIO()
+                (image if fmt == "webp" else flat).save(
+                    buffer, pil_format, **options)
+                yield size, image.width, image.height, fmt, buffer.getvalue()
+
+
+def _copy_name(image_pk, source, size, fmt):
+    stem = posixpath.splitext(posixpath.basename(source))[0]
+    return f"derivatives/{image_pk}/{stem}-{size}.{FORMATS[fmt][2]}"
+
+
+def derivative_name(image, size, fmt):
+    return _copy_name(image.pk, image.image.name, size, fmt)
+
+
+def _remove(storage, name):
+    if storage.exists(name):
+        storage.delete(name)
+
+
+def delete_copies(storage, image_pk, source):
+    """
+    Delete the copies of image ``image_pk`` made from its file
+    ``source``, if any.
+    """
+    if not source:
+        return
+    for size in SIZES:
+        for fmt in FORMATS:
+            _remove(storage, _copy_name(image_pk, source, size, fmt))
+
+
+def process(image):
+    """
+    Render and store the copies of one ProductImage and record their
+    URLs, deleting the copies of the file it had before. Returns False
+    if the image's file changed meanwhile (it has been queued again).
+    """
+    storage = image.image.storage
+    source = image.image.name
+    if image.derivatives_source != source:
+        delete_copies(storage, image.pk, image.derivatives_source)
+
+    derivatives = {}
+    with storage.open(source, "rb") as original:
+        for size, width, height, fmt, data in render(original):
+            name = derivative_name(image, size, fmt)
+            # Replace a copy from an earlier or failed attempt rather
+            # than saving a suffixed one next to it
+            _remove(storage, name)
+            name = storage.save(name, ContentFile(data))
+            entry = derivatives.setdefault(
+                size, {"width": width, "height": height})
+            entry[fmt] = storage.url(name)
+
+    with transaction.atomic():
+        done = ProductImage.objects.filter(pk=image.pk, image=source).update(
+            derivatives=derivatives,
+            derivatives_source=source,
+            derivatives_status=ProductImage.DERIVATIVES_DONE,
+            derivatives_error="",
+        )
+        if done:
+            Product.sync_primary_image(image.product_id)
+    return bool(done)
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to ``batch_size`` due images to this worker by pushing
+    their derivatives_due_at past the lease time.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        images = list(
+            ProductImage.objects.select_for_update(skip_locked=True)
+            .filter(
+                derivatives_status=ProductImage.DERIVATIVES_PENDING,
+                derivatives_due_at__lte=now,
+            )
+            .order_by("derivatives_due_at", "id")[:batch_size]
+        )
+        ProductImage.objects.filter(pk__in=[i.pk for i in images]).update(
+            derivatives_due_at=now + LEASE)
+    return images
+
+
+def process_batch(images, max_attempts=MAX_ATTEMPTS):
+    """Process claimed ``images``. Returns (done, failed)."""
+    done = failed = 0
+    for image in images:
+        if not image.image:
+            delete_copies(
+                image.image.storage, image.pk, image.derivatives_source)
+            ProductImage.objects.filter(pk=image.pk, image="").update(
+                derivatives={}, derivatives_source="",
+                derivatives_status=ProductImage.DERIVATIVES_DONE)
+            continue
+        image.derivatives_attempts += 1
+        try:
+            process(image)
+        except Exception as e:
+            logger.exception(
+                "Image derivatives for %s failed: %s", image.pk, e)
+            failed += 1
+            status = ProductImage.DERIVATIVES_PENDING
+            due_at = timezone.now() + backoff(image.derivatives_attempts)
+            if image.derivatives_attempts >= max_attempts:
+                status = ProductImage.DERIVATIVES_FAILED
+            ProductImage.objects.filter(
+                pk=image.pk, image=image.image.name).update(
+                derivatives_status=status,
+                derivatives_attempts=image.derivatives_attempts,
+                derivatives_due_at=due_at,
+                derivatives_error=repr(e),
+            )
+            continue
+        done += 1
+    if done:
+        # Cached product pages hold the gallery images
+        catalog_cache.bump_on_commit()
+    return done, failed
+
+
+def drain(batch_size=20, max_attempts=MAX_ATTEMPTS):
+    """Process every image currently due. Returns (done, failed)."""
+    total_done = total_failed = 0
+    while True:
+        images = claim_batch(batch_size)
+        if not images:
+            return total_done, total_failed
+        done, failed = process_batch(images, max_attempts=max_attempts)
+        total_done += done
+        total_failed += failed
+
+
+def queue(images, clear=False):
+    """
+    Mark the ``images`` queryset due now, with a fresh retry budget;
+    ``clear`` also forgets the current copies' URLs (``process`` deletes
+    their files). Returns how many were queued.
+    """
+    changes = {}
+    if clear:
+        changes = {"derivatives": {}}
+    return images.update(
+        derivatives_status=ProductImage.DERIVATIVES_PENDING,
+        derivatives_attempts=0,
+        derivatives_due_at=timezone.now(),
+        derivatives_error="",
+        **changes,
+    )
+
+
+def srcset(derivatives, fmt):
+    """``srcset`` value for one format of a ``derivatives`` dict."""
+    seen = set()
+    candidates = []
+    for entry in sorted(derivatives.values(), key=lambda e: e["width"]):
+        # Small originals aren't upscaled, so sizes can coincide
+        if fmt in entry and entry["width"] not in seen:
+            seen.add(entry["width"])
+            candidates.append(f"{entry[fmt]} {entry['width']}w")
+    return ", ".join(candidates)
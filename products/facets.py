@@ -0,0 +1,248 @@
+"""
+Facet filters and counts for the product listing.
+
+Counts come from a small "cube": how many active products fall in each
+(category, price band, rating floor) cell. For the whole catalog the
+cube is the FacetCell table, kept incrementally like the rating
+aggregates: a product save or delete and every rating change move one
+product out of its old cell and into its new one with a -1/+1 UPDATE
+(see ``products.signals`` and ``products.ratings``). Bulk writes that
+bypass the signals (staff bulk actions, imports, rating recomputes,
+seeding) call ``rebuild``, one GROUP BY over the products. A listing
+reads the table (a few dozen rows) once per catalog version, and a
+search's cube is one GROUP BY over its hits, cached per query the same
+way. Every facet count is then a sum over cube cells in Python, so a
+listing never runs a COUNT per facet value.
+
+Counts are disjunctive: each facet's numbers respect the other facets'
+selections but not its own, so picking a price band still shows what
+the other bands would give.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+
+from . import cache as catalog_cache
+from .models import FacetCell, Product
+
+# (slug, label, low, high): low <= price < high
+PRICE_BANDS = [
+    ("under-10", "Under £10", None, Decimal("10")),
+    ("10-25", "£10 – £25", Decimal("10"), Decimal("25")),
+    ("25-50", "£25 – £50", Decimal("25"), Decimal("50")),
+    ("50-plus", "£50 and over", Decimal("50"), None),
+]
+
+# Minimum average rating choices, best first
+RATING_FLOORS = [4, 3, 2, 1]
+
+
+def _band_q(low, high):
+    q = Q()
+    if low is not None:
+        q &= Q(price__gte=low)
+    if high is not None:
+        q &= Q(price__lt=high)
+    return q
+
+
+def parse(params):
+    """Validated (price_band, min_rating) from request.GET."""
+    price = params.get("price") or ""
+    if price not in {slug for slug, *_ in PRICE_BANDS}:
+        price = ""
+    try:
+        rating = int(params.get("rating") or 0)
+    except ValueError:
+        rating = 0
+    if rating not in RATING_FLOORS:
+        rating = 0
+    return price, rating
+
+
+def apply(qs, price, rating):
+    """Narrow ``qs`` to the selected price band and minimum rating."""
+    for slug, _label, low, high in PRICE_BANDS:
+        if slug == price:
+            qs = qs.filter(_band_q(low, high))
+    if rating:
+        qs = qs.filter(rating_count__gt=0, rating_avg__gte=rating)
+    return qs
+
+
+def _cube(qs):
+    """[(category_id, band_index, rating_floor, count)] for ``qs``."""
+    band = Case(
+        *[
+            When(_band_q(low, high), then=Value(i))
+            for i, (_slug, _label, low, high) in enumerate(PRICE_BANDS)
+        ],
+        output_field=IntegerField(),
+    )
+    floor = Case(
+        *[
+            When(rating_count__gt=0, rating_avg__gte=stars, then=Value(stars))
+            for stars in RATING_FLOORS
+        ],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    return list(
+        qs.order_by()
+        .annotate(band=band, floor=floor)
+        .values("category_id", "band", "floor")
+        .annotate(n=Count("id"))
+        .values_list("category_id", "band", "floor", "n")
+    )
+
+
+# FacetCell stand-ins for "no category" and "no price band"
+NO_CATEGORY = 0
+NO_BAND = -1
+
+
+def band_of(price):
+    """Index into PRICE_BANDS of ``price``, or None."""
+    price = Decimal(str(price))
+    for i, (_slug, _label, low, high) in enumerate(PRICE_BANDS):
+        if (low is None or price >= low) and (high is None or price < high):
+            return i
+    return None
+
+
+def floor_of(rating_count, rating_avg):
+    """Best RATING_FLOORS entry the rating reaches, 0 for none."""
+    if rating_count:
+        for stars in RATING_FLOORS:
+            if rating_avg >= stars:
+                return stars
+    return 0
+
+
+def cell_of(category_id, price, is_active, rating_count, rating_avg):
+    """The FacetCell key of a product with these values, or None."""
+    if not is_active:
+        return None
+    band = band_of(price)
+    return (
+        category_id or NO_CATEGORY,
+        NO_BAND if band is None else band,
+        floor_of(rating_count, rating_avg),
+    )
+
+
+CELL_FIELDS = ("category_id", "price", "is_active", "rating_count",
+               "rating_avg")
+
+
+def stored_cell(product_id):
+    """The cell of the stored product row, or None."""
+    row = Product.objects.filter(pk=product_id).values_list(
+        *CELL_FIELDS).first()
+    return cell_of(*row) if row else None
+
+
+def move(before, after):
+    """
+    One product left cell ``before`` and joined cell ``after`` (either
+    may be None): -1 and +1 on their counts.
+    """
+    if before == after:
+        return
+    if before is not None:
+        _add(before, -1)
+    if after is not None:
+        _add(after, 1)
+
+
+def _add(key, delta):
+    category, band, floor = key
+    cell = FacetCell.objects.filter(category=category, band=band, floor=floor)
+    if cell.update(count=F("count") + delta):
+        return
+    # First product in this cell; another writer may be creating it too
+    FacetCell.objects.bulk_create(
+        [FacetCell(category=category, band=band, floor=floor)],
+        ignore_conflicts=True)
+    cell.update(count=F("count") + delta)
+
+
+def cell_rows(products):
+    """FacetCell field dicts for the cube of the ``products`` queryset."""
+    for category_id, band, floor, n in _cube(products):
+        yield {
+            "category": category_id or NO_CATEGORY,
+            "band": NO_BAND if band is None else band,
+            "floor": floor,
+            "count": n,
+        }
+
+
+def rebuild():
+    """Recount every FacetCell from the products table."""
+    with transaction.atomic():
+        FacetCell.objects.all().delete()
+        FacetCell.objects.bulk_create(
+            FacetCell(**fields) for fields in cell_rows(
+                Product.objects.filter(is_active=True)))
+    catalog_cache.bump_on_commit()
+
+
+def _stored_cube():
+    return [
+        (
+            category or None,
+            None if band == NO_BAND else band,
+            floor,
+            count,
+        )
+        for category, band, floor, count in FacetCell.objects.filter(
+            count__gt=0).values_list("category", "band", "floor", "count")
+    ]
+
+
+def catalog_cube():
+    """The cube of all active products, from FacetCell."""
+    return catalog_cache.get_or_set(
+        catalog_cache.FACETS, "catalog", _stored_cube)
+
+
+def search_cube(qs):
+    """The cube of a search's hits ``qs``: one GROUP BY, cached."""
+    return catalog_cache.get_or_set(
+        catalog_cache.FACETS, qs.query.sql_with_params(),
+        lambda: _cube(qs))
+
+
+def counts(cells, category_id=None, price="", rating=0):
+    """
+    Facet counts for the current selection:
+    {"category": {id: n}, "price": {slug: n}, "rating": {stars: n}}
+    """
+    band_index = {slug: i for i, (slug, *_) in enumerate(PRICE_BANDS)}
+    selected_band = band_index.get(price)
+
+    by_category, by_band, by_floor = {}, {}, {}
+    for cat_id, band, floor, n in cells:
+        cat_ok = category_id is None or cat_id == category_id
+        band_ok = selected_band is None or band == selected_band
+        floor_ok = floor >= rating
+        if band_ok and floor_ok:
+            by_category[cat_id] = by_category.get(cat_id, 0) + n
+        if cat_ok and floor_ok and band is not None:
+            by_band[band] = by_band.get(band, 0) + n
+        if cat_ok and band_ok:
+            by_floor[floor] = by_floor.get(floor, 0) + n
+
+    return {
+        "category": by_category,
+        "price": {
+            slug: by_band.get(i, 0)
+            for i, (slug, *_) in enumerate(PRICE_BANDS)
+        },
+        "rating": {
+            stars: sum(n for f, n in by_floor.items() if f >= stars)
+            for stars in RATING_FLOORS
+        },
+    }
@@ -1,7 +1,8 @@
 from django import forms
 from django.forms import inlineformset_factory
 
-from .models import Product, ProductReview, ProductImage
+from . import bulk
+from .models import Category, Product, ProductReview, ProductImage
 
 
 class ProductForm(forms.ModelForm):
@@ -62,3 +63,49 @@ ProductImageFormSet = inlineformset_factory(
     validate_min=False,
     validate_max=False,
 )
+
+
+class ProductImportForm(forms.Form):
+    """
+    Upload for the staff catalog import (see products.transfer).
+    """
+    file = forms.FileField(
+        help_text="CSV or JSON Lines, one product per row, keyed on SKU.",
+        widget=forms.ClearableFileInput(
+            attrs={"class": "form-control", "accept": ".csv,.jsonl,.json"}),
+    )
+    format = forms.ChoiceField(
+        choices=[
+            ("", "From the file name"),
+            ("csv", "CSV"),
+            ("jsonl", "JSON Lines"),
+        ],
+        required=False,
+        widget=forms.Select(attrs={"class": "form-select"}),
+    )
+
+
+class ProductBulkActionForm(forms.Form):
+    """
+    A bulk action from the staff product list (see products.bulk). The
+    ticked product ids come in as ``selected``; ``select_all`` applies
+    the action to every product matching the list's filters instead,
+    which arrive under the list's own names (``q``, ``category``,
+    ``active``), so the category to move to is ``target_category``.
+    """
+    action = forms.ChoiceField(choices=list(bulk.ACTIONS.items()))
+    target_category = forms.ModelChoiceField(
+        queryset=Category.objects.all(), required=False)
+    percent = forms.DecimalField(
+        required=False, max_digits=5, decimal_places=2,
+        min_value=-99, max_value=1000)
+    select_all = forms.BooleanField(required=False)
+
+    def clean(self):
+        cleaned = super().clean()
+        action = cleaned.get("action")
+        if action == "set_category" and not cleaned.get("target_category"):
+            self.add_error("target_category", "Choose a category to move to.")
+        if action == "adjust_price" and cleaned.get("percent") is None:
+            self.add_error("percent", "Enter a percentage.")
+        return cleaned
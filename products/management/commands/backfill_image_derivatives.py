@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import derivatives
+from products.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the resized WebP/JPEG copies of existing product images: "
+        "queue every image that has none (--failed also retries ones "
+        "that gave up, --force redoes all of them, e.g. after SIZES "
+        "changed) and process the queue here rather than waiting for "
+        "the process_images worker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument(
+            "--failed", action="store_true",
+            help="Also retry images whose attempts ran out.")
+        parser.add_argument(
+            "--force", action="store_true",
+            help="Redo every image, even ones that have copies.")
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.exclude(image="").exclude(
+            image__isnull=True)
+        if not options["force"]:
+            statuses = [ProductImage.DERIVATIVES_PENDING]
+            if options["failed"]:
+                statuses.append(ProductImage.DERIVATIVES_FAILED)
+            images = images.filter(derivatives_status__in=statuses)
+        queued = derivatives.queue(images)
+        self.stdout.write(f"Queued {queued} images.")
+
+        started = time.perf_counter()
+        total_done = total_failed = 0
+        while True:
+            batch = derivatives.claim_batch(options["batch_size"])
+            if not batch:
+                break
+            done, failed = derivatives.process_batch(batch)
+            total_done += done
+            total_failed += failed
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{total_done} done, {total_failed} failed "
+                f"({total_done / elapsed:.1f} images/s)")
+
+        style = self.style.WARNING if total_failed else self.style.SUCCESS
+        self.stdout.write(style(
+            f"Processed {total_done}, failed {total_failed}."))
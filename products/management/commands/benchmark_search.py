@@ -0,0 +1,80 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products import search, seeding
+from products.models import Product
+
+DEFAULT_TERMS = ["wreath", "lav", "festive candle", "seasonal", "zzz"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the full-text search path against the old icontains "
+        "search on a synthetic catalog. All data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--term", action="append", dest="terms",
+            help="Search phrase to time (repeatable).",
+        )
+
+    def handle(self, *args, **options):
+        if search.backend() is None:
+            self.stderr.write("This database has no full-text engine.")
+            return
+
+        terms = options["terms"] or DEFAULT_TERMS
+        with transaction.atomic():
+            started = time.perf_counter()
+            seeding.seed_catalog(
+                options["products"], options["batch_size"], options["seed"])
+            search.rebuild_index()
+            self.stdout.write(
+                f"Seeded and indexed {options['products']} products in "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+
+            self.stdout.write(
+                f"{'term':<18}{'hits':>8}{'icontains ms':>15}"
+                f"{'fts ms':>10}{'speed-up':>10}"
+            )
+            for term in terms:
+                hits, legacy = self._time(
+                    lambda: search.icontains_filter(self._base(), term),
+                    options["repeat"],
+                )
+                _, fts = self._time(
+                    lambda: search.filter_products(self._base(), term),
+                    options["repeat"],
+                )
+                self.stdout.write(
+                    f"{term:<18}{hits:>8}{legacy:>15.1f}{fts:>10.1f}"
+                    f"{(legacy / fts if fts else 0):>9.1f}x"
+                )
+            transaction.set_rollback(True)
+
+    def _base(self):
+        return Product.objects.filter(is_active=True)
+
+    def _time(self, make_qs, repeat):
+        """
+        Median time (ms) of one listing page plus its total count,
+        which is what a catalog request costs.
+        """
+        samples = []
+        hits = 0
+        for _ in range(repeat):
+            started = time.perf_counter()
+            qs = make_qs().order_by("-created_at")
+            list(qs[:12])
+            hits = qs.count()
+            samples.append((time.perf_counter() - started) * 1000)
+        return hits, statistics.median(samples)
@@ -0,0 +1,231 @@
+import json
+import math
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from checkout.fake_stripe import FakeStripeServer
+from products import cache as catalog_cache
+from products import facets, search, seeding
+from products.models import Product, Wishlist
+from products.views import SORT_MAP
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / "benchmarks" / "views.json"
+SEARCH_TERM = "festive candle"
+BAG_LINES = 3
+WISHLIST_ROWS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the hot views (catalog listing with every sort and a "
+        "search, category, detail, bag, checkout, wishlist, home and the "
+        "staff product list) against synthetic catalogs of each --sizes "
+        "product count, through the in-process test client with Stripe "
+        "replaced by a local FakeStripeServer. Records cold and warm "
+        "latency and query counts and compares them with --baseline: "
+        "more queries than the baseline, or a warm median more than "
+        "--tolerance slower, fails the command. --save-baseline writes "
+        "the results instead. All data is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+            help="Catalog sizes to seed, in products.")
+        parser.add_argument(
+            "--repeat", type=int, default=10,
+            help="Warm requests per view (fewer if --max-seconds runs out).")
+        parser.add_argument(
+            "--max-seconds", type=float, default=5.0,
+            help="Time allowed per view for the warm requests.")
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--baseline", type=Path, default=DEFAULT_BASELINE)
+        parser.add_argument(
+            "--save-baseline", action="store_true",
+            help="Write the results to --baseline instead of comparing.")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.5,
+            help="Allowed warm median slow-down, as a fraction.")
+        parser.add_argument(
+            "--min-delta-ms", type=float, default=5.0,
+            help="Slow-downs smaller than this are noise, not regressions.")
+
+    def handle(self, *args, **options):
+        results = {}
+        with FakeStripeServer() as stripe_server, override_settings(
+            ALLOWED_HOSTS=["testserver"],
+            STRIPE_API_BASE=stripe_server.url,
+            STRIPE_SECRET_KEY="sk_test_benchmark",
+            SERVER_TIMING_SAMPLE_RATE=0,
+            QUERY_BUDGET_ENABLED=False,
+            # Runs without collectstatic's manifest
+            STORAGES={**settings.STORAGES, "staticfiles": {
+                "BACKEND": "django.contrib.staticfiles.storage."
+                           "StaticFilesStorage"}},
+        ):
+            for size in options["sizes"]:
+                results[str(size)] = self._run_size(size, options)
+
+        if options["save_baseline"]:
+            self._save(results, options["baseline"])
+            return
+        regressions = self._compare(results, options)
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} regression(s) against "
+                f"{options['baseline']}:\n" + "\n".join(regressions))
+
+    def _run_size(self, size, options):
+        with transaction.atomic():
+            started = time.perf_counter()
+            categories = seeding.seed_catalog(
+                size, options["batch_size"], options["seed"])
+            facets.rebuild()
+            if search.backend():
+                search.rebuild_index()
+            self.stdout.write(
+                f"\n{size} products seeded in "
+                f"{time.perf_counter() - started:.1f}s")
+
+            results = {}
+            self.stdout.write(
+                f"{'view':<24}{'cold ms':>9}{'p50 ms':>9}{'p95 ms':>9}"
+                f"{'queries':>14}{'n':>4}")
+            for name, client, url in self._cases(categories):
+                result = self._measure(client, url, options)
+                results[name] = result
+                queries = f"{result['cold_queries']} cold/{result['queries']}"
+                self.stdout.write(
+                    f"{name:<24}{result['cold_ms']:>9.1f}"
+                    f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+                    f"{queries:>14}"
+                    f"{result['samples']:>4}")
+            transaction.set_rollback(True)
+        return results
+
+    def _cases(self, categories):
+        """(name, client, url) for every view timed."""
+        products = list(
+            Product.objects.filter(category=categories[0])
+            .order_by("pk")[:WISHLIST_ROWS])
+
+        anonymous = Client()
+        shopper = Client()
+        user = User.objects.create_user(
+            "bench-shopper", "shopper@example.com", "x")
+        shopper.force_login(user)
+        Wishlist.objects.bulk_create(
+            [Wishlist(user=user, product=p) for p in products])
+        for product in products[:BAG_LINES]:
+            shopper.post(
+                reverse("bag:add_to_bag", args=[product.pk]),
+                {"quantity": 1, "redirect_url": "/"})
+        staff = Client()
+        staff.force_login(User.objects.create_user(
+            "bench-staff", "staff@example.com", "x", is_staff=True))
+
+        listing = reverse("products:list")
+        cases = [("home", anonymous, reverse("home"))]
+        cases += [
+            (f"list sort={sort}", anonymous, f"{listing}?sort={sort}")
+            for sort in SORT_MAP if sort != "relevance"
+        ]
+        cases += [
+            ("list search", anonymous,
+             f"{listing}?q={SEARCH_TERM.replace(' ', '+')}"),
+            ("category", anonymous,
+             reverse("products:category", args=[categories[0].slug])),
+            ("detail", anonymous,
+             reverse("products:detail", args=[products[0].slug])),
+            ("view_bag", shopper, reverse("bag:view_bag")),
+            ("checkout", shopper, reverse("checkout:checkout")),
+            ("wishlist", shopper, reverse("products:wishlist")),
+            ("admin_product_list", staff,
+             reverse("products:admin_product_list")),
+        ]
+        return cases
+
+    def _request(self, client, url):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            ms = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise CommandError(f"GET {url}: {response.status_code}")
+        return ms, len(queries)
+
+    def _measure(self, client, url, options):
+        """
+        One request with the catalog cache just invalidated, then up to
+        --repeat warm ones within --max-seconds.
+        """
+        catalog_cache.bump()
+        cold_ms, cold_queries = self._request(client, url)
+        samples = []
+        queries = cold_queries
+        deadline = time.perf_counter() + options["max_seconds"]
+        while len(samples) < options["repeat"] and (
+                not samples or time.perf_counter() < deadline):
+            ms, queries = self._request(client, url)
+            samples.append(ms)
+        samples.sort()
+        return {
+            "cold_ms": round(cold_ms, 1),
+            "cold_queries": cold_queries,
+            "p50_ms": round(statistics.median(samples), 1),
+            "p95_ms": round(samples[math.ceil(0.95 * len(samples)) - 1], 1),
+            "queries": queries,
+            "samples": len(samples),
+        }
+
+    def _save(self, results, path):
+        baseline = {}
+        if path.exists():
+            baseline = json.loads(path.read_text())
+        baseline.update(results)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        self.stdout.write(f"\nBaseline written to {path}")
+
+    def _compare(self, results, options):
+        """Regression messages for results worse than the baseline."""
+        path = options["baseline"]
+        if not path.exists():
+            raise CommandError(
+                f"No baseline at {path}; run with --save-baseline first.")
+        baseline = json.loads(path.read_text())
+
+        regressions = []
+        for size, views in results.items():
+            for name, result in views.items():
+                base = baseline.get(size, {}).get(name)
+                if base is None:
+                    self.stdout.write(f"{size} {name}: not in the baseline")
+                    continue
+                for key in ("cold_queries", "queries"):
+                    if result[key] > base[key]:
+                        regressions.append(
+                            f"{size} {name}: {key} {base[key]} -> "
+                            f"{result[key]}")
+                limit = max(
+                    base["p50_ms"] * (1 + options["tolerance"]),
+                    base["p50_ms"] + options["min_delta_ms"])
+                if result["p50_ms"] > limit:
+                    regressions.append(
+                        f"{size} {name}: p50 {base['p50_ms']}ms -> "
+                        f"{result['p50_ms']}ms (limit {limit:.1f}ms)")
+        if not regressions:
+            self.stdout.write(f"\nNo regressions against {path}")
+        return regressions
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from products import cards
+
+
+class Command(BaseCommand):
+    help = (
+        "Show (and optionally reset) the product-card cache hit/miss "
+        "counts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true",
+            help="Zero the counters after printing them.")
+
+    def handle(self, *args, **options):
+        stats = cards.stats()
+        self.stdout.write(
+            f"hits={stats['hits']} misses={stats['misses']} "
+            f"hit_rate={stats['hit_rate']:.1%}")
+        if options["reset"]:
+            cards.reset_stats()
+            self.stdout.write("Counters reset.")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from products import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every product to a CSV or JSONL file (or stdout with "
+        "'-'), streamed from the database --chunk-size rows at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format", choices=transfer.FORMATS,
+            help="Default: from the file extension.")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or transfer.format_for(path)
+        lines = transfer.export_lines(fmt, chunk_size=options["chunk_size"])
+        if path == "-":
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        count = -1 if fmt == "csv" else 0  # the CSV header
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {count} products to {path}."))
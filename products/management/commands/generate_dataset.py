@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+
+from checkout.seeding import seed_orders
+from products import cache as catalog_cache
+from products import search, seeding
+from products.models import Category, Product
+from profiles.models import UserProfile
+from profiles.seeding import seed_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a synthetic shop: categories, products "
+        "with --images ProductImages each, users with profiles, "
+        "wishlists, reviews and historical orders. The same --seed "
+        "always gives the same data. Rows are inserted with bulk_create, "
+        "--batch-size rows per transaction, so millions of rows take "
+        "minutes. Nothing is rolled back: point DATABASE_URL at a "
+        "scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--categories", type=int, default=8)
+        parser.add_argument("--products", type=int, default=10_000)
+        parser.add_argument(
+            "--images", type=int, default=3, help="Images per product.")
+        parser.add_argument("--users", type=int, default=2_000)
+        parser.add_argument(
+            "--wishlist", type=int, default=5,
+            help="Wishlisted products per user, on average.")
+        parser.add_argument("--reviews", type=int, default=20_000)
+        parser.add_argument("--orders", type=int, default=10_000)
+        parser.add_argument(
+            "--max-lines", type=int, default=5,
+            help="Lines per order, at most.")
+        parser.add_argument("--batch-size", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--prefix", default="seed",
+            help="Slug, username and file name prefix of the generated rows.")
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        products = Product.objects.filter(
+            slug__startswith=f"{prefix}-product-")
+        if products.exists() or Category.objects.filter(
+                slug=f"{prefix}-0").exists():
+            raise CommandError(
+                f"There is already data with the prefix '{prefix}'; use "
+                f"another --prefix or a fresh database.")
+
+        batch_size, seed = options["batch_size"], options["seed"]
+        self.total_rows = 0
+        self.started = time.perf_counter()
+
+        with self._step("categories and products"):
+            seeding.seed_catalog(
+                options["products"], batch_size, seed, prefix,
+                categories=options["categories"])
+        catalog = list(products.order_by("pk").values_list("pk", "price"))
+        product_ids = [pk for pk, _ in catalog]
+        self.total_rows += options["categories"] + len(catalog)
+
+        if options["images"]:
+            with self._step("product images"):
+                seeding.seed_images(
+                    products, options["images"], batch_size, seed, prefix)
+            self.total_rows += len(catalog) * options["images"]
+
+        with self._step("users and profiles"):
+            user_ids = seed_users(
+                options["users"], batch_size, seed, prefix)
+        self.total_rows += 2 * len(user_ids)
+
+        with self._step("wishlists"):
+            self.total_rows += seeding.seed_wishlists(
+                user_ids, product_ids, options["wishlist"], batch_size, seed)
+
+        with self._step("reviews and ratings"):
+            self.total_rows += seeding.seed_reviews(
+                user_ids, product_ids, options["reviews"], batch_size, seed)
+
+        with self._step("orders and line items"):
+            self.total_rows += options["orders"] + seed_orders(
+                options["orders"],
+                UserProfile.objects.filter(user_id__in=user_ids), catalog,
+                batch_size, seed, prefix, options["max_lines"])
+
+        if search.backend():
+            with self._step("search index"):
+                search.rebuild_index()
+        catalog_cache.bump()
+
+        elapsed = time.perf_counter() - self.started
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {self.total_rows} rows in {elapsed:.1f}s "
+            f"({self.total_rows / elapsed:,.0f} rows/s)."))
+
+    @contextmanager
+    def _step(self, name):
+        started = time.perf_counter()
+        self.stdout.write(f"{name}...", ending="")
+        self.stdout.flush()
+        yield
+        self.stdout.write(f" {time.perf_counter() - started:.1f}s")
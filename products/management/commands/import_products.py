@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products from a CSV or JSONL file, matched on "
+        "sku (see products.transfer for the columns). The file is read "
+        "as a stream and upserted --batch-size rows at a time; invalid "
+        "rows are listed and skipped without stopping the import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument(
+            "--format", choices=transfer.FORMATS,
+            help="Default: from the file extension.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or transfer.format_for(path)
+        started = time.perf_counter()
+        try:
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                result = transfer.import_products(
+                    transfer.read_rows(f, fmt), options["batch_size"])
+        except OSError as e:
+            raise CommandError(e)
+
+        for line, sku, message in result.errors:
+            self.stderr.write(f"line {line} {sku}: {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(
+                f"... and {result.error_count - len(result.errors)} more")
+        style = self.style.WARNING if result.error_count else \
+            self.style.SUCCESS
+        self.stdout.write(style(
+            f"{result} in {time.perf_counter() - started:.1f}s."))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products import derivatives
+
+
+class Command(BaseCommand):
+    help = (
+        "Make the resized WebP/JPEG copies of newly uploaded product "
+        "images. Safe to run several copies in parallel."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument(
+            "--max-attempts", type=int, default=derivatives.MAX_ATTEMPTS)
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep running, polling for new images every --sleep "
+                 "seconds.")
+        parser.add_argument("--sleep", type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        total_done = total_failed = 0
+        while True:
+            done, failed = derivatives.drain(
+                batch_size=options["batch_size"],
+                max_attempts=options["max_attempts"],
+            )
+            total_done += done
+            total_failed += failed
+            if not options["loop"]:
+                break
+            time.sleep(options["sleep"])
+        self.stdout.write(
+            f"Processed {total_done}, failed {total_failed}.")
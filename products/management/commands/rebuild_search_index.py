@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from products import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product full-text search index from scratch."
+
+    def handle(self, *args, **options):
+        engine = search.backend()
+        if engine is None:
+            self.stdout.write(
+                "No full-text engine for this database; nothing to do.")
+            return
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the {engine} product search index."))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from products import ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute rating_avg, rating_count and the star histogram of "
+        "every product from its approved reviews."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rated = ratings.recompute_all(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomputed ratings; {rated} products have reviews."))
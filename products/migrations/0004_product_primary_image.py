@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_primary_images(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductImage = apps.get_model('products', 'ProductImage')
+    for product_id in Product.objects.values_list('id', flat=True):
+        image = ProductImage.objects.filter(product_id=product_id).order_by(
+            '-is_primary', 'sort_order', 'id').first()
+        url = ''
+        if image and image.image:
+            try:
+                url = image.image.url
+            except Exception:
+                url = ''
+        Product.objects.filter(pk=product_id).update(
+            primary_image=image,
+            primary_image_url=url,
+            primary_image_alt=(image.alt_text if image else ''),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.productimage'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_alt',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_image_url',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.RunPython(
+            backfill_primary_images, migrations.RunPython.noop),
+    ]
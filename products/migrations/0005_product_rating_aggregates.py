@@ -0,0 +1,74 @@
+# Generated by Django 5.2.5 on 2026-10-18 13:54
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductReview = apps.get_model('products', 'ProductReview')
+    histograms = defaultdict(dict)
+    rows = (
+        ProductReview.objects.filter(approved=True)
+        .order_by()
+        .values('product_id', 'rating')
+        .annotate(n=Count('id'))
+        .values_list('product_id', 'rating', 'n')
+    )
+    for product_id, stars, n in rows:
+        histograms[product_id][stars] = n
+    for product_id, histogram in histograms.items():
+        count = sum(histogram.values())
+        Product.objects.filter(pk=product_id).update(
+            rating_count=count,
+            rating_avg=sum(s * n for s, n in histogram.items()) / count,
+            **{f'rating_count_{s}': n for s, n in histogram.items()},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_primary_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+def fill_facet_cells(apps, schema_editor):
+    from products import facets
+
+    Product = apps.get_model('products', 'Product')
+    FacetCell = apps.get_model('products', 'FacetCell')
+    FacetCell.objects.bulk_create(
+        FacetCell(**fields) for fields in facets.cell_rows(
+            Product.objects.filter(is_active=True)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.PositiveIntegerField()),
+                ('band', models.SmallIntegerField()),
+                ('floor', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('category', 'band', 'floor'), name='facet_cell_unique')],
+            },
+        ),
+        migrations.RunPython(fill_facet_cells, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,37 @@
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 
+from cwh_site import timing
+
 
 RATING_CHOICES = [(i, i) for i in range(1, 6)]
 
 
+class MaintainedFieldsModel(models.Model):
+    """
+    A model whose MAINTAINED_FIELDS are kept by conditional F() UPDATEs,
+    signals or workers, never by save(): a loaded instance's copies may
+    be stale by the time it is saved, so saving an existing row updates
+    every other column only.
+    """
+    MAINTAINED_FIELDS = frozenset()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.MAINTAINED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+
 class Category(models.Model):
 
     class Meta:
@@ -30,7 +56,7 @@ class Category(models.Model):
         super().save(*args, **kwargs)
 
 
-class Product(models.Model):
+class Product(MaintainedFieldsModel):
     category = models.ForeignKey(
         'Category', null=True, blank=True, on_delete=models.SET_NULL)
     name = models.CharField(max_length=250)
@@ -40,11 +66,93 @@ class Product(models.Model):
     sku = models.CharField(max_length=6, unique=True, null=True, blank=True)
     is_active = models.BooleanField(default=True)
 
+    # Denormalised from ProductImage so listings, the bag and the nav
+    # dropdown can show a thumbnail without touching the images table.
+    # Maintained by sync_primary_image() via products.signals.
+    primary_image = models.ForeignKey(
+        'ProductImage', null=True, blank=True, editable=False,
+        on_delete=models.SET_NULL, related_name='+')
+    primary_image_url = models.CharField(
+        max_length=500, blank=True, editable=False)
+    primary_image_alt = models.CharField(
+        max_length=200, blank=True, editable=False)
+    primary_image_derivatives = models.JSONField(
+        default=dict, blank=True, editable=False)
+    # Bumped on every image change; part of the product-card cache key
+    images_version = models.PositiveIntegerField(default=0, editable=False)
+
+    # On-hand stock, and how much of it is held for unpaid checkouts
+    # (see checkout.inventory). stock=None means not tracked.
+    stock = models.PositiveIntegerField(null=True, blank=True)
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+
+    # Approved-review aggregates, kept incrementally by products.ratings
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_count_5 = models.PositiveIntegerField(default=0, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
+        # Public listings filter is_active (and maybe category) and
+        # order by a SORT_MAP column plus id, the keyset tie-breaker.
+        # Partial on is_active so hidden products don't bloat them.
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_created_idx'),
+            models.Index(
+                fields=['name', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_name_idx'),
+            models.Index(
+                fields=['price', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_price_idx'),
+            models.Index(
+                fields=['rating_avg', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_rating_idx'),
+            models.Index(
+                fields=['category', 'created_at', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_cat_created_idx'),
+            models.Index(
+                fields=['category', 'price', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_cat_price_idx'),
+            models.Index(
+                fields=['category', 'name', 'id'],
+                condition=models.Q(is_active=True),
+                name='product_active_cat_name_idx'),
+            # The staff list shows hidden products too, sorted by any
+            # of these columns
+            models.Index(
+                fields=['name', 'id'], name='product_name_idx'),
+            models.Index(
+                fields=['price', 'id'], name='product_price_idx'),
+            models.Index(
+                fields=['created_at', 'id'], name='product_created_idx'),
+            models.Index(
+                fields=['updated_at', 'id'], name='product_updated_idx'),
+        ]
+
+    # Kept by checkout.inventory, products.ratings and
+    # sync_primary_image
+    MAINTAINED_FIELDS = frozenset({
+        'reserved', 'rating_avg', 'rating_count', 'rating_count_1',
+        'rating_count_2', 'rating_count_3', 'rating_count_4',
+        'rating_count_5', 'images_version', 'primary_image',
+        'primary_image_url', 'primary_image_alt',
+        'primary_image_derivatives',
+    })
 
     def __str__(self):
         return self.name
@@ -54,8 +162,54 @@ class Product(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
+    @property
+    def available(self):
+        """Units that can still be bought, or None if not tracked."""
+        if self.stock is None:
+            return None
+        return max(self.stock - self.reserved, 0)
+
+    @property
+    def rating_histogram(self):
+        """
+        [(stars, count, percent), ...] from 5 stars down to 1.
+        """
+        rows = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_count_{stars}')
+            percent = (
+                round(100 * count / self.rating_count)
+                if self.rating_count else 0
+            )
+            rows.append((stars, count, percent))
+        return rows
 
-class ProductImage(models.Model):
+    @classmethod
+    def sync_primary_image(cls, product_id):
+        """
+        Recompute the cached primary image of one product: the image
+        flagged is_primary, else the first by sort order. Also bumps
+        images_version so cached product cards are re-rendered.
+        Uses update() so updated_at and post_save are left alone.
+        """
+        image = ProductImage.objects.filter(product_id=product_id).first()
+        url = ''
+        if image and image.image:
+            try:
+                with timing.phase('images'):
+                    url = image.image.url
+            except Exception:
+                url = ''
+        cls.objects.filter(pk=product_id).update(
+            primary_image=image,
+            primary_image_url=url,
+            primary_image_alt=(image.alt_text if image else ''),
+            primary_image_derivatives=(image.derivatives if image else {}),
+            images_version=models.F('images_version') + 1,
+        )
+
+
+class ProductImage(MaintainedFieldsModel):
     product = models.ForeignKey(
         'Product', on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(null=True, blank=True)
@@ -63,15 +217,75 @@ class ProductImage(models.Model):
     is_primary = models.BooleanField(default=False)
     sort_order = models.PositiveIntegerField(default=0)
 
+    # Resized WebP/JPEG copies for srcset, made off the request path by
+    # the process_images worker (see products.derivatives):
+    # {"thumb": {"width": 160, "height": 120, "webp": url, "jpeg": url},
+    #  "card": {...}, "detail": {...}}, from the file derivatives_source.
+    # A new upload queues the image again via products.signals.
+    DERIVATIVES_PENDING = 'pending'
+    DERIVATIVES_DONE = 'done'
+    DERIVATIVES_FAILED = 'failed'
+    DERIVATIVES_STATUS_CHOICES = [
+        (DERIVATIVES_PENDING, 'Pending'),
+        (DERIVATIVES_DONE, 'Done'),
+        (DERIVATIVES_FAILED, 'Failed'),
+    ]
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    derivatives_source = models.CharField(
+        max_length=100, blank=True, editable=False)
+    derivatives_status = models.CharField(
+        max_length=10, choices=DERIVATIVES_STATUS_CHOICES,
+        default=DERIVATIVES_PENDING, editable=False)
+    derivatives_attempts = models.PositiveIntegerField(
+        default=0, editable=False)
+    derivatives_due_at = models.DateTimeField(
+        default=timezone.now, editable=False)
+    derivatives_error = models.TextField(blank=True, editable=False)
+    # Kept by products.derivatives and its worker
+    MAINTAINED_FIELDS = frozenset({
+        'derivatives', 'derivatives_source', 'derivatives_status',
+        'derivatives_attempts', 'derivatives_due_at', 'derivatives_error',
+    })
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-is_primary', 'sort_order', 'id']
+        indexes = [
+            models.Index(
+                fields=['derivatives_due_at', 'id'],
+                condition=models.Q(derivatives_status='pending'),
+                name='image_derivatives_due_idx'),
+        ]
 
     def __str__(self):
         return f'{self.product.name} image #{self.pk}'
-    
+
+
+class FacetCell(models.Model):
+    """
+    How many active products fall in one (category, price band, rating
+    floor) cell: the listing's facet counts, kept up to date by
+    products.facets. ``category`` is a Category id, 0 for none, and
+    ``band`` an index into facets.PRICE_BANDS, -1 for none, so every
+    cell has exactly one row.
+    """
+    category = models.PositiveIntegerField()
+    band = models.SmallIntegerField()
+    floor = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['category', 'band', 'floor'],
+                name='facet_cell_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.category}/{self.band}/{self.floor}: {self.count}'
+
 
 class Wishlist(models.Model):
     user = models.ForeignKey(
@@ -89,6 +303,11 @@ class Wishlist(models.Model):
     class Meta:
         unique_together = ('user', 'product')
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['user', 'created_at'],
+                name='wishlist_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} → {self.product}'
@@ -115,6 +334,15 @@ class ProductReview(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ('product', 'user')
+        indexes = [
+            # Approved reviews of a product, newest first. Partial
+            # rather than a leading approved column: SQLite compiles
+            # approved=True to a bare column test it can't seek on.
+            models.Index(
+                fields=['product', 'created_at'],
+                condition=models.Q(approved=True),
+                name='review_product_approved_idx'),
+        ]
 
     def __str__(self):
         return (
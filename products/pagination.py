@@ -0,0 +1,135 @@
+"""
+Pagination helpers for the catalog listings.
+
+``KeysetPaginator`` pages on the active sort column plus ``id`` using
+opaque ``?after=`` / ``?before=`` cursors, so page 500 costs the same as
+page 1 (no OFFSET scan, no COUNT). ``CountCachingPaginator`` keeps the
+classic numbered pages for orderings a cursor can't express, and both
+share ``cached_count`` so the total is computed once per catalog
+version (see ``products.cache``).
+"""
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from . import cache as catalog_cache
+
+CURSOR_SALT = "products.cursor"
+
+
+def queryset_key(qs):
+    """The SQL and params of ``qs``, for use as a cache key part."""
+    return qs.query.sql_with_params()
+
+
+def cached_count(qs):
+    """
+    ``qs.count()``, remembered in the versioned catalog cache so it is
+    recomputed only after the catalog changes.
+    """
+    return catalog_cache.get_or_set(
+        catalog_cache.COUNTS, queryset_key(qs), qs.count)
+
+
+class CountCachingPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return cached_count(self.object_list)
+
+
+class KeysetPage:
+    """
+    One page of keyset results. Iterates like a Django ``Page`` and
+    exposes the cursors for its neighbours.
+    """
+
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Cursor paginator for a queryset ordered by one model field.
+
+    ``ordering`` is an ``order_by`` string such as ``"-created_at"``;
+    ``id`` in the same direction is appended as the tie-breaker.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.descending = ordering.startswith("-")
+        self.field = ordering.lstrip("-")
+        self.model_field = queryset.model._meta.get_field(self.field)
+        self.per_page = per_page
+        prefix = "-" if self.descending else ""
+        self.queryset = queryset.order_by(ordering, f"{prefix}id")
+
+    def _encode(self, obj):
+        value = self.model_field.value_to_string(obj)
+        return signing.dumps(
+            [self.field, value, obj.pk], salt=CURSOR_SALT, compress=True)
+
+    def _decode(self, token):
+        """Return (value, pk), or None for a bad or foreign cursor."""
+        try:
+            field, value, pk = signing.loads(token, salt=CURSOR_SALT)
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+        if field != self.field:
+            return None
+        try:
+            return self.model_field.to_python(value), int(pk)
+        except Exception:
+            return None
+
+    def _seek(self, qs, value, pk, forward):
+        """Rows strictly after (forward) or before the cursor row."""
+        later = forward != self.descending
+        op = "gt" if later else "lt"
+        return qs.filter(
+            Q(**{f"{self.field}__{op}": value})
+            | Q(**{self.field: value, f"id__{op}": pk})
+        )
+
+    def get_page(self, after=None, before=None):
+        qs = self.queryset
+        per = self.per_page
+
+        if before and (cursor := self._decode(before)):
+            rows = list(self._seek(qs, *cursor, forward=False).reverse()[
+                :per + 1])
+            has_previous = len(rows) > per
+            rows = list(reversed(rows[:per]))
+            has_next = True
+        else:
+            cursor = self._decode(after) if after else None
+            if cursor:
+                qs = self._seek(qs, *cursor, forward=True)
+            rows = list(qs[:per + 1])
+            has_next = len(rows) > per
+            rows = rows[:per]
+            has_previous = cursor is not None
+
+        return KeysetPage(
+            rows,
+            next_cursor=self._encode(rows[-1]) if rows and has_next else None,
+            previous_cursor=(
+                self._encode(rows[0]) if rows and has_previous else None),
+        )
@@ -0,0 +1,129 @@
+"""
+Denormalised review aggregates on Product.
+
+Each approved review contributes one vote to ``rating_count`` and to the
+``rating_count_<stars>`` histogram bucket; ``rating_avg`` is derived from
+the histogram. Review saves and deletes apply a +1/-1 delta in a single
+UPDATE (see ``products.signals``) and move the product to its new
+rating floor in the facet counts; ``recompute_all`` rebuilds everything
+from the review table, for the ``recompute_ratings`` command and the
+seeding code.
+"""
+from django.db import transaction
+from django.db.models import (
+    Case, Count, F, FloatField, OuterRef, Subquery, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.lookups import GreaterThan
+
+from . import cache as catalog_cache
+from . import facets
+from .models import Product, ProductReview
+
+STARS = range(1, 6)
+
+
+def bucket(stars):
+    return f"rating_count_{stars}"
+
+
+def _vote(review):
+    """(product_id, stars) if the review counts towards ratings."""
+    if review is None or not review.approved:
+        return None
+    return review.product_id, review.rating
+
+
+def _apply(product_id, added=None, removed=None):
+    """
+    Add and/or remove one vote on a product in a single UPDATE, then
+    move the product to its new facet cell. Every right-hand side sees
+    the pre-update row, so the new average is worked out from the old
+    histogram plus the delta.
+    """
+    if added == removed:
+        return
+    delta = (added is not None) - (removed is not None)
+    updates = {}
+    if added is not None:
+        updates[bucket(added)] = F(bucket(added)) + 1
+    if removed is not None:
+        updates[bucket(removed)] = F(bucket(removed)) - 1
+
+    weighted = Value(added or 0) - Value(removed or 0)
+    for stars in STARS:
+        weighted = weighted + F(bucket(stars)) * stars
+    count = F("rating_count") + delta
+
+    updates["rating_count"] = count
+    updates["rating_avg"] = Case(
+        When(
+            GreaterThan(count, 0),
+            then=Cast(weighted, FloatField()) / count,
+        ),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    before = facets.stored_cell(product_id)
+    Product.objects.filter(pk=product_id).update(**updates)
+    facets.move(before, facets.stored_cell(product_id))
+
+
+def review_changed(before, after):
+    """
+    Apply the difference between a review's old and new state.
+    ``before`` / ``after`` are ProductReview instances or None.
+    """
+    old, new = _vote(before), _vote(after)
+    if old == new:
+        return
+    if old and new and old[0] == new[0]:
+        _apply(new[0], added=new[1], removed=old[1])
+        return
+    if old:
+        _apply(old[0], removed=old[1])
+    if new:
+        _apply(new[0], added=new[1])
+
+
+def recompute_all(batch_size=1000):
+    """
+    Rebuild every product's aggregates from the approved reviews, with
+    set-based UPDATEs over ``batch_size`` products at a time: one counts
+    each histogram bucket with a correlated subquery, the next derives
+    rating_count and rating_avg from the buckets.
+    """
+    approved = (
+        ProductReview.objects.filter(product=OuterRef("pk"), approved=True)
+        .order_by().values("product"))
+    buckets = {
+        bucket(stars): Coalesce(Subquery(
+            approved.filter(rating=stars).annotate(n=Count("pk"))
+            .values("n")), 0)
+        for stars in STARS
+    }
+    count = sum((F(bucket(stars)) for stars in STARS), Value(0))
+    weighted = sum((F(bucket(stars)) * stars for stars in STARS), Value(0))
+    totals = {
+        "rating_count": count,
+        "rating_avg": Case(
+            When(
+                GreaterThan(count, 0),
+                then=Cast(weighted, FloatField()) / count,
+            ),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ),
+    }
+
+    ids = list(Product.objects.order_by("pk").values_list("pk", flat=True))
+    with transaction.atomic():
+        for start in range(0, len(ids), batch_size):
+            chunk = Product.objects.filter(
+                pk__gte=ids[start],
+                pk__lte=ids[min(start + batch_size, len(ids)) - 1])
+            chunk.update(**buckets)
+            chunk.update(**totals)
+        facets.rebuild()
+    catalog_cache.bump_on_commit()
+    return Product.objects.filter(rating_count__gt=0).count()
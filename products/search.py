@@ -0,0 +1,187 @@
+"""
+Full-text search for the product catalog.
+
+SQLite keeps an FTS5 virtual table (``products_product_fts``) whose rowid
+is the product id; Postgres keeps a weighted ``search_vector`` tsvector
+column with a GIN index. Both are created by migration 0003 and kept up
+to date by the receivers in ``products.signals``. Any other database
+falls back to the old ``icontains`` search.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = "products_product_fts"
+PRODUCT_TABLE = "products_product"
+CATEGORY_TABLE = "products_category"
+
+# Postgres text search configuration used for both indexing and querying
+PG_CONFIG = "english"
+
+# Column weights: name, description, category (FTS5 bm25 / tsvector)
+BM25_WEIGHTS = (10.0, 1.0, 4.0)
+
+MAX_TOKENS = 8
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def backend():
+    """Name of the full-text engine for the current database, or None."""
+    if connection.vendor in ("sqlite", "postgresql"):
+        return connection.vendor
+    return None
+
+
+def tokenize(q):
+    """Split a search phrase into lower-case word tokens."""
+    return TOKEN_RE.findall((q or "").lower())[:MAX_TOKENS]
+
+
+def icontains_filter(qs, q):
+    """The original substring search (name, description, category)."""
+    return qs.filter(
+        Q(name__icontains=q) |
+        Q(description__icontains=q) |
+        Q(category__name__icontains=q)
+    )
+
+
+def filter_products(qs, q, rank=False):
+    """
+    Restrict a Product queryset to rows matching ``q``.
+    Every token must match (as a prefix) in the name, description or
+    category name. With ``rank=True`` a ``search_rank`` annotation is
+    added, where higher means more relevant.
+    """
+    tokens = tokenize(q)
+    engine = backend()
+
+    if not tokens or engine is None:
+        qs = icontains_filter(qs, q)
+        if rank:
+            qs = qs.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return qs
+
+    if engine == "sqlite":
+        match = " ".join(f'"{t}"*' for t in tokens)
+        qs = qs.filter(
+            id__in=RawSQL(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s",
+                [match],
+            )
+        )
+        if rank:
+            weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+            qs = qs.annotate(
+                search_rank=RawSQL(
+                    f"SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+                    f"WHERE {FTS_TABLE} MATCH %s "
+                    f"AND rowid = {PRODUCT_TABLE}.id",
+                    [match],
+                    output_field=FloatField(),
+                )
+            )
+        return qs
+
+    tsquery = " & ".join(f"{t}:*" for t in tokens)
+    qs = qs.filter(
+        RawSQL(
+            f"{PRODUCT_TABLE}.search_vector @@ "
+            f"to_tsquery('{PG_CONFIG}', %s)",
+            [tsquery],
+            output_field=BooleanField(),
+        )
+    )
+    if rank:
+        qs = qs.annotate(
+            search_rank=RawSQL(
+                f"ts_rank({PRODUCT_TABLE}.search_vector, "
+                f"to_tsquery('{PG_CONFIG}', %s))",
+                [tsquery],
+                output_field=FloatField(),
+            )
+        )
+    return qs
+
+
+# -------------------------------------------------------------------
+# Index maintenance
+# -------------------------------------------------------------------
+
+
+def _reindex(where="", params=()):
+    """
+    (Re)build index rows for the products selected by ``where``, a SQL
+    condition on the ``p`` (product) alias. An empty ``where`` rebuilds
+    the whole index.
+    """
+    engine = backend()
+    if engine is None:
+        return
+
+    with connection.cursor() as cursor:
+        if engine == "sqlite":
+            if where:
+                cursor.execute(
+                    f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+                    f"(SELECT p.id FROM {PRODUCT_TABLE} p WHERE {where})",
+                    params,
+                )
+            else:
+                cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) "
+                f"SELECT p.id, p.name, p.description, COALESCE(c.name, '') "
+                f"FROM {PRODUCT_TABLE} p "
+                f"LEFT JOIN {CATEGORY_TABLE} c ON c.id = p.category_id"
+                + (f" WHERE {where}" if where else ""),
+                params,
+            )
+        else:
+            cursor.execute(
+                f"UPDATE {PRODUCT_TABLE} p SET search_vector = "
+                f"setweight(to_tsvector('{PG_CONFIG}', p.name), 'A') || "
+                f"setweight(to_tsvector('{PG_CONFIG}', COALESCE("
+                f"(SELECT c.name FROM {CATEGORY_TABLE} c "
+                f"WHERE c.id = p.category_id), '')), 'B') || "
+                f"setweight(to_tsvector('{PG_CONFIG}', p.description), 'C')"
+                + (f" WHERE {where}" if where else ""),
+                params,
+            )
+
+
+def index_product(product_id):
+    _reindex("p.id = %s", [product_id])
+
+
+def index_products(product_ids):
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    _reindex(f"p.id IN ({placeholders})", product_ids)
+
+
+def index_category(category_id):
+    """Refresh every product in a category (e.g. after a rename)."""
+    _reindex("p.category_id = %s", [category_id])
+
+
+def index_uncategorised():
+    _reindex("p.category_id IS NULL")
+
+
+def remove_product(product_id):
+    # Postgres keeps the vector on the product row itself
+    if backend() == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id]
+            )
+
+
+def rebuild_index():
+    _reindex()
@@ -0,0 +1,234 @@
+"""
+Synthetic catalog data for benchmarks and the generate_dataset command.
+
+Every function draws from its own ``random.Random``, seeded from
+``seed``, so the same arguments always give the same rows, and changing
+how many of one kind of row are made doesn't reshuffle the others. Rows
+are written with ``bulk_create`` in batches, each batch in its own
+transaction. That skips ``save()`` and the signals, so denormalised
+columns are filled in afterwards with set-based UPDATEs, and callers
+should run ``facets.rebuild()`` for the listing's facet counts (seeding
+reviews does, through ``ratings.recompute_all``) and, if they search,
+``search.rebuild_index()``.
+"""
+import io
+import random
+from decimal import Decimal
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from . import ratings
+from .models import Category, Product, ProductImage, ProductReview, Wishlist
+
+WORDS = [
+    "wreath", "krapek", "paracord", "bracelet", "centerpiece", "door",
+    "autumn", "winter", "spring", "summer", "easter", "christmas",
+    "pumpkin", "holly", "lavender", "rose", "pine", "ribbon", "velvet",
+    "rustic", "golden", "festive", "handmade", "ceramic", "candle",
+    "garland", "felt", "wooden", "heart", "star", "floral", "pastel",
+]
+
+CATEGORY_NAMES = [
+    "Wreaths", "Krapeks", "Paracord", "Centerpieces", "Door Decor",
+    "Seasonal", "Gifts", "Candles",
+]
+
+SYLLABLES = [
+    "ba", "ce", "di", "fo", "gu", "ha", "ke", "li", "mo", "nu", "pa",
+    "re", "si", "to", "vu", "wa", "xe", "yo", "za", "qu",
+]
+
+REVIEW_TITLES = [
+    "Lovely", "Beautiful work", "As pictured", "Smaller than expected",
+    "Perfect gift", "Not for me", "Great quality", "Arrived quickly",
+]
+
+PLACEHOLDER_COLOURS = [
+    (176, 58, 46), (202, 111, 30), (212, 172, 13), (34, 153, 84),
+    (36, 113, 163), (125, 60, 152), (93, 109, 126), (160, 64, 0),
+]
+
+
+def vocabulary(rng, size=5_000):
+    """
+    Filler words plus WORDS, so descriptions look like prose rather
+    than repeating the same few dozen words in every row.
+    """
+    return sorted({
+        "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+        for _ in range(size)
+    }) + WORDS
+
+
+def batched(rows, batch_size):
+    """Lists of up to ``batch_size`` items from the iterable ``rows``."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_insert(model, rows, batch_size):
+    """
+    bulk_create ``rows`` (any iterable) a batch per transaction; returns
+    the created objects' pks.
+    """
+    pks = []
+    for batch in batched(rows, batch_size):
+        with transaction.atomic():
+            pks.extend(o.pk for o in model.objects.bulk_create(batch))
+    return pks
+
+
+def category_name(i):
+    name = CATEGORY_NAMES[i % len(CATEGORY_NAMES)]
+    round_ = i // len(CATEGORY_NAMES)
+    return f"{name} {round_ + 1}" if round_ else name
+
+
+def seed_catalog(total, batch_size=5_000, seed=42, prefix="bench",
+                 categories=len(CATEGORY_NAMES)):
+    """
+    Create ``categories`` categories and ``total`` products spread over
+    them, with ratings so every listing sort has something to order by.
+    Returns the categories.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    categories = [
+        Category.objects.create(
+            name=f"{category_name(i)} ({prefix})", slug=f"{prefix}-{i}",
+            sort_order=i)
+        for i in range(categories)
+    ]
+
+    def products():
+        for i in range(total):
+            rating_count = rng.choice([0, 0, 1, 3, 8, 20])
+            yield Product(
+                category=rng.choice(categories),
+                name=" ".join(rng.sample(WORDS, 3)).title(),
+                slug=f"{prefix}-product-{i}",
+                description=" ".join(rng.choices(words, k=25)),
+                price=Decimal(rng.randint(300, 9000)) / 100,
+                rating_avg=(
+                    round(rng.uniform(1, 5), 2) if rating_count else 0),
+                rating_count=rating_count,
+            )
+
+    bulk_insert(Product, products(), batch_size)
+    return categories
+
+
+def placeholder_images(prefix="bench", count=len(PLACEHOLDER_COLOURS)):
+    """
+    Names of ``count`` small JPEGs in the default storage, written on
+    first use, for seeded ProductImages to share.
+    """
+    from PIL import Image
+
+    names = []
+    for i in range(count):
+        name = f"{prefix}/placeholder-{i}.jpg"
+        if not default_storage.exists(name):
+            buffer = io.BytesIO()
+            colour = PLACEHOLDER_COLOURS[i % len(PLACEHOLDER_COLOURS)]
+            Image.new("RGB", (1200, 1200), colour).save(
+                buffer, "JPEG", quality=85)
+            name = default_storage.save(name, ContentFile(buffer.getvalue()))
+        names.append(name)
+    return names
+
+
+def seed_images(products, per_product, batch_size=5_000, seed=42,
+                prefix="bench"):
+    """
+    Give every product in the ``products`` queryset ``per_product``
+    ProductImages over the placeholder files, the first one primary,
+    then fill in the products' primary image columns.
+    """
+    rng = random.Random(f"{seed}:images")
+    names = placeholder_images(prefix)
+
+    def images():
+        for product_id, name in products.values_list("pk", "name").iterator(
+                chunk_size=batch_size):
+            for n in range(per_product):
+                yield ProductImage(
+                    product_id=product_id, image=rng.choice(names),
+                    alt_text=f"{name}, photo {n + 1}", is_primary=n == 0,
+                    sort_order=n)
+
+    bulk_insert(ProductImage, images(), batch_size)
+    sync_primary_images(products, names)
+
+
+def sync_primary_images(products, names):
+    """
+    Product.sync_primary_image for a whole queryset: one UPDATE for the
+    image and alt text, and one per file name for the URL.
+    """
+    first = ProductImage.objects.filter(
+        product=OuterRef("pk")).order_by("-is_primary", "sort_order", "id")
+    with transaction.atomic():
+        products.update(
+            primary_image=Subquery(first.values("pk")[:1]),
+            primary_image_alt=Subquery(first.values("alt_text")[:1]),
+        )
+        for name in names:
+            products.filter(primary_image__image=name).update(
+                primary_image_url=default_storage.url(name))
+
+
+def seed_wishlists(user_ids, product_ids, per_user, batch_size=5_000,
+                   seed=42):
+    """``per_user`` distinct wishlisted products per user, on average."""
+    rng = random.Random(f"{seed}:wishlists")
+
+    def rows():
+        for user_id in user_ids:
+            k = min(rng.randint(0, per_user * 2), len(product_ids))
+            for product_id in rng.sample(product_ids, k):
+                yield Wishlist(user_id=user_id, product_id=product_id)
+
+    return len(bulk_insert(Wishlist, rows(), batch_size))
+
+
+def seed_reviews(user_ids, product_ids, total, batch_size=5_000, seed=42):
+    """
+    About ``total`` reviews, at most one per (product, user) and most of
+    them on a popular few products, then the rating aggregates rebuilt
+    from them. Returns how many were made.
+    """
+    rng = random.Random(f"{seed}:reviews")
+    words = vocabulary(rng, size=500)
+    # Leave room so drawing unseen pairs never takes long
+    total = min(total, len(user_ids) * len(product_ids) // 2)
+
+    def rows():
+        seen = set()
+        while len(seen) < total:
+            # Squaring skews reviews towards the start of the catalog
+            product_id = product_ids[int(rng.random() ** 2 * len(product_ids))]
+            user_id = rng.choice(user_ids)
+            if (product_id, user_id) in seen:
+                continue
+            seen.add((product_id, user_id))
+            yield ProductReview(
+                product_id=product_id, user_id=user_id,
+                rating=rng.choices(range(1, 6), weights=(1, 1, 2, 4, 6))[0],
+                title=rng.choice(REVIEW_TITLES),
+                body=" ".join(rng.choices(words, k=rng.randint(8, 40))),
+                approved=rng.random() > 0.05,
+            )
+
+    made = len(bulk_insert(ProductReview, rows(), batch_size))
+    ratings.recompute_all(batch_size=batch_size)
+    return made
@@ -0,0 +1,163 @@
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+
+from . import cache as catalog_cache
+from . import derivatives, facets, ratings, search
+from .models import Category, Product, ProductImage, ProductReview
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_catalog_cache(sender, **kwargs):
+    """
+    Anything shown in the catalog changed; retire the cached copies
+    """
+    catalog_cache.bump_on_commit()
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    """
+    Keep the full-text index in step with the product row
+    """
+    search.index_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+# Columns that decide a product's facet cell
+FACET_FIELDS = {
+    'category', 'category_id', 'price', 'is_active', 'rating_count',
+    'rating_avg',
+}
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def remember_product_facet(sender, instance, update_fields=None, **kwargs):
+    """
+    Stash the stored row's facet cell so post_save / post_delete can
+    move the product out of it
+    """
+    instance._stored_facet = None
+    instance._facet_unchanged = (
+        update_fields is not None and not FACET_FIELDS & set(update_fields))
+    if instance.pk and not instance._facet_unchanged:
+        instance._stored_facet = facets.stored_cell(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def update_facets_on_save(sender, instance, **kwargs):
+    if not getattr(instance, '_facet_unchanged', False):
+        facets.move(
+            getattr(instance, '_stored_facet', None),
+            facets.stored_cell(instance.pk))
+    instance._stored_facet = None
+
+
+@receiver(post_delete, sender=Product)
+def update_facets_on_delete(sender, instance, **kwargs):
+    facets.move(getattr(instance, '_stored_facet', None), None)
+    instance._stored_facet = None
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    """
+    Category names are searchable, so a rename touches its products
+    """
+    if not created:
+        search.index_category(instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorised_products(sender, instance, **kwargs):
+    # Products were moved to category=NULL by SET_NULL
+    search.index_uncategorised()
+    facets.rebuild()
+
+
+@receiver(post_save, sender=ProductImage)
+def queue_image_derivatives(sender, instance, created, **kwargs):
+    """
+    A replaced file needs new resized copies; forget the old ones (so
+    pages show the new original meanwhile) and queue the image for the
+    process_images worker, which deletes their files. New images start
+    out queued. Runs before sync_product_primary_image so the product
+    picks up the change.
+    """
+    source = instance.image.name or ''
+    if created:
+        return
+    # The worker may have moved these on since the instance was loaded
+    instance.refresh_from_db(fields=ProductImage.MAINTAINED_FIELDS)
+    if source == instance.derivatives_source:
+        return
+    if (instance.derivatives_status == ProductImage.DERIVATIVES_PENDING
+            and not instance.derivatives):
+        return  # never processed; the worker will read the new file
+    derivatives.queue(
+        ProductImage.objects.filter(pk=instance.pk), clear=True)
+
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_derivatives(sender, instance, **kwargs):
+    """
+    A deleted image's resized copies go with it, once the delete is
+    committed
+    """
+    # Copies of the current file, or of the one before it if the worker
+    # hasn't got to the new one. The pk is cleared after the delete.
+    storage, pk = instance.image.storage, instance.pk
+    sources = {instance.image.name or '', instance.derivatives_source}
+
+    def delete_copies():
+        for source in sources:
+            derivatives.delete_copies(storage, pk, source)
+
+    transaction.on_commit(delete_copies, robust=True)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def sync_product_primary_image(sender, instance, **kwargs):
+    """
+    Any image change (new upload, delete, is_primary or sort_order
+    edits) can change which image is the product's primary one
+    """
+    Product.sync_primary_image(instance.product_id)
+
+
+@receiver(pre_save, sender=ProductReview)
+def remember_review_state(sender, instance, **kwargs):
+    """
+    Stash the stored row so post_save can apply only the difference
+    """
+    instance._stored_review = (
+        ProductReview.objects.filter(pk=instance.pk).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=ProductReview)
+def update_ratings_on_save(sender, instance, **kwargs):
+    ratings.review_changed(
+        getattr(instance, '_stored_review', None), instance)
+    instance._stored_review = None
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_ratings_on_delete(sender, instance, **kwargs):
+    ratings.review_changed(instance, None)
@@ -0,0 +1,17 @@
+from django import template
+
+from products.cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_cards(products):
+    """
+    Rendered cards for a list of products, fetched from the fragment
+    cache in one round trip:
+
+        {% product_cards page_obj as cards %}
+        {% for product, card in cards %}{{ card }}{% endfor %}
+    """
+    return render_cards(products)
@@ -0,0 +1,30 @@
+from django import template
+
+from products.derivatives import srcset
+
+register = template.Library()
+
+
+@register.inclusion_tag("products/partials/_picture.html")
+def picture(derivatives, fallback, alt, size="card", sizes="100vw",
+            **attrs):
+    """
+    A <picture> offering the WebP and JPEG copies of an image (see
+    products.derivatives), or a plain <img> of ``fallback``, the
+    original file, until they have been made. ``size`` picks the copy
+    for browsers without srcset; any other keyword becomes an attribute
+    of the <img>:
+
+        {% picture img.derivatives img.display_url alt class="w-100" %}
+    """
+    entry = (derivatives or {}).get(size) or {}
+    return {
+        "src": entry.get("jpeg") or fallback,
+        "width": entry.get("width"),
+        "height": entry.get("height"),
+        "webp_srcset": srcset(derivatives or {}, "webp"),
+        "jpeg_srcset": srcset(derivatives or {}, "jpeg"),
+        "sizes": sizes,
+        "alt": alt,
+        "attrs": attrs,
+    }
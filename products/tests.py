@@ -1,3 +1,945 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import checks
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from products import cache as catalog_cache
+from products import cards
+from products import derivatives
+from products import facets
+from products import search
+from products.models import (
+    Category,
+    FacetCell,
+    Product,
+    ProductImage,
+    ProductReview,
+    Wishlist,
+)
+from products.pagination import KeysetPaginator
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.wreaths = Category.objects.create(name="Wreaths")
+        self.door = Product.objects.create(
+            name="Autumn Door Wreath",
+            description="Pumpkins and pine cones.",
+            price=Decimal("30.00"),
+            category=self.wreaths,
+        )
+        self.candle = Product.objects.create(
+            name="Lavender Candle",
+            description="Goes well next to any wreath.",
+            price=Decimal("12.00"),
+        )
+
+    def _search(self, q):
+        return set(search.filter_products(Product.objects.all(), q))
+
+    def test_prefix_and_category_matches(self):
+        self.assertEqual(self._search("lav"), {self.candle})
+        self.assertEqual(self._search("wreaths"), {self.door})
+        self.assertEqual(self._search("wreath"), {self.door, self.candle})
+        self.assertEqual(self._search("pine wreath"), {self.door})
+
+    def test_index_follows_saves_and_deletes(self):
+        self.candle.name = "Rosemary Candle"
+        self.candle.save()
+        self.assertEqual(self._search("lavender"), set())
+
+        self.wreaths.name = "Garlands"
+        self.wreaths.save()
+        self.assertEqual(self._search("garlands"), {self.door})
+
+        self.door.delete()
+        self.assertEqual(self._search("pumpkins"), set())
+
+    def test_relevance_sort(self):
+        response = self.client.get(
+            reverse("products:list"), {"q": "wreath", "sort": "relevance"})
+        self.assertEqual(response.status_code, 200)
+        # A name match outranks a description match
+        self.assertEqual(
+            list(response.context["page_obj"]), [self.door, self.candle])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        # Duplicate prices force the id tie-breaker to do its job
+        for i in range(7):
+            Product.objects.create(
+                name=f"Item {i}", price=Decimal(10 + i % 3))
+
+    def _walk(self, ordering):
+        paginator = KeysetPaginator(Product.objects.all(), ordering, 3)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(after=pages[-1].next_cursor))
+        return paginator, pages
+
+    def test_cursor_walk_matches_offset_order(self):
+        for ordering in ("price", "-price", "-created_at", "name"):
+            paginator, pages = self._walk(ordering)
+            walked = [p for page in pages for p in page]
+            self.assertEqual(walked, list(paginator.queryset))
+            self.assertEqual([len(page) for page in pages], [3, 3, 1])
+            self.assertFalse(pages[0].has_previous())
+
+            back = paginator.get_page(before=pages[2].previous_cursor)
+            self.assertEqual(list(back), list(pages[1]))
+            self.assertTrue(back.has_next())
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        paginator, pages = self._walk("price")
+        self.assertEqual(
+            list(paginator.get_page(after="not-a-cursor")), list(pages[0]))
+        # A cursor minted for another sort column is ignored too
+        other = KeysetPaginator(Product.objects.all(), "name", 3)
+        self.assertEqual(
+            list(other.get_page(after=pages[0].next_cursor)),
+            list(other.get_page()),
+        )
+
+    def test_listing_uses_cursors_and_counts_once(self):
+        url = reverse("products:list")
+        response = self.client.get(url, {"sort": "price", "per": 3})
+        self.assertTrue(response.context["cursor_mode"])
+        self.assertEqual(response.context["total"], 7)
+        next_cursor = response.context["page_obj"].next_cursor
+
+        with self.assertNumQueries(1):
+            # Only the new page's rows; the COUNT and categories are
+            # already in the catalog cache
+            response = self.client.get(
+                url, {"sort": "price", "per": 3, "after": next_cursor})
+        self.assertEqual(len(response.context["page_obj"]), 3)
+
+        # Old numbered links still work
+        response = self.client.get(url, {"page": 3, "per": 3})
+        self.assertFalse(response.context["cursor_mode"])
+        self.assertEqual(len(response.context["page_obj"]), 1)
+
+
+@override_settings(STORAGES={
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+})
+class PrimaryImageTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Holly Wreath", price=Decimal("25.00"))
+
+    def _refresh(self):
+        self.product.refresh_from_db()
+        return self.product.primary_image_url
+
+    def test_primary_image_is_maintained(self):
+        self.assertEqual(self._refresh(), "")
+
+        first = ProductImage.objects.create(
+            product=self.product, image="a.jpg", sort_order=1)
+        self.assertEqual(self._refresh(), "/media/a.jpg")
+
+        second = ProductImage.objects.create(
+            product=self.product, image="b.jpg", sort_order=2,
+            alt_text="Close-up")
+        self.assertEqual(self._refresh(), "/media/a.jpg")
+
+        second.is_primary = True
+        second.save()
+        self.assertEqual(self._refresh(), "/media/b.jpg")
+        self.assertEqual(self.product.primary_image, second)
+        self.assertEqual(self.product.primary_image_alt, "Close-up")
+
+        second.delete()
+        self.assertEqual(self._refresh(), "/media/a.jpg")
+        first.delete()
+        self.assertEqual(self._refresh(), "")
+        self.assertIsNone(self.product.primary_image)
+
+    def test_listing_does_not_query_images(self):
+        ProductImage.objects.create(product=self.product, image="a.jpg")
+        with self.assertNumQueries(4):
+            # rows + COUNT + categories + facet counts, all cold
+            response = self.client.get(reverse("products:list"))
+        self.assertContains(response, 'src="/media/a.jpg"')
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name="Krapek", price=Decimal("15.00"))
+        self.users = [
+            User.objects.create(username=f"user{i}")
+            for i in range(3)
+        ]
+
+    def _review(self, user, rating, **kwargs):
+        return ProductReview.objects.create(
+            product=self.product, user=user, rating=rating,
+            body="Lovely", **kwargs)
+
+    def _state(self):
+        p = Product.objects.get(pk=self.product.pk)
+        return (
+            p.rating_count,
+            round(p.rating_avg, 2),
+            [count for _, count, _ in p.rating_histogram],
+        )
+
+    def test_incremental_updates(self):
+        five = self._review(self.users[0], 5)
+        self._review(self.users[1], 2)
+        hidden = self._review(self.users[2], 1, approved=False)
+        self.assertEqual(self._state(), (2, 3.5, [1, 0, 0, 1, 0]))
+
+        five.rating = 4
+        five.save()
+        self.assertEqual(self._state(), (2, 3.0, [0, 1, 0, 1, 0]))
+
+        hidden.approved = True
+        hidden.save()
+        self.assertEqual(self._state(), (3, 2.33, [0, 1, 0, 1, 1]))
+
+        five.delete()
+        self.assertEqual(self._state(), (2, 1.5, [0, 0, 0, 1, 1]))
+
+        ProductReview.objects.all().delete()
+        self.assertEqual(self._state(), (0, 0.0, [0, 0, 0, 0, 0]))
+
+    def test_recompute_command(self):
+        self._review(self.users[0], 5)
+        self._review(self.users[1], 4)
+        Product.objects.update(rating_count=0, rating_avg=0, rating_count_5=0)
+        call_command("recompute_ratings", stdout=StringIO())
+        self.assertEqual(self._state(), (2, 4.5, [1, 1, 0, 0, 0]))
+
+    def test_rating_sort(self):
+        other = Product.objects.create(name="Wreath", price=Decimal("9.00"))
+        self._review(self.users[0], 3)
+        ProductReview.objects.create(
+            product=other, user=self.users[0], rating=5, body="Great")
+        response = self.client.get(
+            reverse("products:list"), {"sort": "rating"})
+        self.assertEqual(
+            list(response.context["page_obj"]), [other, self.product])
+
+
+class CatalogCacheTests(TestCase):
+    backends = {
+        "locmem": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "catalog-tests",
+        },
+        "file": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": "",
+        },
+        "db": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "catalog_cache_tests",
+        },
+    }
+
+    def _each_backend(self):
+        for name, config in self.backends.items():
+            with self.subTest(backend=name), TemporaryDirectory() as tmp:
+                config = dict(config)
+                if name == "file":
+                    config["LOCATION"] = tmp
+                with override_settings(CACHES={"default": config}):
+                    if name == "db":
+                        call_command("createcachetable", verbosity=0)
+                    cache.clear()
+                    # Each backend starts from the same database state
+                    with transaction.atomic():
+                        yield name
+                        transaction.set_rollback(True)
+
+    def test_get_or_set_and_bump(self):
+        for _ in self._each_backend():
+            calls = []
+
+            def compute():
+                calls.append(1)
+                return ["value"]
+
+            for _ in range(2):
+                self.assertEqual(
+                    catalog_cache.get_or_set("test", ("a", 1), compute),
+                    ["value"])
+            self.assertEqual(len(calls), 1)
+
+            catalog_cache.bump()
+            catalog_cache.get_or_set("test", ("a", 1), compute)
+            self.assertEqual(len(calls), 2)
+
+            # A lost version key starts a fresh namespace
+            cache.delete(catalog_cache.VERSION_KEY)
+            catalog_cache.get_or_set("test", ("a", 1), compute)
+            self.assertEqual(len(calls), 3)
+
+    def test_model_changes_invalidate_pages(self):
+        for _ in self._each_backend():
+            category = Category.objects.create(name="Garlands")
+            product = Product.objects.create(
+                name="Ivy Garland", price=Decimal("20.00"),
+                category=category)
+            url = reverse("products:list")
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertContains(response, "Ivy Garland")
+            # Only the database cache backend itself may hit the DB
+            self.assertFalse([
+                q for q in queries.captured_queries
+                if "products_" in q["sql"]
+            ])
+
+            product.name = "Fern Garland"
+            product.save()
+            self.assertContains(self.client.get(url), "Fern Garland")
+
+            detail = reverse("products:detail", args=[product.slug])
+            self.client.get(detail)
+            ProductReview.objects.create(
+                product=product, rating=5, body="Lovely",
+                user=User.objects.create(username="reviewer"))
+            response = self.client.get(detail)
+            self.assertEqual(response.context["product"].rating_count, 1)
+
+    def test_deploy_check_requires_a_shared_cache(self):
+        def errors(config, debug=False):
+            with override_settings(CACHES={"default": config}, DEBUG=debug):
+                return [
+                    e.id for e in checks.run_checks(
+                        include_deployment_checks=True)
+                    if e.id.startswith("products.")]
+
+        self.assertEqual(errors(self.backends["locmem"]), ["products.E001"])
+        self.assertEqual(errors(self.backends["locmem"], debug=True), [])
+        self.assertEqual(errors(self.backends["db"]), [])
+        # Only the deploy checks care; the test runner's checks pass
+        with override_settings(CACHES={"default": self.backends["locmem"]}):
+            self.assertFalse([
+                e for e in checks.run_checks()
+                if e.id.startswith("products.")])
+
+
+@override_settings(STORAGES={
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+})
+class ProductCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = [
+            Product.objects.create(name=f"Card {i}", price=Decimal("5.00"))
+            for i in range(3)
+        ]
+
+    def _render(self):
+        return dict(cards.render_cards(
+            Product.objects.filter(
+                pk__in=[p.pk for p in self.products]).order_by("pk")))
+
+    def test_warm_render_is_all_hits(self):
+        self._render()
+        self.assertEqual(cards.stats()["misses"], 3)
+        cards.reset_stats()
+
+        self._render()
+        self.assertEqual(
+            cards.stats(), {"hits": 3, "misses": 0, "hit_rate": 1.0})
+
+    def test_counts_are_flushed_to_the_cache_in_batches(self):
+        self._render()
+        cards.stats()
+        with (
+            patch.object(cache, "incr") as incr,
+            patch.object(cache, "add") as add,
+        ):
+            for _ in range(3):
+                self._render()
+        # A warm render is one get_many; the counts wait in process
+        incr.assert_not_called()
+        add.assert_not_called()
+        self.assertEqual(cards.stats()["hits"], 9)
+
+        with patch.object(cards, "STATS_FLUSH_INTERVAL", 0):
+            self._render()
+        self.assertEqual(cache.get(cards.HITS_KEY), 12)
+
+    def test_changes_rerender_only_that_card(self):
+        self._render()
+        first, second, third = self.products
+        first.price = Decimal("7.50")
+        first.save()
+        ProductImage.objects.create(product=second, image="b.jpg")
+        ProductReview.objects.create(
+            product=third, user=User.objects.create(username="reviewer"),
+            rating=4, body="Nice")
+        cards.reset_stats()
+
+        rendered = self._render()
+        self.assertEqual(cards.stats()["misses"], 3)
+        self.assertIn("7.50", rendered[first])
+        self.assertIn('src="/media/b.jpg"', rendered[second])
+        self.assertIn("4.0 (1)", rendered[third])
+
+    def test_listing_uses_cached_cards(self):
+        url = reverse("products:list")
+        self.client.get(url)
+        cards.reset_stats()
+        response = self.client.get(url)
+        self.assertContains(response, "Card 2")
+        self.assertEqual(cards.stats()["hits"], 3)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.candles = Category.objects.create(name="Candles")
+        self.wreaths = Category.objects.create(name="Wreaths")
+        reviewer = User.objects.create(username="reviewer")
+        for name, price, category, stars in [
+            ("Tea Light", "4.00", self.candles, 5),
+            ("Pillar", "12.00", self.candles, 2),
+            ("Jar", "30.00", self.candles, None),
+            ("Holly", "30.00", self.wreaths, 4),
+            ("Grand Door", "80.00", self.wreaths, None),
+        ]:
+            product = Product.objects.create(
+                name=name, price=Decimal(price), category=category)
+            if stars:
+                ProductReview.objects.create(
+                    product=product, user=reviewer, rating=stars, body="-")
+
+    def _get(self, **params):
+        return self.client.get(reverse("products:list"), params).context
+
+    def test_filters_and_disjunctive_counts(self):
+        context = self._get(category="candles", rating=2)
+        self.assertEqual(
+            {p.name for p in context["page_obj"]}, {"Tea Light", "Pillar"})
+        self.assertEqual(
+            [(c.name, n) for c, n in context["category_facets"]],
+            [("Candles", 2), ("Wreaths", 1)],
+        )
+        self.assertEqual(
+            [n for _slug, _label, n in context["price_facets"]],
+            [1, 1, 0, 0],
+        )
+        self.assertEqual(
+            context["rating_facets"], [(4, 1), (3, 1), (2, 2), (1, 2)])
+
+        context = self._get(price="25-50")
+        self.assertEqual(
+            {p.name for p in context["page_obj"]}, {"Jar", "Holly"})
+        self.assertEqual(context["total"], 2)
+
+    def test_counts_come_from_one_cached_query(self):
+        self._get()
+        with self.assertNumQueries(2):
+            # The new selection's rows and total; no facet COUNTs
+            self._get(price="50-plus", rating=4)
+
+        Product.objects.create(
+            name="Beeswax", price=Decimal("5.00"), category=self.candles)
+        context = self._get()
+        self.assertEqual(
+            context["category_facets"][0], (self.candles, 4))
+
+    def _cells(self):
+        return sorted(
+            FacetCell.objects.filter(count__gt=0)
+            .values_list("category", "band", "floor", "count"))
+
+    def test_cells_follow_changes_without_a_rebuild(self):
+        holly = Product.objects.get(name="Holly")
+        holly.price = Decimal("60.00")
+        holly.category = self.candles
+        holly.save()
+        ProductReview.objects.create(
+            product=Product.objects.get(name="Jar"), rating=3, body="-",
+            user=User.objects.create(username="second"))
+        ProductReview.objects.filter(rating=2).get().delete()
+        Product.objects.get(name="Grand Door").delete()
+        tea_light = Product.objects.get(name="Tea Light")
+        tea_light.is_active = False
+        tea_light.save()
+        Product.objects.create(name="Loose", price=Decimal("9.00"))
+
+        incremental = self._cells()
+        facets.rebuild()
+        self.assertEqual(incremental, self._cells())
+
+    def test_catalog_changes_do_not_recount_the_products(self):
+        self._get()
+        ProductReview.objects.create(
+            product=Product.objects.get(name="Jar"), rating=5, body="-",
+            user=User.objects.create(username="second"))
+        with CaptureQueriesContext(connection) as queries:
+            context = self._get()
+        self.assertEqual(context["rating_facets"][0], (4, 3))
+        self.assertFalse([
+            q for q in queries.captured_queries
+            if "GROUP BY" in q["sql"]])
+
+    def test_search_cube_is_cached(self):
+        self._get(q="tea")
+        with CaptureQueriesContext(connection) as queries:
+            context = self._get(q="tea")
+        self.assertEqual(context["category_facets"][0], (self.candles, 1))
+        self.assertFalse([
+            q for q in queries.captured_queries
+            if "GROUP BY" in q["sql"]])
+
+
+class IndexUsageTests(TestCase):
+    """
+    The hot catalog and order queries are served by an index (see the
+    Meta.indexes on Product, Wishlist, ProductReview and Order).
+    """
+
+    def setUp(self):
+        if connection.vendor == "postgresql":
+            # A near-empty table is always cheaper to scan; make the
+            # planner show whether it *can* use an index at all
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, qs):
+        plan = qs.explain()
+        if connection.vendor == "sqlite":
+            uses_index = "USING INDEX" in plan or "COVERING INDEX" in plan
+            self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plan)
+        else:
+            uses_index = "Index" in plan
+        self.assertTrue(uses_index, f"{qs.query}\n{plan}")
+
+    def test_hot_queries_use_indexes(self):
+        from checkout.models import Order
+        from profiles.models import UserProfile
+
+        user = User.objects.create(username="indexed")
+        product = Product.objects.create(name="Pine", price=Decimal("1"))
+        active = Product.objects.filter(is_active=True)
+
+        for ordering in ("-created_at", "name", "price", "-rating_avg"):
+            tie = "-id" if ordering.startswith("-") else "id"
+            with self.subTest(ordering=ordering):
+                self.assertUsesIndex(active.order_by(ordering, tie)[:13])
+        # The staff list, hidden products included
+        for ordering in ("name", "-price", "created_at", "-updated_at"):
+            tie = "-id" if ordering.startswith("-") else "id"
+            with self.subTest(staff=True, ordering=ordering):
+                self.assertUsesIndex(
+                    Product.objects.order_by(ordering, tie)[50:100])
+        for ordering in ("-created_at", "name", "price"):
+            tie = "-id" if ordering.startswith("-") else "id"
+            with self.subTest(category=True, ordering=ordering):
+                self.assertUsesIndex(
+                    active.filter(category_id=1).order_by(ordering, tie)[:13])
+
+        self.assertUsesIndex(
+            Wishlist.objects.filter(user=user).order_by("-created_at"))
+        self.assertUsesIndex(
+            ProductReview.objects.filter(product=product, approved=True)
+            .order_by("-created_at"))
+        self.assertUsesIndex(Order.objects.filter(stripe_pid="pi_123"))
+        self.assertUsesIndex(
+            Order.objects.filter(
+                user_profile=UserProfile.objects.get(user=user))
+            .order_by("-date"))
+
+
+class BenchmarkViewsTests(TestCase):
+    def test_fails_on_more_queries_than_the_baseline(self):
+        with TemporaryDirectory() as tmp:
+            baseline = Path(tmp) / "views.json"
+            options = {
+                "sizes": [30], "repeat": 1, "baseline": baseline,
+                # One sample is too noisy to compare latency with
+                "min_delta_ms": 10_000, "stdout": StringIO(),
+            }
+            call_command("benchmark_views", save_baseline=True, **options)
+            call_command("benchmark_views", **options)
+
+            data = json.loads(baseline.read_text())
+            data["30"]["detail"]["cold_queries"] -= 1
+            baseline.write_text(json.dumps(data))
+            with self.assertRaisesMessage(CommandError, "30 detail"):
+                call_command("benchmark_views", **options)
+
+
+@override_settings(STORAGES={
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+})
+class GenerateDatasetTests(TestCase):
+    def _generate(self):
+        from checkout.models import Order
+
+        with transaction.atomic():
+            call_command(
+                "generate_dataset", products=40, users=10, reviews=60,
+                orders=15, batch_size=7, stdout=StringIO())
+            products = Product.objects.filter(slug__startswith="seed-")
+            snapshot = {
+                "products": list(products.order_by("slug").values_list(
+                    "slug", "name", "price", "rating_count")),
+                "images": ProductImage.objects.count(),
+                "wishlists": Wishlist.objects.count(),
+                "orders": list(Order.objects.order_by("stripe_pid")
+                               .values_list("order_number", "grand_total")),
+            }
+            self.assertEqual(products.count(), 40)
+            self.assertFalse(products.filter(primary_image=None).exists())
+            self.assertEqual(
+                products.filter(primary_image_url="").count(), 0)
+            self.assertEqual(
+                ProductReview.objects.count(),
+                sum(p[3] for p in snapshot["products"])
+                + ProductReview.objects.filter(approved=False).count())
+            transaction.set_rollback(True)
+        return snapshot
+
+    def test_same_seed_same_data(self):
+        with TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media):
+            first = self._generate()
+            self.assertEqual(first["images"], 120)
+            self.assertEqual(len(first["orders"]), 15)
+            self.assertEqual(self._generate(), first)
+
+
+class ProductTransferTests(TestCase):
+    def setUp(self):
+        self.wreaths = Category.objects.create(name="Wreaths")
+        self.holly = Product.objects.create(
+            name="Holly Wreath", sku="WR001", price=Decimal("25.00"),
+            category=self.wreaths)
+        self.staff = User.objects.create_user(
+            "staff", password="x", is_staff=True)
+
+    def test_import_upserts_and_reports_bad_rows(self):
+        rows = (
+            "sku,name,category,price,is_active,stock\n"
+            "WR001,Holly Wreath,Wreaths,27.50,false,\n"
+            "WR002,Pine Wreath,wreaths,30.00,true,5\n"
+            "WR003,Broken,Nowhere,abc,true,\n"
+            "WR004,,Wreaths,10.00,true,\n"
+            "WR002,Pine Again,,1.00,,\n"
+        )
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / "products.csv"
+            path.write_text(rows)
+            err = StringIO()
+            call_command(
+                "import_products", str(path), batch_size=2,
+                stdout=StringIO(), stderr=err)
+
+        self.holly.refresh_from_db()
+        self.assertEqual(self.holly.price, Decimal("27.50"))
+        self.assertFalse(self.holly.is_active)
+        pine = Product.objects.get(sku="WR002")
+        self.assertEqual(
+            (pine.slug, pine.category, pine.stock),
+            ("pine-wreath", self.wreaths, 5))
+        self.assertEqual(
+            list(search.filter_products(Product.objects.all(), "pine")),
+            [pine])
+        self.assertIn("line 4 WR003: category: no category", err.getvalue())
+        self.assertIn("price:", err.getvalue())
+        self.assertIn("line 5 WR004: name:", err.getvalue())
+        self.assertIn("line 6 WR002: sku: repeated", err.getvalue())
+
+    def test_partial_rows_update_only_their_columns(self):
+        from products import transfer
+
+        csv_rows = transfer.read_rows(
+            StringIO("sku,is_active\nWR001,false\n"), "csv")
+        result = transfer.import_products(csv_rows)
+        self.assertEqual((result.updated, result.error_count), (1, 0))
+
+        jsonl_rows = transfer.read_rows(
+            StringIO('{"sku": "WR001", "stock": 3}\n'), "jsonl")
+        result = transfer.import_products(jsonl_rows)
+        self.assertEqual((result.updated, result.error_count), (1, 0))
+
+        self.holly.refresh_from_db()
+        self.assertEqual(
+            (self.holly.name, self.holly.price, self.holly.is_active,
+             self.holly.stock, self.holly.category),
+            ("Holly Wreath", Decimal("25.00"), False, 3, self.wreaths))
+
+    def test_export_round_trips_through_the_staff_views(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(
+            reverse("products:product_export"), {"format": "jsonl"})
+        exported = b"".join(response.streaming_content).decode()
+        self.assertEqual(json.loads(exported)["sku"], "WR001")
+
+        upload = exported.replace("Holly Wreath", "Holly Door Wreath")
+        response = self.client.post(reverse("products:product_import"), {
+            "file": SimpleUploadedFile("products.jsonl", upload.encode()),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["result"].updated, 1)
+        self.holly.refresh_from_db()
+        self.assertEqual(self.holly.name, "Holly Door Wreath")
+
+        self.client.logout()
+        response = self.client.get(reverse("products:product_export"))
+        self.assertEqual(response.status_code, 302)
+
+
+class StaffProductListTests(TestCase):
+    def setUp(self):
+        self.wreaths = Category.objects.create(name="Wreaths")
+        self.gifts = Category.objects.create(name="Gifts")
+        Product.objects.bulk_create([
+            Product(
+                name=f"Wreath {i:02}", slug=f"wreath-{i}",
+                price=Decimal(10 + i), category=self.wreaths)
+            for i in range(55)
+        ])
+        self.holly = Product.objects.create(
+            name="Holly Garland", price=Decimal("9999.00"),
+            category=self.wreaths)
+        self.staff = User.objects.create_user(
+            "staff", password="x", is_staff=True)
+        self.client.force_login(self.staff)
+
+    def bulk(self, follow=False, **data):
+        return self.client.post(
+            reverse("products:product_bulk_action"),
+            {"return_query": "sort=-price&page=2", **data}, follow=follow)
+
+    def test_pages_and_sorts(self):
+        response = self.client.get(
+            reverse("products:admin_product_list"),
+            {"sort": "-price", "page": 2})
+        page = response.context["page_obj"]
+        self.assertEqual(page.paginator.count, 56)
+        self.assertEqual(
+            [p.name for p in page],
+            [f"Wreath {i:02}" for i in range(5, -1, -1)])
+        self.assertEqual(
+            response.context["sort_links"]["price"]["url"], "?sort=price")
+        self.assertContains(response, "?sort=-price&page=1")
+
+    def test_each_action_is_one_update(self):
+        ids = list(Product.objects.filter(
+            name__in=["Wreath 00", "Wreath 01"]).values_list("pk", flat=True))
+        for data in (
+            {"action": "deactivate"},
+            {"action": "set_category", "target_category": self.gifts.pk},
+            {"action": "adjust_price", "percent": "-12.5"},
+        ):
+            with self.subTest(**data), CaptureQueriesContext(
+                    connection) as queries:
+                response = self.bulk(selected=ids, **data)
+            self.assertRedirects(
+                response,
+                reverse("products:admin_product_list") + "?sort=-price&page=2",
+                fetch_redirect_response=False)
+            updates = [
+                q["sql"] for q in queries
+                if q["sql"].startswith('UPDATE "products_product"')]
+            self.assertEqual(len(updates), 1, updates)
+
+        moved = Product.objects.filter(pk__in=ids).order_by("name")
+        self.assertEqual(
+            [(p.is_active, p.category, p.price) for p in moved],
+            [(False, self.gifts, Decimal("8.75")),
+             (False, self.gifts, Decimal("9.63"))])
+        self.assertEqual(
+            list(search.filter_products(Product.objects.all(), "gifts")),
+            list(moved))
+
+    def test_select_all_follows_the_filters(self):
+        self.bulk(action="adjust_price", percent="50", select_all="on",
+                  q="holly")
+        self.holly.refresh_from_db()
+        self.assertEqual(self.holly.price, Decimal("9999.99"))
+        self.assertFalse(
+            Product.objects.filter(price__gt=Decimal("100")).exclude(
+                pk=self.holly.pk).exists())
+
+        self.bulk(action="deactivate", select_all="on",
+                  category=self.wreaths.pk)
+        self.assertFalse(Product.objects.filter(is_active=True).exists())
+
+    def test_invalid_action_changes_nothing(self):
+        response = self.bulk(
+            action="adjust_price", selected=[self.holly.pk], follow=True)
+        self.assertContains(response, "Enter a percentage.")
+        self.holly.refresh_from_db()
+        self.assertEqual(self.holly.price, Decimal("9999.00"))
+
+        self.client.logout()
+        self.client.force_login(
+            User.objects.create_user("shopper", password="x"))
+        response = self.bulk(action="deactivate", selected=[self.holly.pk])
+        self.assertEqual(response.status_code, 302)
+        self.holly.refresh_from_db()
+        self.assertTrue(self.holly.is_active)
+
+
+def png(size=(2400, 1600)):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGBA", size, (200, 30, 30, 128)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@override_settings(STORAGES={
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+})
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        settings = self.settings(MEDIA_ROOT=media.name, MEDIA_URL="/media/")
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.product = Product.objects.create(
+            name="Holly Wreath", price=Decimal("25.00"))
+        self.image = ProductImage.objects.create(
+            product=self.product, alt_text="Holly",
+            image=SimpleUploadedFile("holly.png", png()))
+
+    def test_worker_makes_copies_for_srcset(self):
+        call_command("process_images", stdout=StringIO())
+
+        self.product.refresh_from_db()
+        copies = self.product.primary_image_derivatives
+        self.assertEqual(
+            {size: (c["width"], c["height"]) for size, c in copies.items()},
+            {"thumb": (160, 107), "card": (480, 320),
+             "detail": (1200, 800)})
+        self.assertTrue(copies["card"]["webp"].endswith("holly-card.webp"))
+
+        response = self.client.get(reverse("products:list"))
+        self.assertContains(
+            response,
+            f'<source type="image/webp" srcset="{copies["thumb"]["webp"]} '
+            f'160w, {copies["card"]["webp"]} 480w, '
+            f'{copies["detail"]["webp"]} 1200w"')
+        self.assertContains(response, f'src="{copies["card"]["jpeg"]}"')
+
+    def test_new_file_is_queued_again(self):
+        derivatives.drain()
+        self.image.image = SimpleUploadedFile("pine.png", png((300, 200)))
+        self.image.save()
+        self.image.refresh_from_db()
+        self.assertEqual(
+            (self.image.derivatives_status, self.image.derivatives),
+            (ProductImage.DERIVATIVES_PENDING, {}))
+        # Pages show the new original until the copies are made
+        response = self.client.get(reverse("products:list"))
+        self.assertNotContains(response, "<picture>")
+
+        call_command("backfill_image_derivatives", stdout=StringIO())
+        self.product.refresh_from_db()
+        copies = self.product.primary_image_derivatives
+        self.assertIn("pine-thumb.jpg", copies["thumb"]["jpeg"])
+        # Never upscaled
+        self.assertEqual(copies["detail"]["width"], 300)
+
+    def _copies(self, image_pk=None):
+        folder = self.media / "derivatives" / str(image_pk or self.image.pk)
+        return sorted(p.name for p in folder.iterdir())
+
+    def test_old_copies_are_deleted(self):
+        derivatives.drain()
+        self.assertEqual(len(self._copies()), 6)
+        self.image.image = SimpleUploadedFile("pine.png", png((300, 200)))
+        self.image.save()
+        derivatives.drain()
+        copies = self._copies()
+        self.assertEqual(len(copies), 6)
+        self.assertTrue(all(name.startswith("pine") for name in copies))
+
+        image_pk = self.image.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.image.delete()
+        self.assertEqual(self._copies(image_pk), [])
+
+    def test_retry_replaces_copies_from_a_failed_attempt(self):
+        # A first attempt stored one copy and then failed
+        left_over = derivatives.derivative_name(self.image, "detail", "webp")
+        self.image.image.storage.save(left_over, ContentFile(b"partial"))
+        derivatives.drain()
+        self.assertEqual(len(self._copies()), 6)
+        self.image.refresh_from_db()
+        self.assertTrue(self.image.derivatives["detail"]["webp"].endswith(
+            "/holly-detail.webp"))
+
+    def test_failures_back_off_then_give_up(self):
+        broken = ProductImage.objects.create(
+            product=self.product,
+            image=SimpleUploadedFile("broken.png", b"not an image"))
+        with self.assertLogs("products.derivatives", "ERROR"):
+            self.assertEqual(derivatives.drain(), (1, 1))
+        broken.refresh_from_db()
+        self.assertEqual(broken.derivatives_attempts, 1)
+        self.assertGreater(broken.derivatives_due_at, timezone.now())
+
+        ProductImage.objects.filter(pk=broken.pk).update(
+            derivatives_due_at=timezone.now())
+        with self.assertLogs("products.derivatives", "ERROR"):
+            derivatives.drain(max_attempts=2)
+        broken.refresh_from_db()
+        self.assertEqual(
+            broken.derivatives_status, ProductImage.DERIVATIVES_FAILED)
+
+    def test_deployed_worker_makes_the_copies(self):
+        # The Procfile's worker runs run_workers, which drains this queue
+        # along with the checkout ones
+        procfile = Path(settings.BASE_DIR, "Procfile").read_text()
+        self.assertIn("worker: python manage.py run_workers", procfile)
+
+        call_command("run_workers", once=True, stdout=StringIO())
+        self.image.refresh_from_db()
+        self.assertEqual(
+            self.image.derivatives_status, ProductImage.DERIVATIVES_DONE)
+        self.product.refresh_from_db()
+        self.assertIn("detail", self.product.primary_image_derivatives)
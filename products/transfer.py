@@ -0,0 +1,354 @@
+"""
+Catalog import and export as CSV or JSON Lines.
+
+One row per product, keyed on ``sku``::
+
+    sku,name,slug,category,description,price,is_active,stock
+    WR001,Holly Wreath,holly-wreath,Wreaths,...,25.00,true,4
+
+``category`` is the category's name (or slug). A file may carry any
+subset of the columns as long as ``sku`` is one of them: existing
+products only have the columns present updated, while new ones need at
+least ``name`` and ``price``.
+
+``import_products`` reads rows lazily, cleans each one with the model
+fields' own validation (no per-row queries) and saves them
+``batch_size`` at a time, a transaction per batch: existing skus with
+``bulk_update`` of just the columns present, new ones with
+``bulk_create``. A bad row is reported in the result and skipped;
+the rest of the file still goes in. Imported products are reindexed for
+search batch by batch; the facet counts are rebuilt and the catalog
+cache bumped once at the end.
+
+``export_lines`` streams the catalog a chunk of rows at a time, so
+exporting a large catalog doesn't hold it in memory; the
+export_products command writes it to a file and the staff export view
+to a StreamingHttpResponse.
+"""
+import csv
+import io
+import json
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import cache as catalog_cache
+from . import facets, search
+from .models import Category, Product
+
+COLUMNS = [
+    "sku", "name", "slug", "category", "description", "price", "is_active",
+    "stock",
+]
+FORMATS = ("csv", "jsonl")
+REQUIRED_FOR_NEW = ("name", "price")
+MAX_ERRORS_KEPT = 1000
+
+BOOLEANS = {
+    "true": True, "t": True, "yes": True, "y": True, "1": True,
+    "false": False, "f": False, "no": False, "n": False, "0": False,
+}
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        # [(line, sku, message)], the first MAX_ERRORS_KEPT of them
+        self.errors = []
+
+    def error(self, line, sku, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS_KEPT:
+            self.errors.append((line, sku, message))
+
+    def __str__(self):
+        return (
+            f"{self.created} created, {self.updated} updated, "
+            f"{self.error_count} rejected")
+
+
+def format_for(filename, default="csv"):
+    """The format implied by a file name's extension."""
+    for fmt in FORMATS:
+        if filename.lower().endswith(f".{fmt}"):
+            return fmt
+    if filename.lower().endswith(".json"):
+        return "jsonl"
+    return default
+
+
+def read_rows(text, fmt):
+    """
+    (line number, dict) for each row of the text stream ``text``. Lines
+    of a JSONL file that aren't JSON objects come through as strings,
+    for ``import_products`` to reject.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            row = f"Invalid JSON: {e}"
+        else:
+            if not isinstance(row, dict):
+                row = "Expected a JSON object."
+        yield line_num, row
+
+
+def _categories():
+    """{name or slug: id} for every category."""
+    lookup = {}
+    for pk, name, slug in Category.objects.values_list("pk", "name", "slug"):
+        lookup[name.lower()] = pk
+        if slug:
+            lookup[slug.lower()] = pk
+    return lookup
+
+
+def clean_row(row, categories):
+    """
+    Field values for the known columns in ``row``, cleaned by the model
+    fields. Raises ValidationError with every problem in the row.
+    """
+    values = {}
+    errors = []
+    if row.get("sku") in ("", None):
+        errors.append("sku: required.")
+    for column in COLUMNS:
+        if column not in row:
+            continue
+        value = row[column]
+        if isinstance(value, str):
+            value = value.strip()
+        if column == "category":
+            if value in ("", None):
+                values["category_id"] = None
+            elif str(value).lower() in categories:
+                values["category_id"] = categories[str(value).lower()]
+            else:
+                errors.append(f"category: no category called '{value}'.")
+            continue
+
+        field = Product._meta.get_field(column)
+        if isinstance(field, BooleanField):
+            if value in ("", None):
+                continue  # keep the current value, or the default
+            value = BOOLEANS.get(str(value).lower(), value)
+        elif value in ("", None):
+            value = None if field.null else ""
+        elif isinstance(value, float):
+            value = Decimal(str(value))
+        try:
+            values[column] = field.clean(value, None)
+        except ValidationError as e:
+            errors += [f"{column}: {message}" for message in e.messages]
+
+    if errors:
+        raise ValidationError(errors)
+    return values
+
+
+def _create(rows, result):
+    """
+    Insert ``rows`` ([(line, values)] of new skus with the same columns)
+    in one statement; if the database refuses the batch, row by row so
+    only the offending rows are rejected. A sku created by someone else
+    meanwhile is updated instead. Returns the saved products.
+    """
+    update_fields = [c for c in rows[0][1] if c != "sku"] + ["updated_at"]
+
+    def save(rows):
+        return Product.objects.bulk_create(
+            [Product(**values) for _, values in rows],
+            update_conflicts=True,
+            unique_fields=["sku"],
+            update_fields=update_fields,
+        )
+
+    try:
+        with transaction.atomic():
+            return save(rows)
+    except IntegrityError:
+        pass
+    saved = []
+    for line, values in rows:
+        try:
+            with transaction.atomic():
+                saved += save([(line, values)])
+        except IntegrityError as e:
+            result.error(line, values["sku"], str(e))
+    return saved
+
+
+def _update(rows, products, result):
+    """
+    Write ``rows`` ([(line, values)] of existing skus with the same
+    columns) onto ``products`` ({sku: Product}) with one bulk_update,
+    touching only those columns; row by row if the batch is refused.
+    Returns the saved products.
+    """
+    fields = [c for c in rows[0][1] if c != "sku"] + ["updated_at"]
+    now = timezone.now()
+    changed = []
+    for _, values in rows:
+        product = products[values["sku"]]
+        for column, value in values.items():
+            setattr(product, column, value)
+        product.updated_at = now
+        changed.append(product)
+
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_update(changed, fields)
+        return changed
+    except IntegrityError:
+        pass
+    saved = []
+    for (line, values), product in zip(rows, changed):
+        try:
+            with transaction.atomic():
+                Product.objects.bulk_update([product], fields)
+        except IntegrityError as e:
+            result.error(line, values["sku"], str(e))
+        else:
+            saved.append(product)
+    return saved
+
+
+def _import_batch(batch, result):
+    skus = [values["sku"] for _, values in batch]
+    existing = Product.objects.in_bulk(skus, field_name="sku")
+
+    accepted = []
+    for line, values in batch:
+        if values["sku"] not in existing:
+            missing = [c for c in REQUIRED_FOR_NEW if not values.get(c)]
+            if missing:
+                result.error(
+                    line, values["sku"],
+                    f"New product needs {', '.join(missing)}.")
+                continue
+            if not values.get("slug"):
+                values["slug"] = slugify(values["name"])
+        elif "slug" in values and not values["slug"]:
+            del values["slug"]  # an empty cell keeps the current slug
+        accepted.append((line, values))
+
+    # A slug taken by another product (in the database or earlier in
+    # this batch) would fail the whole batch
+    owners = dict(Product.objects.filter(
+        slug__in=[v["slug"] for _, v in accepted if v.get("slug")],
+    ).values_list("slug", "sku"))
+    groups = {}
+    for line, values in accepted:
+        slug = values.get("slug")
+        if slug and owners.setdefault(slug, values["sku"]) != values["sku"]:
+            result.error(
+                line, values["sku"], f"slug: '{slug}' is already taken.")
+            continue
+        # Existing products only get the columns the file has, which
+        # an INSERT can't do (it needs every NOT NULL column). Rows are
+        # grouped by their columns, too, because JSONL rows can differ.
+        is_new = values["sku"] not in existing
+        groups.setdefault((is_new, tuple(values)), []).append(
+            (line, values))
+
+    with transaction.atomic():
+        saved = []
+        created = 0
+        for (is_new, _), rows in groups.items():
+            if is_new:
+                new = _create(rows, result)
+                created += len(new)
+                saved += new
+            else:
+                saved += _update(rows, existing, result)
+        search.index_products([p.pk for p in saved])
+    result.created += created
+    result.updated += len(saved) - created
+
+
+def import_products(rows, batch_size=1000):
+    """
+    Upsert products from ``rows`` ((line, dict) pairs, e.g. from
+    ``read_rows``). Returns an ImportResult.
+    """
+    result = ImportResult()
+    categories = _categories()
+    seen = set()
+    batch = []
+    for line, row in rows:
+        if isinstance(row, str):
+            result.error(line, "", row)
+            continue
+        try:
+            values = clean_row(row, categories)
+        except ValidationError as e:
+            result.error(line, row.get("sku") or "", " ".join(e.messages))
+            continue
+        if values["sku"] in seen:
+            result.error(line, values["sku"], "sku: repeated in this file.")
+            continue
+        seen.add(values["sku"])
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            _import_batch(batch, result)
+            batch = []
+    if batch:
+        _import_batch(batch, result)
+    facets.rebuild()
+    catalog_cache.bump_on_commit()
+    return result
+
+
+def _export_values(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def export_lines(fmt="csv", queryset=None, chunk_size=2000):
+    """
+    The catalog (or ``queryset``) as CSV or JSONL text, a line at a
+    time, read from the database ``chunk_size`` rows at a time.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    rows = queryset.order_by("pk").values_list(
+        "sku", "name", "slug", "category__name", "description", "price",
+        "is_active", "stock",
+    ).iterator(chunk_size=chunk_size)
+
+    if fmt == "jsonl":
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            record["price"] = str(record["price"])
+            yield json.dumps(record) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    yield line(COLUMNS)
+    for row in rows:
+        yield line([_export_values(v) for v in row])
@@ -10,11 +10,26 @@ urlpatterns = [
         views.admin_product_list,
         name="admin_product_list",
     ),
+    path(
+        "admin/products/bulk/",
+        views.product_bulk_action,
+        name="product_bulk_action",
+    ),
     path(
         "admin/products/add/",
         views.product_create,
         name="product_create",
     ),
+    path(
+        "admin/products/import/",
+        views.product_import,
+        name="product_import",
+    ),
+    path(
+        "admin/products/export/",
+        views.product_export,
+        name="product_export",
+    ),
     path(
         "admin/products/<int:pk>/edit/",
         views.product_update,
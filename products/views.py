@@ -1,12 +1,31 @@
-from django.core.paginator import Paginator
-from django.db.models import Q, Count, Avg
+import io
+from urllib.parse import urlencode
+
+from django.db.models import Q, Count
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.views.decorators.http import require_POST
 from django.urls import reverse
 
+from cwh_site import timing
+from . import cache as catalog_cache
+from . import bulk, facets, search, transfer
 from .models import Category, Product, Wishlist, ProductReview
-from .forms import ProductForm, ProductReviewForm, ProductImageFormSet
+from .forms import (
+    ProductBulkActionForm,
+    ProductForm,
+    ProductImageFormSet,
+    ProductImportForm,
+    ProductReviewForm,
+)
+from .pagination import (
+    CountCachingPaginator,
+    KeysetPaginator,
+    cached_count,
+    queryset_key,
+)
 
 # Map UI sort values to queryset order_by
 SORT_MAP = {
@@ -15,26 +34,31 @@ SORT_MAP = {
     "-name": "-name",
     "price": "price",
     "-price": "-price",
+    "rating": "-rating_avg",
+    "relevance": "-search_rank",
 }
 
 PER_OPTIONS = [12, 24, 36, 48]
 
 
 def category_list(request):
-    categories = (
-        Category.objects.filter(is_active=True)
-        .annotate(
-            product_count=Count(
-                "product",
-                filter=Q(product__is_active=True),
+    categories = catalog_cache.get_or_set(
+        catalog_cache.CATEGORIES, "with-counts", lambda: list(
+            Category.objects.filter(is_active=True)
+            .annotate(
+                product_count=Count(
+                    "product",
+                    filter=Q(product__is_active=True),
+                )
             )
-        )
-        .order_by("sort_order", "name")
+            .order_by("sort_order", "name")
+        ),
     )
-    latest_products = (
-        Product.objects.filter(is_active=True)
-        .order_by("-created_at")
-        .prefetch_related("images")[:8]
+    latest_products = catalog_cache.get_or_set(
+        catalog_cache.PRODUCT_LIST, "latest", lambda: list(
+            Product.objects.filter(is_active=True)
+            .order_by("-created_at")[:8]
+        ),
     )
     return render(request, "products/category_list.html", {
         "categories": categories,
@@ -45,35 +69,57 @@ def category_list(request):
 def _apply_catalog_filters(request, qs):
     """
     Apply search (?q=), sort (?sort=...),
-    and pagination (?per=, ?page=) to a base queryset.
+    and pagination (?per=, ?after=/?before= or ?page=) to a base queryset.
     Returns (page_obj, ctx_extras_dict).
     """
     # --- Search ---
     q = (request.GET.get("q") or "").strip()
+    sort_param = request.GET.get("sort") or "newest"
+    if sort_param not in SORT_MAP or (sort_param == "relevance" and not q):
+        sort_param = "newest"
     if q:
-        qs = qs.filter(
-            Q(name__icontains=q) |
-            Q(description__icontains=q) |
-            Q(category__name__icontains=q)
-        )
+        qs = search.filter_products(
+            qs, q, rank=(sort_param == "relevance"))
 
     # --- Sort ---
-    sort_param = request.GET.get("sort") or "newest"
-    qs = qs.order_by(SORT_MAP.get(sort_param, "-created_at"))
+    ordering = SORT_MAP[sort_param]
 
     # --- Pagination ---
     try:
         per_page = max(1, min(48, int(request.GET.get("per", "12"))))
     except ValueError:
         per_page = 12
-    paginator = Paginator(qs, per_page)
-    page_obj = paginator.get_page(request.GET.get("page"))
+
+    # Cursor pages by default; numbered pages for old ?page= links and
+    # for relevance, whose rank isn't a column a cursor can seek on.
+    page_number = request.GET.get("page")
+    cursor_mode = not page_number and sort_param != "relevance"
+    if cursor_mode:
+        paginator = KeysetPaginator(qs, ordering, per_page)
+        after = request.GET.get("after")
+        before = request.GET.get("before")
+        if q:
+            # Free-text searches are too varied to be worth caching
+            page_obj = paginator.get_page(after=after, before=before)
+        else:
+            page_obj = catalog_cache.get_or_set(
+                catalog_cache.PRODUCT_LIST,
+                (queryset_key(paginator.queryset), per_page, after, before),
+                lambda: paginator.get_page(after=after, before=before),
+            )
+        total = cached_count(qs)
+    else:
+        paginator = CountCachingPaginator(
+            qs.order_by(ordering, "-id"), per_page)
+        page_obj = paginator.get_page(page_number)
+        total = paginator.count
 
     return page_obj, {
         "q": q,
         "sort_param": sort_param,
         "per_page": per_page,
-        "total": qs.count(),
+        "total": total,
+        "cursor_mode": cursor_mode,
     }
 
 
@@ -82,13 +128,13 @@ def product_list_by_category(request, slug):
     List products in a single category with search/sort/pagination.
     Supports:
       ?q=phrase
-      ?sort=newest|name|-name|price|-price
+      ?sort=newest|name|-name|price|-price|rating|relevance
       ?per=12|24|36|48
+      ?after=<cursor> / ?before=<cursor>
     """
     category = get_object_or_404(Category, slug=slug, is_active=True)
     base_qs = (
         Product.objects.filter(is_active=True, category=category)
-        .prefetch_related('images')
         .select_related('category')
     )
 
@@ -103,57 +149,120 @@ def product_list_by_category(request, slug):
 
 
 def product_list(request):
-    base_qs = (
-        Product.objects.filter(is_active=True)
-        .prefetch_related('images')
-        .select_related('category')
+    """
+    All products with search/sort/pagination plus facet filters:
+      ?category=<slug or id>
+      ?price=<band slug> (see facets.PRICE_BANDS)
+      ?rating=<minimum stars>
+    """
+    active = Product.objects.filter(is_active=True)
+    base_qs = active.select_related('category')
+
+    categories = catalog_cache.get_or_set(
+        catalog_cache.CATEGORIES, "by-name", lambda: list(
+            Category.objects.filter(is_active=True).order_by('name')),
     )
 
     # Optional category filter via query string (?category=<slug or id>)
     category_param = (request.GET.get("category") or "").strip()
+    category_id = None
     if category_param:
         if category_param.isdigit():
-            base_qs = base_qs.filter(category_id=int(category_param))
+            category_id = int(category_param)
+            base_qs = base_qs.filter(category_id=category_id)
         else:
             base_qs = base_qs.filter(category__slug=category_param)
+            category_id = next(
+                (c.pk for c in categories if c.slug == category_param),
+                None,
+            )
+
+    price_param, rating_param = facets.parse(request.GET)
+    base_qs = facets.apply(base_qs, price_param, rating_param)
 
     page_obj, extras = _apply_catalog_filters(request, base_qs)
 
-    categories = Category.objects.filter(is_active=True).order_by('name')
+    # Facet counts from the cube of all active products (or of the
+    # search hits), never one COUNT per facet value
+    q = extras["q"]
+    cube = (
+        facets.search_cube(search.filter_products(active, q)) if q
+        else facets.catalog_cube()
+    )
+    counts = facets.counts(
+        cube,
+        category_id=category_id, price=price_param, rating=rating_param,
+    )
 
     return render(request, 'products/product_list.html', {
         'page_obj': page_obj,
         'categories': categories,
         'category_param': category_param,
+        'category_facets': [
+            (c, counts['category'].get(c.pk, 0)) for c in categories
+        ],
+        'price_facets': [
+            (slug, label, counts['price'][slug])
+            for slug, label, _low, _high in facets.PRICE_BANDS
+        ],
+        'rating_facets': [
+            (stars, counts['rating'][stars])
+            for stars in facets.RATING_FLOORS
+        ],
+        'price_param': price_param,
+        'rating_param': rating_param,
         **extras,
         'per_options': PER_OPTIONS,
     })
 
 
-def product_detail(request, slug):
-    product = get_object_or_404(
-        Product.objects.prefetch_related('images', 'category'),
-        slug=slug,
-        is_active=True,
+def _product_detail_payload(slug):
+    """
+    The shared, user-independent part of a product page: the product,
+    its gallery and the gallery JSON. None if there is no such product.
+    """
+    product = (
+        Product.objects.select_related('category')
+        .prefetch_related('images')
+        .filter(slug=slug, is_active=True)
+        .first()
     )
-    # This picks primary image or first as fallback
-    primary = product.images.filter(
-        is_primary=True,
-    ).first() or product.images.first()
+    if product is None:
+        return None
     gallery = list(product.images.all())
+    # Build each storage URL once; the template reads img.display_url
+    with timing.phase('images'):
+        for img in gallery:
+            img.display_url = img.image.url if img.image else ''
+    # The cached primary image, else the first image as fallback
+    primary = next(
+        (img for img in gallery if img.pk == product.primary_image_id),
+        gallery[0] if gallery else None,
+    )
 
     gallery_js = []
-    if primary:
-        gallery_js.append({
-            'url': primary.image.url,
-            'alt': primary.alt_text or product.name,
-        })
-    for img in gallery:
-        if not any(g['url'] == img.image.url for g in gallery_js):
+    seen = set()
+    for img in ([primary] if primary else []) + gallery:
+        if img.display_url not in seen:
+            seen.add(img.display_url)
+            # The modal's full view; the detail copy once it exists
+            detail = img.derivatives.get('detail', {})
             gallery_js.append({
-                'url': img.image.url,
+                'url': detail.get('jpeg') or img.display_url,
                 'alt': img.alt_text or product.name,
             })
+    return product, primary, gallery, gallery_js
+
+
+def product_detail(request, slug):
+    payload = catalog_cache.get_or_set(
+        # The trailing number versions the payload's shape
+        catalog_cache.PRODUCT_DETAIL, (slug, 3),
+        lambda: _product_detail_payload(slug),
+    )
+    if payload is None:
+        raise Http404("No Product matches the given query.")
+    product, primary, gallery, gallery_js = payload
 
     # Wishlist info
     in_wishlist = False
@@ -163,9 +272,9 @@ def product_detail(request, slug):
             product=product,
         ).exists()
 
-    # Reviews + average rating
-    reviews = product.reviews.filter(approved=True)
-    average_rating = reviews.aggregate(avg=Avg('rating'))['avg']
+    # Reviews; the average comes from the denormalised aggregates
+    reviews = product.reviews.filter(approved=True).select_related('user')
+    average_rating = product.rating_avg if product.rating_count else None
 
     user_review = None
     if request.user.is_authenticated:
@@ -192,21 +301,30 @@ def _is_staff_user(user):
     return user.is_active and user.is_staff
 
 
-@login_required
-@user_passes_test(_is_staff_user)
-def admin_product_list(request):
+# Staff list sort values -> order_by; id in the same direction breaks ties
+ADMIN_SORTS = {
+    "name": "name",
+    "-name": "-name",
+    "price": "price",
+    "-price": "-price",
+    "created": "created_at",
+    "-created": "-created_at",
+    "updated": "updated_at",
+    "-updated": "-updated_at",
+}
+ADMIN_PER_PAGE = 50
+
+
+def _admin_products(params):
     """
-    Admin-facing list of all products, with search, filters,
-    thumbnail and links to edit/delete.
+    Products matching the staff list's filters in ``params`` (GET for
+    the list, POST for a bulk action on all matches), and the cleaned
+    filter values.
     """
-    products = (
-        Product.objects.all()
-        .select_related('category')
-        .prefetch_related('images')
-    )
+    products = Product.objects.all()
 
     # Search by name/description/SKU
-    q = (request.GET.get("q") or "").strip()
+    q = (params.get("q") or "").strip()
     if q:
         products = products.filter(
             Q(name__icontains=q)
@@ -215,7 +333,7 @@ def admin_product_list(request):
         )
 
     # Filter by category (id)
-    raw_category = (request.GET.get("category") or "").strip()
+    raw_category = (params.get("category") or "").strip()
     category_id = None
     if raw_category:
         try:
@@ -225,21 +343,171 @@ def admin_product_list(request):
             category_id = None
 
     # Filter by active status
-    active_param = (request.GET.get("active") or "").strip()
+    active_param = (params.get("active") or "").strip()
     if active_param == "1":
         products = products.filter(is_active=True)
     elif active_param == "0":
         products = products.filter(is_active=False)
 
-    products = products.order_by("name")
-    categories = Category.objects.filter(is_active=True).order_by("name")
+    return products, {
+        "q": q,
+        "category_id": category_id,
+        "active_param": active_param,
+    }
+
+
+def _admin_query(filters, **extra):
+    """Query string for the staff list with ``filters`` and ``extra``."""
+    params = {
+        "q": filters["q"],
+        "category": filters["category_id"] or "",
+        "active": filters["active_param"],
+        **extra,
+    }
+    return urlencode({k: v for k, v in params.items() if v not in ("", None)})
+
+
+@login_required
+@user_passes_test(_is_staff_user)
+def admin_product_list(request):
+    """
+    Admin-facing list of products, 50 to a page, with search, filters,
+    sortable columns, thumbnail, links to edit/delete and bulk actions.
+    """
+    products, filters = _admin_products(request.GET)
+
+    sort = request.GET.get("sort") or "name"
+    if sort not in ADMIN_SORTS:
+        sort = "name"
+    ordering = ADMIN_SORTS[sort]
+    tie = "-id" if ordering.startswith("-") else "id"
+    paginator = CountCachingPaginator(
+        products.select_related("category").order_by(ordering, tie),
+        ADMIN_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get("page"))
+
+    # Each sortable header links to its ascending order, or descending
+    # when it is already the ascending sort
+    sort_links = {}
+    for column in ("name", "price", "created", "updated"):
+        target = f"-{column}" if sort == column else column
+        sort_links[column] = {
+            "url": "?" + _admin_query(filters, sort=target),
+            "arrow": (
+                "▲" if sort == column
+                else "▼" if sort == f"-{column}" else ""),
+        }
+
+    categories = catalog_cache.get_or_set(
+        catalog_cache.CATEGORIES, "admin", lambda: list(
+            Category.objects.filter(is_active=True).order_by("name")))
 
     return render(request, 'products/admin/product_admin_list.html', {
-        'products': products,
+        'page_obj': page_obj,
+        'products': page_obj.object_list,
         'categories': categories,
-        'q': q,
-        'category_id': category_id,
-        'active_param': active_param,
+        'sort': sort,
+        'sort_links': sort_links,
+        'page_query': _admin_query(filters, sort=sort),
+        'current_query': _admin_query(
+            filters, sort=sort, page=page_obj.number),
+        'bulk_actions': bulk.ACTIONS,
+        **filters,
+    })
+
+
+@login_required
+@user_passes_test(_is_staff_user)
+@require_POST
+def product_bulk_action(request):
+    """
+    Apply a bulk action to the ticked products, or to every product
+    matching the list's filters, as a single UPDATE. Staff/superusers
+    only.
+    """
+    back = (
+        reverse("products:admin_product_list")
+        + "?" + request.POST.get("return_query", ""))
+    form = ProductBulkActionForm(request.POST)
+    if not form.is_valid():
+        for errors in form.errors.values():
+            messages.error(request, errors[0])
+        return redirect(back)
+
+    if form.cleaned_data["select_all"]:
+        products, _ = _admin_products(request.POST)
+    else:
+        ids = [
+            int(pk) for pk in request.POST.getlist("selected")
+            if pk.isdigit()
+        ]
+        if not ids:
+            messages.info(request, "No products were selected.")
+            return redirect(back)
+        products = Product.objects.filter(pk__in=ids)
+
+    action = form.cleaned_data["action"]
+    changed = bulk.apply(
+        products, action,
+        category=form.cleaned_data["target_category"],
+        percent=form.cleaned_data["percent"],
+    )
+    messages.success(
+        request,
+        f"{bulk.ACTIONS[action]}: {changed} "
+        f"product{'' if changed == 1 else 's'} updated.")
+    return redirect(back)
+
+
+@login_required
+@user_passes_test(_is_staff_user)
+def product_export(request):
+    """
+    Download the whole catalog as CSV or JSONL, streamed from the
+    database in chunks. Staff/superusers only.
+    """
+    fmt = request.GET.get("format")
+    if fmt not in transfer.FORMATS:
+        fmt = "csv"
+    response = StreamingHttpResponse(
+        transfer.export_lines(fmt),
+        content_type=(
+            "text/csv" if fmt == "csv" else "application/x-ndjson"),
+    )
+    response["Content-Disposition"] = (
+        f'attachment; filename="products.{fmt}"')
+    return response
+
+
+@login_required
+@user_passes_test(_is_staff_user)
+def product_import(request):
+    """
+    Create or update products from an uploaded CSV or JSONL file,
+    matched on SKU. Bad rows are listed; the rest are imported.
+    Staff/superusers only.
+    """
+    result = None
+    if request.method == "POST":
+        form = ProductImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            fmt = (
+                form.cleaned_data["format"]
+                or transfer.format_for(upload.name))
+            text = io.TextIOWrapper(
+                upload.file, encoding="utf-8-sig", newline="")
+            result = transfer.import_products(transfer.read_rows(text, fmt))
+            if result.error_count:
+                messages.warning(request, f"Import finished: {result}.")
+            else:
+                messages.success(request, f"Import finished: {result}.")
+    else:
+        form = ProductImportForm()
+
+    return render(request, "products/admin/product_import.html", {
+        "form": form,
+        "result": result,
     })
 
 
@@ -0,0 +1,61 @@
+"""
+Synthetic users with profiles, for the generate_dataset command (see
+products.seeding).
+"""
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from products.seeding import bulk_insert
+from .models import UserProfile
+
+FIRST_NAMES = [
+    "Ana", "Ben", "Chloe", "Dev", "Ema", "Finn", "Grace", "Hugo", "Isla",
+    "Jan", "Katja", "Leo", "Maja", "Noah", "Olivia", "Petra", "Rhys",
+    "Sara", "Tom", "Una",
+]
+
+LAST_NAMES = [
+    "Novak", "Smith", "Horvat", "Jones", "Kovac", "Taylor", "Zupan",
+    "Brown", "Krajnc", "Evans", "Potocnik", "Wilson", "Mlakar", "Hughes",
+]
+
+CITIES = [
+    ("London", "SW1A 1AA"), ("Leeds", "LS1 4DY"), ("Bristol", "BS1 5TR"),
+    ("Cardiff", "CF10 1EP"), ("Glasgow", "G1 1XQ"), ("York", "YO1 7HH"),
+]
+
+
+def seed_users(total, batch_size=5_000, seed=42, prefix="bench",
+               password="seeded"):
+    """
+    ``total`` users, all with ``password`` (hashed once; hashing per user
+    would take longer than the inserts), each with a filled-in profile.
+    Returns the user ids.
+    """
+    rng = random.Random(f"{seed}:users")
+    hashed = make_password(password)
+    names = [
+        (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        for _ in range(total)
+    ]
+    user_ids = bulk_insert(User, (
+        User(
+            username=f"{prefix}-user-{i}", first_name=first, last_name=last,
+            email=f"{prefix}-user-{i}@example.com", password=hashed)
+        for i, (first, last) in enumerate(names)
+    ), batch_size)
+
+    def profiles():
+        for i, user_id in enumerate(user_ids):
+            city, postcode = rng.choice(CITIES)
+            yield UserProfile(
+                user_id=user_id, full_name=" ".join(names[i]),
+                email=f"{prefix}-user-{i}@example.com",
+                phone_number=f"07700 {rng.randint(0, 999999):06d}",
+                address1=f"{rng.randint(1, 200)} High Street",
+                city=city, postcode=postcode, country="GB")
+
+    bulk_insert(UserProfile, profiles(), batch_size)
+    return user_ids
@@ -0,0 +1,40 @@
+(function () {
+  // Polls the order-status endpoint until the order exists, then
+  // moves on to the success page. The server decides when to fall
+  // back to creating the order itself, so we just keep asking.
+  const el = document.getElementById("finalising");
+  if (!el) return;
+
+  const statusUrl = el.dataset.statusUrl;
+  const baseInterval = parseInt(el.dataset.interval, 10) || 1000;
+  const maxInterval = 5000;
+  let interval = baseInterval;
+
+  function poll() {
+    fetch(statusUrl, {
+      headers: { Accept: "application/json" },
+      credentials: "same-origin",
+    })
+      .then(function (res) {
+        return res.json();
+      })
+      .then(function (data) {
+        if (data.status === "ready" && data.redirect) {
+          window.location.assign(data.redirect);
+          return;
+        }
+        if (data.status === "unknown") {
+          window.location.reload();
+          return;
+        }
+        setTimeout(poll, interval);
+      })
+      .catch(function () {
+        // Network hiccup: back off a little and try again
+        interval = Math.min(interval * 2, maxInterval);
+        setTimeout(poll, interval);
+      });
+  }
+
+  setTimeout(poll, interval);
+})();